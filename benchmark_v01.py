@@ -0,0 +1,402 @@
+import os
+import sys
+import time
+import datetime
+import json
+import zipfile
+import shutil
+import statistics
+import platform
+import subprocess
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.transform import from_origin
+import open_source_template_v01 as template
+
+# BENCHMARK SUITE
+BENCHMARK_SIZE = 2048  # Width and height (pixels) of the 10m bands of the synthetic Sentinel-2 product
+BENCHMARK_BAND_FORMAT = "gtiff"  # Format of the synthetic bands: "gtiff" (fast to generate) or "jp2" (JPEG2000)
+BENCHMARK_NODATA_FRACTION = 0.3  # Fraction of each synthetic band which is nodata (swath edge)
+BENCHMARK_SEED = 1  # Seed of the synthetic pixel values, the same seed results in the same rasters
+BENCHMARK_MIN_TIME = 2.0  # Benchmarks are repeated until they took atleast this many seconds, reduces noise
+BENCHMARK_HISTORY = "benchmark_history.json"  # History of the results, stored in the output folder
+REGRESSION_THRESHOLD = 0.1  # A throughput lower than the recent median by more than this fraction is a regression
+REGRESSION_RUNS = 5  # Number of recent runs (with the same configuration) used for the median
+
+# Code run by "run_startup_benchmarks" in a new interpreter, arguments: settings, product and warm product (JSON)
+# Prints the durations of the first product (including the import) and of the second product and the peak memory
+STARTUP_CODE = """
+import sys
+import time
+import json
+start_time = time.time()
+import open_source_template_v01 as template
+template.set_settings(json.loads(sys.argv[1]))
+template.VERBOSE = False
+template.s2_process_product(*json.loads(sys.argv[2]))
+cold_duration = time.time() - start_time
+start_time = time.time()
+template.s2_process_product(*json.loads(sys.argv[3]))
+print(json.dumps([cold_duration, time.time() - start_time, template.get_peak_memory()]))
+"""
+
+# Sentinel-2 bands of the synthetic product: resolution (m): band names
+S2_SYNTHETIC_BANDS = {10: ["B02", "B03", "B04", "B08"], 20: ["B05", "B06", "B07", "B8A", "B11", "B12"],
+                      60: ["B01", "B09"]}
+
+
+# Gets the size (MB) of a raster, including its additional files (e.g. external overviews)
+def get_raster_size(raster):
+    raster_size = 0
+    for extension in ["", ".ovr", ".aux.xml"]:
+        if os.path.exists(raster + extension):
+            raster_size = raster_size + os.path.getsize(raster + extension)
+
+    return raster_size / 1024.0 / 1024.0
+
+
+# Reads all bands of a raster window by window (internal blocks), returns the number of MB read
+def read_raster(raster):
+    read_size = 0
+    with rasterio.open(raster) as raster_obj:
+        for ij, window in raster_obj.block_windows(1):
+            read_size = read_size + raster_obj.read(window=window).nbytes
+
+    return read_size / 1024.0 / 1024.0
+
+
+# Benchmarks the output profiles (see "OUTPUT_PROFILES") by copying the input raster with each profile
+# Reports the size, write throughput and read throughput (MB/s, uncompressed pixel data) of each profile
+# Returns a list of [profile, size, write MB/s, read MB/s]
+def benchmark_output_profiles(input_raster, output_folder):
+    template.create_output_folder(output_folder)
+    template.CACHE_DIR = output_folder + "cache/"
+
+    list_results = []
+    for profile in template.OUTPUT_PROFILES:
+        template.OUTPUT_PROFILE = profile
+        output_raster = output_folder + "benchmark_" + profile + ".tif"
+
+        start_time = time.time()
+        template.copy_raster(input_raster, output_raster, True)
+        write_time = time.time() - start_time
+
+        start_time = time.time()
+        read_size = read_raster(output_raster)
+        read_time = time.time() - start_time
+
+        output_size = get_raster_size(output_raster)
+        list_results.append([profile, output_size, read_size / write_time, read_size / read_time])
+        template.write_message("Profile: " + profile + ", size: " + str(round(output_size, 1)) + " MB, write: " +
+                               str(round(read_size / write_time, 1)) + " MB/s, read: " +
+                               str(round(read_size / read_time, 1)) + " MB/s")
+
+    return list_results
+
+
+# Creates a synthetic raster, written window by window so that large rasters can be created
+# Values are a smooth gradient with noise (compresses like real imagery). The left nodata_fraction of the raster is
+# nodata (0), like the swath edge of a Sentinel-2 tile. The same seed results in the same raster
+def create_synthetic_raster(output_raster, width, height, band_count, dtype="uint16", resolution=10,
+                            nodata_fraction=0.0, seed=BENCHMARK_SEED):
+    random_generator = np.random.default_rng(seed)
+    nodata_width = int(width * nodata_fraction)
+    with rasterio.open(output_raster, 'w', driver='GTiff', width=width, height=height, count=band_count,
+                       dtype=dtype, crs=template.get_crs("utm34s"), nodata=0, tiled=True, blockxsize=512,
+                       blockysize=512, transform=from_origin(600000, 7000000, resolution, resolution)) as raster_obj:
+        for ij, window in raster_obj.block_windows(1):
+            rows, cols = np.mgrid[window.row_off:window.row_off + window.height,
+                                  window.col_off:window.col_off + window.width]
+            for band in range(1, band_count + 1):
+                data = (1000 + band * 100 + (rows + cols) % 2000 +
+                        random_generator.integers(0, 50, size=rows.shape)).astype(dtype)
+                data[cols < nodata_width] = 0
+                raster_obj.write(data, band, window=window)
+
+
+# Creates a synthetic Sentinel-2 L2A product (SAFE folder with a metadata file and the bands of S2_SYNTHETIC_BANDS)
+# size: Width and height of the 10m bands. band_format: "gtiff" or "jp2" (bands are named *.jp2 in both cases)
+# BENCHMARK_SIZE and BENCHMARK_BAND_FORMAT are used if not provided
+# The product is also zipped (stored, like downloaded products)
+# Returns the zip file, the metadata file and the raw folder (SAFE folder)
+def create_synthetic_s2_product(output_folder, size=None, band_format=None):
+    if size is None:
+        size = BENCHMARK_SIZE
+    if band_format is None:
+        band_format = BENCHMARK_BAND_FORMAT
+    product_name = "S2A_MSIL2A_20200105T075311_N0213_R135_T34JBL_20200105T101613"
+    raw_folder = output_folder + product_name + ".SAFE/"
+    granule_folder = "GRANULE/L2A_T34JBL_A023491_20200105T080246/IMG_DATA/"
+
+    list_image_files = []
+    band_number = 1
+    for resolution, list_band_names in S2_SYNTHETIC_BANDS.items():
+        template.create_output_folder(raw_folder + granule_folder + "R" + str(resolution) + "m/")
+        band_size = size * 10 // resolution
+        for band_name in list_band_names:
+            image_file = (granule_folder + "R" + str(resolution) + "m/T34JBL_20200105T075311_" + band_name + "_" +
+                          str(resolution) + "m")
+            band_raster = raw_folder + image_file + ".jp2"
+            if band_format == "jp2":  # The JPEG2000 driver can only copy rasters, a temporary Geotiff is written first
+                temp_raster = raw_folder + image_file + ".tif"
+                create_synthetic_raster(temp_raster, band_size, band_size, 1, resolution=resolution,
+                                        nodata_fraction=BENCHMARK_NODATA_FRACTION, seed=BENCHMARK_SEED + band_number)
+                rasterio.shutil.copy(temp_raster, band_raster, driver="JP2OpenJPEG", QUALITY=100, REVERSIBLE="YES")
+                template.delete_raster(temp_raster)
+            else:
+                create_synthetic_raster(band_raster, band_size, band_size, 1, resolution=resolution,
+                                        nodata_fraction=BENCHMARK_NODATA_FRACTION, seed=BENCHMARK_SEED + band_number)
+            list_image_files.append(image_file)
+            band_number = band_number + 1
+
+    metadata = raw_folder + "MTD_MSIL2A.xml"
+    with open(metadata, "w") as metadata_file:
+        metadata_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                            '<n1:Level-2A_User_Product xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/'
+                            'User_Product_Level-2A.xsd">\n<n1:General_Info>\n<Product_Info>\n'
+                            '<PRODUCT_START_TIME>2020-01-05T07:53:11.024Z</PRODUCT_START_TIME>\n'
+                            '<PRODUCT_URI>' + product_name + '.SAFE</PRODUCT_URI>\n'
+                            '<PROCESSING_LEVEL>Level-2A</PROCESSING_LEVEL>\n<PRODUCT_TYPE>S2MSI2A</PRODUCT_TYPE>\n'
+                            '<Product_Organisation>\n<Granule_List>\n<Granule imageFormat="JPEG2000">\n'
+                            '<IMAGE_FILE_LIST>\n')
+        for image_file in list_image_files:
+            metadata_file.write("<IMAGE_FILE>" + image_file + "</IMAGE_FILE>\n")
+        metadata_file.write('</IMAGE_FILE_LIST>\n</Granule>\n</Granule_List>\n</Product_Organisation>\n'
+                            '</Product_Info>\n</n1:General_Info>\n<n1:Quality_Indicators_Info>\n'
+                            '<Cloud_Coverage_Assessment>12.5</Cloud_Coverage_Assessment>\n<Image_Content_QI>\n'
+                            '<NODATA_PIXEL_PERCENTAGE>' + str(BENCHMARK_NODATA_FRACTION * 100) +
+                            '</NODATA_PIXEL_PERCENTAGE>\n<CLOUDY_PIXEL_PERCENTAGE>10.2</CLOUDY_PIXEL_PERCENTAGE>\n'
+                            '</Image_Content_QI>\n</n1:Quality_Indicators_Info>\n</n1:Level-2A_User_Product>\n')
+
+    zip_file = output_folder + product_name + ".zip"
+    with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_STORED) as zip_obj:
+        for folder, list_folders, list_files in os.walk(raw_folder):
+            for filename in list_files:
+                file_path = os.path.join(folder, filename)
+                zip_obj.write(file_path, os.path.relpath(file_path, output_folder))
+
+    return zip_file, metadata, raw_folder
+
+
+# Runs a function of the template module until it took atleast min_time seconds, used as the worker of "run_benchmark"
+# The clean folder (e.g. an extraction folder) is deleted before each run (not timed). Messages are not printed
+# Returns the duration (seconds) of a single run, the number of runs and the peak memory (MB) of the worker process
+def run_benchmark_task(function_name, list_args, min_time, clean_folder):
+    template.VERBOSE = False
+    runs = 0
+    duration = 0
+    while runs == 0 or duration < min_time:
+        if clean_folder != "":
+            shutil.rmtree(clean_folder, ignore_errors=True)
+
+        start_time = time.time()
+        getattr(template, function_name)(*list_args)
+        duration = duration + time.time() - start_time
+        runs = runs + 1
+    duration = duration / runs
+
+    return duration, runs, template.get_peak_memory()
+
+
+# Runs a benchmark in a new worker process, so that the peak memory (RSS) only includes this benchmark
+# pixels: Number of pixels processed, size: Number of MB processed (uncompressed pixels, or the file size)
+# clean_folder: Optional folder which is deleted before each run, see "run_benchmark_task"
+# Returns a result: {"seconds" (a single run), "runs", "mp_s" (megapixels per second), "mb_s", "peak_rss" (MB)}
+def run_benchmark(name, function_name, list_args, pixels, size, clean_folder=""):
+    with template.get_process_pool(1) as executor:
+        duration, runs, peak_memory = executor.submit(run_benchmark_task, function_name, list_args,
+                                                      BENCHMARK_MIN_TIME, clean_folder).result()
+
+    return get_benchmark_result(name, duration, runs, pixels, size, peak_memory)
+
+
+# Creates the result of a benchmark and prints it, see "run_benchmark"
+# Latency benchmarks (no pixels or MB processed) have a throughput of 0
+def get_benchmark_result(name, duration, runs, pixels, size, peak_memory):
+    result = {"seconds": duration, "runs": runs, "mp_s": pixels / 1000000.0 / duration, "mb_s": size / duration,
+              "peak_rss": peak_memory}
+    message = "Benchmark: " + name + ", " + str(round(duration, 2)) + " s"
+    if size > 0:
+        message = message + ", " + str(round(result["mp_s"], 1)) + " MP/s, " + str(round(result["mb_s"], 1)) + " MB/s"
+    if peak_memory is not None:
+        message = message + ", peak memory: " + str(round(peak_memory)) + " MB"
+    template.write_message(message)
+
+    return result
+
+
+# Runs the startup benchmarks in new interpreters (the worker processes of "run_benchmark" import this module first)
+# startup: Start of the interpreter and import of the template module (GDAL, rasterio and NumPy are imported lazily)
+# product_cold: First product processed by a new process ("s2_process_product"), including the import of the
+# template module and the start of GDAL and PROJ
+# product_warm: Next product (another copy) processed by the same process, like a worker does (see "run_worker")
+# product_args, warm_product_args: Arguments of "s2_process_product". pixels, size: Pixels and MB of a product
+# Returns the results of the three benchmarks, see "run_benchmark"
+def run_startup_benchmarks(product_args, warm_product_args, pixels, size):
+    environment = dict(os.environ)
+    list_paths = [os.path.dirname(os.path.abspath(template.__file__))]
+    if environment.get("PYTHONPATH", "") != "":
+        list_paths.append(environment["PYTHONPATH"])
+    environment["PYTHONPATH"] = os.pathsep.join(list_paths)
+
+    startup_duration = 0
+    startup_runs = 0
+    while startup_runs == 0 or startup_duration < BENCHMARK_MIN_TIME:
+        start_time = time.time()
+        subprocess.run([sys.executable, "-c", "import open_source_template_v01"], env=environment, check=True)
+        startup_duration = startup_duration + time.time() - start_time
+        startup_runs = startup_runs + 1
+
+    list_product_args = [sys.executable, "-c", STARTUP_CODE, json.dumps(template.get_settings()),
+                         json.dumps(product_args), json.dumps(warm_product_args)]
+    cold_duration = 0
+    warm_duration = 0
+    product_runs = 0
+    peak_memory = None
+    while product_runs == 0 or cold_duration + warm_duration < BENCHMARK_MIN_TIME:
+        output = subprocess.run(list_product_args, env=environment, check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        list_durations = json.loads(output.splitlines()[-1])
+        cold_duration = cold_duration + list_durations[0]
+        warm_duration = warm_duration + list_durations[1]
+        peak_memory = list_durations[2]
+        product_runs = product_runs + 1
+
+    return (get_benchmark_result("startup", startup_duration / startup_runs, startup_runs, 0, 0, None),
+            get_benchmark_result("product (cold)", cold_duration / product_runs, product_runs, pixels, size,
+                                 peak_memory),
+            get_benchmark_result("product (warm)", warm_duration / product_runs, product_runs, pixels, size,
+                                 peak_memory))
+
+
+# Gets the size (MB) of the uncompressed pixels of a raster and its number of pixels (all bands)
+def get_pixel_size(raster):
+    with rasterio.open(raster) as raster_obj:
+        pixels = raster_obj.width * raster_obj.height * raster_obj.count
+        return pixels * np.dtype(raster_obj.dtypes[0]).itemsize / 1024.0 / 1024.0, pixels
+
+
+# Runs the benchmark suite on a synthetic Sentinel-2 product in the output folder
+# Benchmarks: metadata parser, unzip_files, stack_rasters, restack_bands, copy_raster, project_raster and the
+# startup latency (see "run_startup_benchmarks")
+# Each benchmark runs in its own worker process (or interpreter) with the current settings of the template module
+# The results are added to the history (BENCHMARK_HISTORY) and compared to the recent runs, see "check_regressions"
+# size: Width and height of the 10m bands, BENCHMARK_SIZE is used if not provided
+# Returns the history entry of this run
+def run_benchmark_suite(output_folder, size=None):
+    if size is None:
+        size = BENCHMARK_SIZE
+    template.create_output_folder(output_folder)
+    product_folder = output_folder + "product/"
+    shutil.rmtree(product_folder, ignore_errors=True)
+    template.create_output_folder(product_folder)
+    template.CACHE_DIR = output_folder + "cache/"
+    template.OVERWRITE = True  # Results are always computed
+
+    template.write_message("Creating synthetic Sentinel-2 product (" + str(size) + " x " + str(size) + ")...")
+    zip_file, metadata, raw_folder = create_synthetic_s2_product(product_folder, size)
+    list_10m_bands = template.s2_get_raster_stack_bands(template.read_raster_sentinel2_metadata(
+        metadata, raw_folder)[3], "L2A")[0]
+    stack_raster = product_folder + "stack.tif"
+    band_size, band_pixels = get_pixel_size(list_10m_bands[0])
+    zip_size = os.path.getsize(zip_file) / 1024.0 / 1024.0
+    metadata_size = os.path.getsize(metadata) / 1024.0 / 1024.0
+
+    results = {}
+    results["parse_sentinel2_metadata"] = run_benchmark("metadata", "parse_sentinel2_metadata", [metadata], 0,
+                                                        metadata_size)
+    results["unzip_files"] = run_benchmark("unzip", "unzip_files", [[zip_file], product_folder + "unzip/"], 0,
+                                           zip_size, product_folder + "unzip/")
+    results["stack_rasters"] = run_benchmark("stack", "stack_rasters", [list_10m_bands, stack_raster],
+                                             band_pixels * len(list_10m_bands), band_size * len(list_10m_bands))
+    stack_size, stack_pixels = get_pixel_size(stack_raster)
+    results["restack_bands"] = run_benchmark("restack", "restack_bands",
+                                             [stack_raster, product_folder + "restack.tif", [3, 2, 1]],
+                                             stack_pixels * 3 // 4, stack_size * 3 / 4)
+    results["copy_raster"] = run_benchmark("copy", "copy_raster", [stack_raster, product_folder + "copy.tif", True],
+                                           stack_pixels, stack_size)
+    results["project_raster"] = run_benchmark("project", "project_raster",
+                                              [stack_raster, product_folder + "project.tif", "bilinear", "lo19"],
+                                              stack_pixels, stack_size)
+    warm_raw_folder = product_folder + "warm/" + os.path.basename(os.path.normpath(raw_folder)) + "/"
+    shutil.copytree(raw_folder, warm_raw_folder)
+    product_args = [metadata, raw_folder, "L2A", product_folder + "product_cold.tif", "bilinear", "lo19", ["10m"]]
+    warm_product_args = [warm_raw_folder + os.path.basename(metadata), warm_raw_folder, "L2A",
+                         product_folder + "product_warm.tif", "bilinear", "lo19", ["10m"]]
+    results["startup"], results["product_cold"], results["product_warm"] = run_startup_benchmarks(
+        product_args, warm_product_args, band_pixels * len(list_10m_bands), band_size * len(list_10m_bands))
+
+    entry = {"date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+             "config": {"size": size, "band_format": BENCHMARK_BAND_FORMAT,
+                        "nodata_fraction": BENCHMARK_NODATA_FRACTION, "output_profile": template.OUTPUT_PROFILE,
+                        "streaming": template.STREAMING, "pipeline_threads": template.PIPELINE_THREADS,
+                        "sparse_blocks": template.SPARSE_BLOCKS, "max_memory": template.MAX_MEMORY},
+             "versions": {"python": platform.python_version(), "rasterio": rasterio.__version__,
+                          "gdal": rasterio.__gdal_version__, "numpy": np.__version__},
+             "results": results}
+    history = read_history(output_folder + BENCHMARK_HISTORY)
+    entry["regressions"] = check_regressions(history, entry)
+    history.append(entry)
+    with open(output_folder + BENCHMARK_HISTORY, "w") as history_file:
+        json.dump(history, history_file, indent=1)
+
+    return entry
+
+
+# Reads the benchmark history (list of runs), an empty history is returned if the file does not exist
+def read_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+
+    with open(history_file) as history_obj:
+        return json.load(history_obj)
+
+
+# Compares the results of a run to the median of the recent runs (REGRESSION_RUNS) with the same configuration
+# Versions are not compared, so that a GDAL/rasterio upgrade shows up as a regression
+# A benchmark is a regression if its throughput (MB/s) is lower than the median by more than REGRESSION_THRESHOLD
+# Latency benchmarks (throughput of 0, e.g. startup) are a regression if they are slower by more than the threshold
+# Returns the list of regressions: [benchmark, MB/s, median MB/s], or [benchmark, seconds, median seconds]
+def check_regressions(history, entry):
+    list_previous = [previous for previous in history if previous["config"] == entry["config"]][-REGRESSION_RUNS:]
+    list_regressions = []
+    if len(list_previous) == 0:
+        return list_regressions
+
+    for name, result in entry["results"].items():
+        list_throughputs = [previous["results"][name]["mb_s"] for previous in list_previous
+                            if name in previous["results"]]
+        if len(list_throughputs) == 0:
+            continue
+
+        if result["mb_s"] == 0:  # Latency benchmark
+            median_duration = statistics.median([previous["results"][name]["seconds"] for previous in list_previous
+                                                 if name in previous["results"]])
+            if result["seconds"] > median_duration * (1 + REGRESSION_THRESHOLD):
+                list_regressions.append([name, result["seconds"], median_duration])
+                template.write_message("REGRESSION: " + name + " " + str(round(result["seconds"], 2)) + " s, median " +
+                                       str(round(median_duration, 2)) + " s")
+            continue
+
+        median_throughput = statistics.median(list_throughputs)
+        if result["mb_s"] < median_throughput * (1 - REGRESSION_THRESHOLD):
+            list_regressions.append([name, result["mb_s"], median_throughput])
+            template.write_message("REGRESSION: " + name + " " + str(round(result["mb_s"], 1)) + " MB/s, median " +
+                                   str(round(median_throughput, 1)) + " MB/s")
+
+    return list_regressions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "suite":
+        if len(sys.argv) == 4:
+            run_benchmark_suite(sys.argv[2], int(sys.argv[3]))
+        else:
+            run_benchmark_suite(sys.argv[2])
+    elif len(sys.argv) == 3:
+        benchmark_output_profiles(sys.argv[1], sys.argv[2])
+    else:
+        print("Usage: python benchmark_v01.py input_raster output_folder/")
+        print("       python benchmark_v01.py suite output_folder/ [size]")
@@ -2,14 +2,55 @@ import os
 import sys
 import time
 import datetime
-import gdal
-import rasterio
 import zipfile
+import io
 import ntpath
 import csv
-
-from rasterio.warp import reproject, Resampling, calculate_default_transform
-from rasterio import Affine
+import xml.etree.ElementTree as ElementTree
+import hashlib
+import shutil
+import sqlite3
+import concurrent.futures
+import multiprocessing
+import threading
+import collections
+import contextlib
+import ast
+import functools
+import json
+import importlib.util
+import types
+
+
+# Imports a module when one of its attributes is first used (importlib LazyLoader)
+# GDAL, rasterio and NumPy take most of the startup time, they are only imported once a function uses them
+# Submodules (e.g. rasterio.warp) which are not imported by their package are imported by the functions using them
+# A module which is not installed only raises the ImportError once one of its attributes is used, e.g. GDAL is only
+# needed by the VRT functions
+def import_lazy(module_name):
+    if sys.modules.get(module_name) is not None:
+        return sys.modules[module_name]
+
+    module_spec = importlib.util.find_spec(module_name)
+    if module_spec is None:  # Not installed (or blocked with None in sys.modules)
+        def raise_import_error(attribute_name):
+            raise ImportError("No module named " + module_name + ", " + module_name + "." + attribute_name +
+                              " is not available")
+
+        module = types.ModuleType(module_name)
+        module.__getattr__ = raise_import_error
+        return module
+    module_spec.loader = importlib.util.LazyLoader(module_spec.loader)
+    module = importlib.util.module_from_spec(module_spec)
+    sys.modules[module_name] = module
+    module_spec.loader.exec_module(module)
+
+    return module
+
+
+gdal = import_lazy("gdal")
+rasterio = import_lazy("rasterio")
+np = import_lazy("numpy")
 
 # GLOBAL DIRECTORIES
 INPUT_DIR = ""
@@ -32,16 +73,265 @@ SPATIAL_RES = 10  # If a does not consist of this spatial resolution, it is resa
 RESAMPLING = "nearest"  # "nearest", "bilinear" or "cubic". Used for resampling and/or projecting
 
 FORMAT = 'Gtiff'  # Will add more formats at a later stage
-OVERWRITE = False  # "True": existing output files will be deleted. "False": If the file exists, it is skipped
-
-
-# Prints a message. Adds the time and date to the string
+OVERWRITE = False  # "True": results are always recomputed. "False": cached results are used if nothing changed
+CACHE_DIR = ""  # Folder of the result cache, see "get_cache_folder" for the folder used if not provided
+CACHE_MAX_SIZE = 50000  # Maximum size (MB) of the result cache, the least recently used results are evicted
+CACHE_MAX_AGE = 30  # Maximum age (days) of unused results in the result cache
+SCAN_THREADS = 8  # Number of threads used to list folders when searching for files
+# SQLite catalog (e.g. "catalog.sqlite") of the searched files, repeat searches only list changed folders, and of the
+# written rasters with their band statistics, see "record_raster" and "query_catalog"
+CATALOG = ""
+METADATA_PROCESSES = 4  # Number of processes used to parse metadata files, see "read_sentinel2_metadata_batch"
+# Sentinel-2 quality indicators read from the metadata files
+METADATA_QUALITY_FIELDS = ["NODATA_PIXEL_PERCENTAGE", "CLOUDY_PIXEL_PERCENTAGE", "SNOW_ICE_PERCENTAGE",
+                           "DEGRADED_MSI_DATA_PERCENTAGE", "DEGRADED_ANC_DATA_PERCENTAGE"]
+UNZIP = False  # "True": zip files are extracted before processing. "False": rasters are read directly from zip files
+
+# Output profile of the written Geotiff rasters, see OUTPUT_PROFILES
+# "default" (striped and uncompressed, tiled if SPARSE_BLOCKS is enabled), "tiled", "deflate", "zstd", "lzw" or "cog"
+# (cloud-optimized Geotiff)
+OUTPUT_PROFILE = "default"
+OUTPUT_PROFILES = {
+    "default": {},
+    "tiled": {"tiled": True, "blockxsize": 512, "blockysize": 512, "bigtiff": "IF_SAFER"},
+    "deflate": {"tiled": True, "blockxsize": 512, "blockysize": 512, "bigtiff": "IF_SAFER", "compress": "deflate",
+                "predictor": True},
+    "zstd": {"tiled": True, "blockxsize": 512, "blockysize": 512, "bigtiff": "IF_SAFER", "compress": "zstd",
+             "predictor": True},
+    "lzw": {"tiled": True, "blockxsize": 512, "blockysize": 512, "bigtiff": "IF_SAFER", "compress": "lzw",
+            "predictor": True},
+    "cog": {"tiled": True, "blockxsize": 512, "blockysize": 512, "bigtiff": "IF_SAFER", "compress": "deflate",
+            "predictor": True, "cog": True}
+}
+OVERVIEWS = []  # Overview levels built for the written rasters, e.g. [2, 4, 8, 16]. Always built for "cog"
+
+# Band math expressions of spectral indices, see "calculate_index". Sentinel-2 band names or b1, b2, ... (band numbers)
+INDEX_EXPRESSIONS = {
+    "ndvi": "(B08 - B04) / (B08 + B04)",
+    "ndwi": "(B03 - B08) / (B03 + B08)",
+    "ndmi": "(B8A - B11) / (B8A + B11)",
+    "ndbi": "(B11 - B08) / (B11 + B08)"
+}
+INDEX_FUNCTIONS = ["sqrt", "abs", "log", "exp", "minimum", "maximum"]  # NumPy functions allowed in band math
+
+STREAMING = True  # "True": rasters are read and written window by window. "False": complete bands are read at once
+MAX_MEMORY = 256  # Memory ceiling (MB) for the pixel data held at once while streaming
+MAX_OPEN_RASTERS = 64  # Maximum number of unused rasters kept open for reuse, see "open_raster"
+PIPELINE_THREADS = 4  # Number of threads reading (decoding/warping) windows while other windows are written, 0: disabled
+PIPELINE_DEPTH = 4  # Maximum number of windows read ahead of the writer, bounds the memory used by the pipeline
+SPARSE_BLOCKS = True  # "True": windows which only contain nodata are not computed or written, Geotiff blocks stay empty
+
+PROJECT_THREADS = 4  # Number of threads used by the GDAL warper for each projected raster
+PROJECT_PROCESSES = 1  # Number of rasters projected at the same time by "project_rasters"
+WARP_MEMORY = 256  # Working memory (MB) of the GDAL warper for each projected raster
+
+BATCH_PROCESSES = 2  # Number of jobs of a batch run at the same time, see "run_batch"
+# Pixel data (MB) written between checkpoints of streamed Geotiff outputs, interrupted outputs are resumed. 0: disabled
+# See "open_output_raster", enabled for batches (1024 MB) unless the manifest sets it
+CHECKPOINT_INTERVAL = 0
+WORKER_POLL_INTERVAL = 5  # Seconds between polls of the job queue and input folders of an idle worker, see "run_worker"
+
+VERBOSE = True  # "True": messages are printed, see "write_message"
+TRACE = False  # "True": timed spans, counters and peak memory are recorded, see "trace_span" and "write_trace"
+
+# TRACE
+TRACE_EVENTS = []  # Recorded spans and messages (Chrome trace events), see "trace_span"
+TRACE_COUNTERS = collections.Counter()  # Bytes read/written, pixels processed and dataset opens, see "trace_count"
+TRACE_LOCK = threading.Lock()
+
+# CACHES
+TRANSFORM_CACHE = {}  # Default transforms, computed once for each source grid and coordinate system pair
+ZIP_CACHE = {}  # Contents of zip files, key: (zip file, modified time)
+CRS_CACHE = {}  # Parsed coordinate systems, see "get_crs"
+HANDLE_CACHE = collections.OrderedDict()  # Open rasters, least recently used first, see "open_raster"
+HANDLE_CACHE_LOCK = threading.Lock()
+RASTER_INFO_CACHE = {}  # Raster properties, see "get_raster_info"
+SOURCE_WINDOWS_CACHE = {}  # Source windows of warped rasters for each grid pair, see "get_source_windows"
+STATISTICS_CACHE = {}  # Band statistics of the written temporary rasters until they are recorded, see "stream_bands"
+
+
+# Prints a message if VERBOSE is enabled. Adds the time and date to the string
+# If TRACE is enabled, the message is also recorded in the trace
 def write_message(message):
     time_sec = time.time()
-    timestamp = datetime.datetime.fromtimestamp(time_sec).strftime('%Y-%m-%d %H:%M:%S')
-    message = "[" + str(timestamp) + "] " + str(message)
+    if TRACE:
+        record_trace_event({"name": str(message), "ph": "i", "s": "t", "ts": time_sec * 1000000.0})
+
+    if VERBOSE:
+        timestamp = datetime.datetime.fromtimestamp(time_sec).strftime('%Y-%m-%d %H:%M:%S')
+        message = "[" + str(timestamp) + "] " + str(message)
+
+        print(message)
+
+
+# Gets the peak memory (resident set size, MB) of this process, None if it is not available (e.g. Windows)
+def get_peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # Bytes on macOS, kilobytes on Linux
+        return peak_memory / 1024.0 / 1024.0
+    return peak_memory / 1024.0
+
+
+# Adds an event to the trace, the process and thread are added
+def record_trace_event(event):
+    event["pid"] = os.getpid()
+    event["tid"] = threading.get_ident()
+    with TRACE_LOCK:
+        TRACE_EVENTS.append(event)
+
+
+# Records a timed span, see "trace_span"
+@contextlib.contextmanager
+def record_span(name, args):
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        end_time = time.time()
+        if args is None:
+            args = {}
+        args["peak_memory"] = get_peak_memory()
+        record_trace_event({"name": name, "ph": "X", "ts": start_time * 1000000.0,
+                            "dur": (end_time - start_time) * 1000000.0, "args": args})
+
+
+# Times a function or stage, use as "with trace_span("name"):". args: Optional dict shown with the span
+# Spans are only recorded if TRACE is enabled, otherwise an empty context is returned (almost no cost)
+def trace_span(name, args=None):
+    if not TRACE:
+        return contextlib.nullcontext()
+
+    return record_span(name, args)
+
+
+# Decorator which records a span for each call of the function if TRACE is enabled, see "trace_span"
+# The first argument (e.g. the input raster) is shown with the span
+def trace_function(function):
+    @functools.wraps(function)
+    def traced_function(*args, **kwargs):
+        if not TRACE:
+            return function(*args, **kwargs)
+
+        span_args = {}
+        if len(args) > 0 and isinstance(args[0], str):
+            span_args["input"] = args[0]
+        with record_span(function.__name__, span_args):
+            return function(*args, **kwargs)
+
+    return traced_function
+
+
+# Adds the value to a trace counter, e.g. "bytes_read", "bytes_written", "pixels" or "opens"
+# Counters are only recorded if TRACE is enabled
+def trace_count(name, value):
+    if TRACE:
+        with TRACE_LOCK:
+            TRACE_COUNTERS[name] = TRACE_COUNTERS[name] + value
+
+
+# Clears the recorded trace
+def reset_trace():
+    with TRACE_LOCK:
+        del TRACE_EVENTS[:]
+        TRACE_COUNTERS.clear()
+
+
+# Runs a function in a worker process (see "get_process_pool") and takes the trace recorded while it ran
+# The trace of the worker is cleared, the next function run by the worker starts a new trace
+# Returns the result of the function, the trace events and the counters, see "merge_trace"
+def run_traced(function, *args):
+    result = function(*args)
+    with TRACE_LOCK:
+        list_events = list(TRACE_EVENTS)
+        counters = dict(TRACE_COUNTERS)
+        del TRACE_EVENTS[:]
+        TRACE_COUNTERS.clear()
+
+    return result, list_events, counters
+
+
+# Adds the trace taken from a worker process (see "run_traced") to the trace of this process
+# The events keep the process id of the worker. Returns the result of the function
+def merge_trace(traced_result):
+    result, list_events, counters = traced_result
+    with TRACE_LOCK:
+        TRACE_EVENTS.extend(list_events)
+        TRACE_COUNTERS.update(counters)
+
+    return result
+
+
+# Gets a summary of the recorded trace: the count, total and maximum duration (seconds) of the spans of each name,
+# the counters and the peak memory (MB, the largest of this process and the merged worker processes)
+def get_trace_summary():
+    with TRACE_LOCK:
+        list_events = list(TRACE_EVENTS)
+        counters = dict(TRACE_COUNTERS)
+
+    spans = {}
+    peak_memory = get_peak_memory()
+    for event in list_events:
+        if event["ph"] == "X":
+            span = spans.setdefault(event["name"], {"count": 0, "total": 0.0, "max": 0.0})
+            span["count"] = span["count"] + 1
+            span["total"] = span["total"] + event["dur"] / 1000000.0
+            span["max"] = max(span["max"], event["dur"] / 1000000.0)
+            if peak_memory is not None and event["args"].get("peak_memory") is not None:
+                peak_memory = max(peak_memory, event["args"]["peak_memory"])
+
+    return {"spans": spans, "counters": counters, "peak_memory": peak_memory}
+
+
+# Writes the recorded trace to a file
+# trace_format: "chrome" (Chrome trace format, open in chrome://tracing or Perfetto) or "json" (see "get_trace_summary")
+def write_trace(output_trace, trace_format="chrome"):
+    if trace_format == "chrome":
+        with TRACE_LOCK:
+            list_events = list(TRACE_EVENTS)
+            counters = dict(TRACE_COUNTERS)
+        if len(list_events) > 0:  # The counters are shown at the end of the trace
+            list_events.append({"name": "counters", "ph": "C", "ts": max([event["ts"] for event in list_events]),
+                                "pid": os.getpid(), "tid": threading.get_ident(), "args": counters})
+        trace = {"traceEvents": list_events, "displayTimeUnit": "ms"}
+    elif trace_format == "json":
+        trace = get_trace_summary()
+    else:
+        write_message("ERROR: Unknown trace format: " + str(trace_format))
+        return
+
+    with open(output_trace, "w") as trace_file:
+        json.dump(trace, trace_file, indent=1)
+
 
-    print(message)
+# Gets the current settings, the upper case global variables (caches, locks and the recorded trace excluded)
+# Used to pass the settings to worker processes
+def get_settings():
+    settings = {}
+    for name, value in globals().items():
+        if (name.isupper() and not name.endswith("_CACHE") and not name.endswith("_LOCK")
+                and not name.startswith("TRACE_")):
+            settings[name] = value
+
+    return settings
+
+
+# Applies the provided settings to the global variables of this process, see "get_settings"
+def set_settings(settings):
+    globals().update(settings)
+
+
+# Creates a pool of worker processes which uses the settings of this process
+# Workers are spawned instead of forked, forking after GDAL has started its threads can deadlock the workers
+# Functions are run with "run_traced", their trace is merged into the trace of this process (see "merge_trace")
+def get_process_pool(processes):
+    return concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                  mp_context=multiprocessing.get_context("spawn"),
+                                                  initializer=set_settings, initargs=(get_settings(),))
 
 
 # Checks whether a file extension is supported/allowed
@@ -57,6 +347,7 @@ def check_extension(cur_file, list_extensions):
 
 
 # Unzips a list of zip files
+@trace_function
 def unzip_files(list_zip_files, extract_dir):
     for zip_file in list_zip_files:
         zip_ref = zipfile.ZipFile(zip_file)  # ZipeFile object
@@ -64,23 +355,202 @@ def unzip_files(list_zip_files, extract_dir):
         extraction_folder = extract_dir + list_zip_contents[0]  # The first folder of the zip file
 
         if not os.path.exists(extraction_folder):  # If the extracted folder exists, skip
-            writeMessage("Extracting zip file: " + zip_file)
+            write_message("Extracting zip file: " + zip_file)
             zip_ref.extractall(extract_dir)
 
 
-# Searches for zip files
-# Recursive
-def search_files(cur_dir):
-    list_contents = os.listdir(cur_dir)
+# Gets the GDAL virtual path (/vsizip/) of a file inside a zip file
+# The file can be read by GDAL and rasterio without extracting the zip file
+def get_vsizip_path(zip_file, zip_member):
+    return "/vsizip/" + zip_file + "/" + zip_member
+
 
-    for content in list_contents:
-        content_dir = cur_dir + content
-        if os.path.isdir(content_dir):  # Subfolder found
-            search_files(content_dir + "/")
-        elif checkExtension(content, ["tif", "img"]):  # Zip file found
-            writeMessage("Example")
-        elif content.endswith(".zip"):  # Zip file found
-            writeMessage("Example")
+# Splits a GDAL virtual path (/vsizip/) into the zip file and the file inside the zip file
+def split_vsizip_path(vsizip_path):
+    zip_path = vsizip_path.replace("/vsizip/", "", 1)
+    split_index = zip_path.lower().index(".zip/") + len(".zip")
+
+    return zip_path[:split_index], zip_path[split_index + 1:]
+
+
+# Lists the contents of a zip file
+# The contents are only read once for each zip file, see ZIP_CACHE
+def get_zip_contents(zip_file):
+    key = (zip_file, os.path.getmtime(zip_file))
+    if key not in ZIP_CACHE:
+        with zipfile.ZipFile(zip_file) as zip_ref:
+            ZIP_CACHE[key] = set(zip_ref.namelist())
+
+    return ZIP_CACHE[key]
+
+
+# Checks whether a file exists
+# Also works with files inside zip files (/vsizip/ paths)
+def file_exists(file_path):
+    if file_path.startswith("/vsizip/"):
+        zip_file, zip_member = split_vsizip_path(file_path)
+        return os.path.exists(zip_file) and zip_member in get_zip_contents(zip_file)
+    else:
+        return os.path.exists(file_path)
+
+
+# Opens a text file for reading
+# Also works with files inside zip files (/vsizip/ paths), which are read without extracting the zip file
+def open_text_file(file_path):
+    if file_path.startswith("/vsizip/"):
+        zip_file, zip_member = split_vsizip_path(file_path)
+        zip_ref = zipfile.ZipFile(zip_file)
+        return io.TextIOWrapper(zip_ref.open(zip_member), encoding="utf-8")
+    else:
+        return open(file_path)
+
+
+# Sentinel-2: Gets the metadata file and the raw folder (SAFE folder) of a zipped product
+# If UNZIP is enabled, the zip file is extracted to the extract folder and the extracted files are used
+# Otherwise the files are read directly from the zip file using /vsizip/ paths
+# Returns "" for the metadata if it is not found in the zip file
+def s2_get_zip_metadata(zip_file, extract_dir):
+    metadata = ""
+    raw_folder = ""
+
+    for zip_member in sorted(get_zip_contents(zip_file)):
+        list_split_member = zip_member.split("/")
+        # The metadata file, e.g. "MTD_MSIL2A.xml", is located in the SAFE folder
+        if len(list_split_member) == 2 and list_split_member[1].startswith("MTD_MSIL"):
+            if UNZIP:
+                unzip_files([zip_file], extract_dir)
+                raw_folder = extract_dir + list_split_member[0] + "/"
+            else:
+                raw_folder = get_vsizip_path(zip_file, list_split_member[0] + "/")
+            metadata = raw_folder + list_split_member[1]
+
+    if metadata == "":
+        write_message("ERROR: Sentinel-2 metadata not found in zip file: " + zip_file)
+
+    return metadata, raw_folder
+
+
+# Lists the contents of a single folder, used by "scan_files"
+# If the modified time of the folder equals the catalog modified time, the folder is not listed (None is returned)
+# A folder which cannot be listed (e.g. no permission, or removed during the scan) is reported and has no entries, the
+# rest of the scan continues. Its modified time is None, the folder is listed again by the next scan
+# Returns the folder, its modified time and a list of [path, name, is_folder, size, modified time] entries
+def scan_folder(folder, catalog_mtime):
+    try:
+        folder_mtime = os.stat(folder).st_mtime_ns
+        if folder_mtime == catalog_mtime:  # Unchanged since the previous scan, the catalog contents are used
+            return folder, folder_mtime, None
+
+        list_entries = []
+        with os.scandir(folder) as folder_entries:
+            for entry in folder_entries:
+                if entry.is_dir(follow_symlinks=False):
+                    list_entries.append([entry.path, entry.name, True, 0, 0])
+                    continue
+                try:
+                    entry_stat = entry.stat()
+                except FileNotFoundError:  # Removed during the scan, or a broken link
+                    continue
+                list_entries.append([entry.path, entry.name, False, entry_stat.st_size, entry_stat.st_mtime_ns])
+    except OSError as error:
+        write_message("ERROR: Folder cannot be scanned: " + folder + " (" + str(error) + ")")
+        return folder, None, []
+
+    return folder, folder_mtime, list_entries
+
+
+# Opens the SQLite file catalog, the tables are created if they do not exist
+# folders: Scanned folders and their modified time. files: Contents of the folders
+# rasters: Written rasters (see "record_raster"). band_statistics: Min, max, mean and valid pixels of each raster band
+# The catalog can be written by several processes, a writer waits until the catalog is not locked
+def open_catalog(catalog):
+    catalog_conn = sqlite3.connect(catalog, timeout=60)
+    catalog_conn.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime INTEGER)")
+    catalog_conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT, name TEXT, "
+                         "is_folder INTEGER, size INTEGER, mtime INTEGER)")
+    catalog_conn.execute("CREATE INDEX IF NOT EXISTS files_folder ON files (folder)")
+    catalog_conn.execute("CREATE TABLE IF NOT EXISTS rasters (path TEXT PRIMARY KEY, sensor TEXT, date TEXT, "
+                         "tile TEXT, bands TEXT, spatial_res REAL, projection TEXT, width INTEGER, height INTEGER, "
+                         "dtype TEXT, size INTEGER, mtime INTEGER)")
+    catalog_conn.execute("CREATE INDEX IF NOT EXISTS rasters_tile_date ON rasters (tile, date)")
+    catalog_conn.execute("CREATE INDEX IF NOT EXISTS rasters_date ON rasters (date)")
+    catalog_conn.execute("CREATE TABLE IF NOT EXISTS band_statistics (path TEXT, band INTEGER, name TEXT, "
+                         "min REAL, max REAL, mean REAL, valid_count INTEGER, PRIMARY KEY (path, band))")
+
+    return catalog_conn
+
+
+# Scans a folder recursively for rasters, zip files and Sentinel-2 metadata files
+# Folders are listed concurrently by SCAN_THREADS threads
+# If a CATALOG is provided, the folder contents are stored in the catalog. Repeat scans only list the folders
+# which changed since the previous scan, the contents of the other folders are read from the catalog
+# verbose: False for repeated scans (e.g. the polls of a worker), the summary of the scan is not printed
+# Returns {"rasters": [...], "zips": [...], "metadata": [...]}, each a list of [path, size, modified time]
+@trace_function
+def scan_files(cur_dir, list_raster_extensions=("tif", "img"), verbose=True):
+    dict_folder_mtimes = {}
+    dict_folder_entries = {}
+    if CATALOG != "":  # Reads the previous scan from the catalog
+        catalog_conn = open_catalog(CATALOG)
+        for path, mtime in catalog_conn.execute("SELECT path, mtime FROM folders"):
+            dict_folder_mtimes[path] = mtime
+        for path, folder, name, is_folder, size, mtime in catalog_conn.execute("SELECT * FROM files"):
+            dict_folder_entries.setdefault(folder, []).append([path, name, bool(is_folder), size, mtime])
+
+    dict_files = {"rasters": [], "zips": [], "metadata": []}
+    list_changed_folders = []
+    list_scanned_folders = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SCAN_THREADS) as executor:
+        root_folder = os.path.normpath(cur_dir)
+        pending = {executor.submit(scan_folder, root_folder, dict_folder_mtimes.get(root_folder))}
+        while len(pending) > 0:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                folder, folder_mtime, list_entries = future.result()
+                list_scanned_folders.append(folder)
+                if list_entries is None:  # Unchanged folder
+                    list_entries = dict_folder_entries.get(folder, [])
+                else:
+                    list_changed_folders.append([folder, folder_mtime, list_entries])
+
+                for path, name, is_folder, size, mtime in list_entries:
+                    if is_folder:  # Subfolder found
+                        pending.add(executor.submit(scan_folder, path, dict_folder_mtimes.get(path)))
+                    elif check_extension(name, list_raster_extensions):  # Raster found
+                        dict_files["rasters"].append([path, size, mtime])
+                    elif name.endswith(".zip"):  # Zip file found
+                        dict_files["zips"].append([path, size, mtime])
+                    elif name.startswith("MTD_MSIL") and name.endswith(".xml"):  # Sentinel-2 metadata found
+                        dict_files["metadata"].append([path, size, mtime])
+
+    if CATALOG != "":  # Updates the catalog with the changed folders, removed folders are deleted
+        with catalog_conn:
+            for folder, folder_mtime, list_entries in list_changed_folders:
+                catalog_conn.execute("DELETE FROM files WHERE folder = ?", (folder,))
+                catalog_conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (folder, folder_mtime))
+                for path, name, is_folder, size, mtime in list_entries:
+                    catalog_conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                         (path, folder, name, int(is_folder), size, mtime))
+
+            set_scanned_folders = set(list_scanned_folders)
+            for folder in dict_folder_mtimes:
+                if folder not in set_scanned_folders and folder.startswith(root_folder + os.sep):
+                    catalog_conn.execute("DELETE FROM files WHERE folder = ?", (folder,))
+                    catalog_conn.execute("DELETE FROM folders WHERE path = ?", (folder,))
+        catalog_conn.close()
+
+    if verbose:
+        write_message("Scanned " + str(len(list_scanned_folders)) + " folders (" + str(len(list_changed_folders)) +
+                      " changed): " + str(len(dict_files["rasters"])) + " rasters, " + str(len(dict_files["zips"])) +
+                      " zip files, " + str(len(dict_files["metadata"])) + " metadata files")
+
+    return dict_files
+
+
+# Searches for rasters, zip files and Sentinel-2 metadata files
+# Recursive, see "scan_files"
+def search_files(cur_dir):
+    return scan_files(cur_dir)
 
 
 # Removes unwanted characters from a string, such as spaces, tabs and newlines
@@ -92,74 +562,1080 @@ def remove_unwanted_txt(string):
     return string
 
 
+# Sentinel-2: Parses a metadata file (MTD XML) using a streaming XML parser
+# Elements are discarded once they are read, tags spanning multiple lines are supported
+# Returns a record (dict) with the product info, cloud cover, quality indicators (see METADATA_QUALITY_FIELDS) and the
+# band directories relative to the SAFE folder. Fields which are not found are left empty ("" or None)
+# A metadata file which cannot be read or parsed does not raise, the record then has an "error"
+def parse_sentinel2_metadata(metadata):
+    metadata_record = {"metadata": metadata, "product_uri": "", "sensor": "", "date": "", "tile": "",
+                       "processing_level": "", "product_type": "", "cloud_cover": None, "image_files": [],
+                       "error": ""}
+    for field in METADATA_QUALITY_FIELDS:
+        metadata_record[field.lower()] = None
+
+    try:
+        with open_text_file(metadata) as metadata_file:
+            for event, element in ElementTree.iterparse(metadata_file):
+                tag = element.tag.rsplit("}", 1)[-1]  # Removes the namespace
+                text = remove_unwanted_txt(element.text or "")
+                if tag == "PRODUCT_URI":
+                    metadata_record["product_uri"] = text
+                    list_split_uri = text.replace(".SAFE", "").split("_")
+                    if len(list_split_uri) > 5:
+                        metadata_record["sensor"] = list_split_uri[0]
+                        metadata_record["date"] = (list_split_uri[2])[:8]
+                        metadata_record["tile"] = (list_split_uri[5])[1:]
+                elif tag == "PROCESSING_LEVEL":
+                    metadata_record["processing_level"] = text
+                elif tag == "PRODUCT_TYPE":
+                    metadata_record["product_type"] = text
+                elif tag == "Cloud_Coverage_Assessment":
+                    metadata_record["cloud_cover"] = float(text)
+                elif tag in METADATA_QUALITY_FIELDS:
+                    metadata_record[tag.lower()] = float(text)
+                elif tag == "IMAGE_FILE":  # Band directories
+                    metadata_record["image_files"].append(text)
+
+                if len(element) == 0:  # Leaf element is read, it is cleared to keep memory usage low
+                    element.clear()
+    except (ElementTree.ParseError, ValueError) as error:  # Invalid XML or value
+        metadata_record["error"] = str(error)
+        write_message("ERROR: Metadata " + metadata + " could not be parsed: " + str(error))
+    except (OSError, KeyError, zipfile.BadZipFile) as error:  # Missing or unreadable file, or missing zip member
+        metadata_record["error"] = type(error).__name__ + ": " + str(error)
+        write_message("ERROR: Metadata " + metadata + " could not be read: " + metadata_record["error"])
+
+    return metadata_record
+
+
+# Sentinel-2: Parses a list of metadata files (MTD XML) using a pool of METADATA_PROCESSES processes
+# See "parse_sentinel2_metadata" for the fields of the records
+# columnar: "True": Returns a table, {field: [value of each product], ...}. "False": Returns a list of records
+@trace_function
+def read_sentinel2_metadata_batch(list_metadata, columnar=False):
+    write_message("Parsing " + str(len(list_metadata)) + " metadata files using " + str(METADATA_PROCESSES) +
+                  " processes...")
+
+    chunk_size = max(1, len(list_metadata) // (METADATA_PROCESSES * 4))  # Many small files, sent in chunks
+    with get_process_pool(METADATA_PROCESSES) as executor:
+        list_records = []
+        for traced_result in executor.map(functools.partial(run_traced, parse_sentinel2_metadata), list_metadata,
+                                          chunksize=chunk_size):
+            list_records.append(merge_trace(traced_result))
+
+    if columnar:
+        metadata_table = {}
+        for metadata_record in list_records:
+            for field in metadata_record:
+                metadata_table.setdefault(field, []).append(metadata_record[field])
+        return metadata_table
+
+    return list_records
+
+
 # Reads raw sensor band directories from the metadata
 # Currently only works with Sentinel-2 metadata, will update as more sensors will be added
+# Metadata inside a zip file can be read, see "s2_get_zip_metadata"
 def read_raster_sentinel2_metadata(metadata, raw_folder):
     sensor = ""
     date = ""
     tile = ""
     list_rasters = []
 
-    if os.path.exists(metadata):
-        metadata_file = open(metadata)
-        list_lines = metadata_file.readlines()
-        for file_line in list_lines:
-            if "<PRODUCT_URI>" in file_line:
-                product_info = (remove_unwanted_txt(file_line)
-                                .replace("<PRODUCT_URI>", "")).replace(".SAFE</PRODUCT_URI>", "")
-                list_split_line = product_info.split("_")
-                sensor = list_split_line[0]
-                date = (list_split_line[2])[:8]
-                tile = (list_split_line[5])[1:]
-            if "<IMAGE_FILE>" in file_line:  # Band directories
-                raster_dir = raw_folder + (remove_unwanted_txt(file_line)
-                                           .replace("<IMAGE_FILE>", "")).replace("</IMAGE_FILE>", ".jp2")
-                list_rasters.append(raster_dir)
+    if file_exists(metadata):
+        metadata_record = parse_sentinel2_metadata(metadata)
+        sensor = metadata_record["sensor"]
+        date = metadata_record["date"]
+        tile = metadata_record["tile"]
+        for image_file in metadata_record["image_files"]:  # Band directories
+            list_rasters.append(raw_folder + image_file + ".jp2")
     else:
-        writeMessage("ERROR: Metadata " + metadata + " does not exist!")
+        write_message("ERROR: Metadata " + metadata + " does not exist!")
 
     return sensor, date, tile, list_rasters
 
 
-# Gets the raster bit-depth/dtype, e.g. float, 16bit unsigned
+# Closes the least recently used rasters which are not in use until at most MAX_OPEN_RASTERS are open
+# HANDLE_CACHE_LOCK has to be acquired by the caller
+def evict_handles():
+    list_keys = list(HANDLE_CACHE.keys())
+    for key in list_keys:
+        if len(HANDLE_CACHE) <= MAX_OPEN_RASTERS:
+            break
+        raster_obj, users = HANDLE_CACHE[key]
+        if users == 0:
+            raster_obj.close()
+            del HANDLE_CACHE[key]
+
+
+# Opens a raster for reading through the shared raster pool, use as "with open_raster(raster) as raster_obj:"
+# Rasters are kept open for reuse and closed when more than MAX_OPEN_RASTERS are open (least recently used first)
+# Each thread gets its own raster object, raster objects can not be used by multiple threads at the same time
+# A raster which changed on disk (size or modified time) is opened again
+@contextlib.contextmanager
+def open_raster(raster):
+    key = (raster, tuple(get_file_identity(raster)), threading.get_ident())
+    with HANDLE_CACHE_LOCK:
+        entry = HANDLE_CACHE.get(key)
+        if entry is not None:  # Already open
+            HANDLE_CACHE.move_to_end(key)
+            entry[1] = entry[1] + 1
+
+    if entry is None:  # Opened outside the lock, other threads do not have to wait
+        entry = [rasterio.open(raster), 1]  # [raster object, number of users]
+        trace_count("opens", 1)
+        with HANDLE_CACHE_LOCK:
+            HANDLE_CACHE[key] = entry
+            evict_handles()
+
+    try:
+        yield entry[0]
+    finally:
+        with HANDLE_CACHE_LOCK:
+            entry[1] = entry[1] - 1
+            evict_handles()
+
+
+# Gets the properties of a raster: dtype, width, height, count, crs, transform, bounds, res, nodata and block_shape
+# The properties are read once and cached until the raster changes on disk, see RASTER_INFO_CACHE
+def get_raster_info(raster):
+    key = (raster, tuple(get_file_identity(raster)))
+    if key not in RASTER_INFO_CACHE:
+        with open_raster(raster) as raster_obj:
+            RASTER_INFO_CACHE[key] = {"dtype": raster_obj.dtypes[0], "width": raster_obj.width,
+                                      "height": raster_obj.height, "count": raster_obj.count, "crs": raster_obj.crs,
+                                      "transform": raster_obj.transform, "bounds": raster_obj.bounds,
+                                      "res": raster_obj.res, "nodata": raster_obj.nodata,
+                                      "block_shape": raster_obj.block_shapes[0]}
+
+    return RASTER_INFO_CACHE[key]
+
+
+# Clears the caches (see CACHES) and closes the open rasters which are not in use
+# Used between the jobs of a long running process (see "run_worker"), the caches otherwise grow with each file
+def clear_caches():
+    with HANDLE_CACHE_LOCK:
+        for key in list(HANDLE_CACHE.keys()):
+            raster_obj, users = HANDLE_CACHE[key]
+            if users == 0:
+                raster_obj.close()
+                del HANDLE_CACHE[key]
+
+    for cache in [TRANSFORM_CACHE, ZIP_CACHE, CRS_CACHE, RASTER_INFO_CACHE, SOURCE_WINDOWS_CACHE, STATISTICS_CACHE]:
+        cache.clear()
+
+
+# Gets the raster bit-depth/dtype, e.g. float32, uint16
 def get_raster_dtype(raster):
-    raster_obj = gdal.Open(raster)
-    band_dtype = raster_obj.GetRasterBand(1).DataType
-    dtype_name = gdal.GetDataTypeName(band_dtype)
+    return get_raster_info(raster)["dtype"]
+
+
+# Gets the creation options of the output profile (OUTPUT_PROFILE) for a raster with the provided driver and dtype
+# Options are only used for Geotiff rasters. The predictor is chosen based on the dtype
+# Rasters are sparse if SPARSE_BLOCKS is enabled, unwritten blocks are read as nodata (or 0 without nodata)
+# Sparse rasters are tiled (512 by 512 blocks) unless the profile sets the blocks. Strips span the full width, empty
+# areas at the edges of the data (e.g. swath edges) would rarely fill a complete strip
+def get_output_options(driver, dtype):
+    output_options = {}
+    if driver.lower() != "gtiff":
+        return output_options
+
+    if SPARSE_BLOCKS:
+        output_options.update({"sparse_ok": True, "tiled": True, "blockxsize": 512, "blockysize": 512})
+
+    for option, value in OUTPUT_PROFILES[OUTPUT_PROFILE].items():
+        if option == "predictor":  # Horizontal differencing for integers, floating point predictor for floats
+            if np.issubdtype(np.dtype(dtype), np.floating):
+                output_options["predictor"] = 3
+            else:
+                output_options["predictor"] = 2
+        elif option != "cog":
+            output_options[option] = value
+
+    return output_options
+
+
+# Gets the overview levels of a raster, OVERVIEWS or (for "cog") halved until the raster fits in a single block
+def get_overview_levels(raster_obj):
+    if len(OVERVIEWS) > 0 or not OUTPUT_PROFILES[OUTPUT_PROFILE].get("cog", False):
+        return OVERVIEWS
+
+    list_levels = []
+    level = 2
+    block_size = OUTPUT_PROFILES[OUTPUT_PROFILE].get("blockxsize", 512)
+    while max(raster_obj.width, raster_obj.height) / float(level) > block_size / 2:
+        list_levels.append(level)
+        level = level * 2
+
+    return list_levels
+
+
+# Finishes a written Geotiff raster based on the output profile
+# Overviews are built (see OVERVIEWS) and "cog" rasters are rewritten with the overviews in front of the data
+@trace_function
+def finish_raster(raster):
+    import rasterio.shutil
+
+    is_cog = OUTPUT_PROFILES[OUTPUT_PROFILE].get("cog", False)
+    if len(OVERVIEWS) == 0 and not is_cog:  # Nothing to finish
+        return
+
+    with rasterio.open(raster, 'r+') as raster_obj:
+        list_levels = get_overview_levels(raster_obj)
+        output_options = get_output_options(raster_obj.driver, raster_obj.dtypes[0])
+        if len(list_levels) > 0:
+            raster_obj.build_overviews(list_levels, get_resampling(RESAMPLING.lower()))
+
+    if is_cog:  # Cloud-optimized layout
+        output_name, output_extension = os.path.splitext(raster)
+        cog_raster = output_name + ".cog" + output_extension
+        delete_raster(cog_raster)
+        rasterio.shutil.copy(raster, cog_raster, driver="GTiff", copy_src_overviews=True, **output_options)
+        delete_raster(raster)
+        os.replace(cog_raster, raster)
+
+
+# Gets the identity of a file: path, size and modified time
+# Files inside zip files (/vsizip/ paths) are identified by the zip file and the path inside the zip file
+def get_file_identity(file_path):
+    identity_path = file_path
+    if file_path.startswith("/vsizip/"):
+        identity_path = split_vsizip_path(file_path)[0]
+
+    file_stat = os.stat(identity_path)
+    return [os.path.abspath(identity_path), file_path, file_stat.st_size, file_stat.st_mtime_ns]
+
+
+# Gets the cache key of a result
+# The key is a hash of the operation, the identities of the input files and the parameters
+# A changed input file or parameter results in a different key, and therefore a recomputed result
+def get_cache_key(operation, list_inputs, list_params):
+    key_info = [operation, FORMAT, OUTPUT_PROFILE, OVERVIEWS]
+    for input_file in list_inputs:
+        key_info.append(get_file_identity(input_file))
+    key_info.append(list_params)
+
+    return hashlib.sha256(repr(key_info).encode("utf-8")).hexdigest()
+
+
+# Gets the folder of the result cache: CACHE_DIR, TEMP_LOC + "cache/" or the cache folder of the user
+# ($XDG_CACHE_HOME or ~/.cache) if neither is provided, results are not written to the working directory
+def get_cache_folder():
+    if CACHE_DIR != "":
+        return create_output_folder(CACHE_DIR)
+    elif TEMP_LOC != "":
+        return create_output_folder(TEMP_LOC + "cache/")
+    else:
+        user_cache_folder = os.environ.get("XDG_CACHE_HOME", "") or os.path.expanduser("~/.cache")
+        return create_output_folder(os.path.join(user_cache_folder, "open_source_template") + "/")
+
+
+# Gets the cached file of a result
+# Virtual rasters (VRT) are not cached, they can reference the source rasters relative to their own location
+def get_cached_file(cache_key, output):
+    if check_extension(output, ["vrt"]):
+        return ""
+
+    return get_cache_folder() + cache_key + os.path.splitext(output)[1]
+
+
+# Places the cached result of the key at the output location
+# The output is a copy of the cached result with the same modified time, see "copy_file"
+# Returns True if the result is cached, the output then does not have to be computed
+# Returns False if the result is not cached or overwrite is enabled
+def fetch_cached_result(cache_key, output, overwrite):
+    cached_file = get_cached_file(cache_key, output)
+    if overwrite or cached_file == "" or not os.path.exists(cached_file):
+        return False
+
+    mark_cache_used(cached_file)
+    # The output is the cached result if it has the same size and modified time
+    if not (os.path.exists(output) and get_file_identity(output)[2:] == get_file_identity(cached_file)[2:]):
+        write_message("Using cached result: " + ntpath.basename(output))
+        temp_output = get_temp_output(output)
+        copy_file(cached_file, temp_output)
+        delete_raster(output)
+        os.replace(temp_output, output)
+
+    if CATALOG != "" and check_extension(output, ["tif", "tiff", "img"]):  # Recorded unless the record is current
+        record_raster(output)
+
+    return True
+
+
+# Marks a cached result as recently used, see "evict_cache"
+# The modified time of the cached file is also the modified time of its outputs, it is part of the cache keys of the
+# following steps (see "get_file_identity") and is not changed. The time of use is the modified time of a marker file
+# (".used") instead
+def mark_cache_used(cached_file):
+    used_marker = cached_file + ".used"
+    with open(used_marker, "a"):
+        pass
+    os.utime(used_marker)
+
+
+# Gets the temporary file to which an output is written, the output only exists once it is complete
+# An existing (partial) temporary file is deleted, unless it is resumed from a checkpoint (see CHECKPOINT_INTERVAL)
+def get_temp_output(output):
+    output_name, output_extension = os.path.splitext(output)
+    temp_output = output_name + ".partial" + output_extension
+    if CHECKPOINT_INTERVAL <= 0 or not os.path.exists(temp_output + ".checkpoint"):
+        delete_raster(temp_output)
+
+    return temp_output
+
+
+# Reads the lines of a checkpoint file, see "open_output_raster"
+# A line which is not completely written (interrupted) is ignored
+def read_checkpoint(checkpoint_file):
+    if not os.path.exists(checkpoint_file):
+        return []
+
+    with open(checkpoint_file) as checkpoint:
+        content = checkpoint.read()
+    return content.split("\n")[:-1]
+
+
+# Appends a line to a checkpoint file, the line is written to disk before returning
+def write_checkpoint(checkpoint_file, line, new=False):
+    with open(checkpoint_file, "w" if new else "a") as checkpoint:
+        checkpoint.write(line + "\n")
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+
+# Opens a temporary output raster (see "get_temp_output") for writing, the keyword arguments of rasterio.open
+# If CHECKPOINT_INTERVAL is enabled, Geotiff outputs get a checkpoint file (".checkpoint") which records the windows
+# written by "stream_bands". The output of an interrupted run with the same arguments is opened for updating instead,
+# its written windows are kept. Checkpointed outputs are sparse, the blocks are not filled when the output is closed
+def open_output_raster(temp_raster, **kwargs):
+    if CHECKPOINT_INTERVAL <= 0 or kwargs.get("driver", "").lower() != "gtiff":
+        return rasterio.open(temp_raster, 'w', **kwargs)
+
+    kwargs["sparse_ok"] = True
+    checkpoint_file = temp_raster + ".checkpoint"
+    output_key = hashlib.sha256(repr(sorted(kwargs.items())).encode("utf-8")).hexdigest()
+    list_lines = read_checkpoint(checkpoint_file)
+    if list_lines and list_lines[0] == output_key and os.path.exists(temp_raster):
+        try:
+            raster_obj = rasterio.open(temp_raster, 'r+')
+            write_message("Resuming: " + temp_raster)
+            return raster_obj
+        except rasterio.errors.RasterioIOError:  # The interrupted output is unreadable and written again
+            pass
+
+    raster_obj = rasterio.open(temp_raster, 'w', **kwargs)
+    write_checkpoint(checkpoint_file, output_key, new=True)
+    return raster_obj
+
+
+# Copies a file to the new location and keeps its modified time, the copy has the same file identity (size and
+# modified time, see "get_file_identity"). Outputs and cached results are not linked, an output which is changed in
+# place does not change the cached result
+def copy_file(file_path, new_file_path):
+    shutil.copyfile(file_path, new_file_path)
+    file_stat = os.stat(file_path)
+    os.utime(new_file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+
+
+# Moves the completed temporary file to the output location and stores the result in the cache
+# The output is replaced at once, an output is therefore never partially written
+# Geotiff rasters are finished first, see "finish_raster". Written rasters are recorded in the CATALOG
+def store_result(cache_key, temp_output, output):
+    if check_extension(temp_output, ["tif", "tiff"]):
+        finish_raster(temp_output)
+
+    delete_raster(output)  # Deletes the previous output and its additional files
+    os.replace(temp_output, output)
+    if os.path.exists(temp_output + ".checkpoint"):  # The output is complete, see "open_output_raster"
+        os.remove(temp_output + ".checkpoint")
+    if CATALOG != "" and check_extension(output, ["tif", "tiff", "img"]):
+        record_raster(output, STATISTICS_CACHE.pop(temp_output, None))
+
+    cached_file = get_cached_file(cache_key, output)
+    if cached_file != "":
+        temp_cached_file = get_temp_output(cached_file)
+        copy_file(output, temp_cached_file)
+        os.replace(temp_cached_file, cached_file)
+
+        evict_cache()
+
+
+# Removes a result and its marker (see "mark_cache_used") from the cache
+def remove_cached_file(cached_file):
+    for file_path in [cached_file, cached_file + ".used"]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+# Removes results from the cache which are unused for longer than CACHE_MAX_AGE days
+# The least recently used results are removed until the cache is smaller than CACHE_MAX_SIZE
+# A result was last used when it was stored or fetched (the modified time of its ".used" marker)
+# Outputs of removed results are not affected
+@trace_function
+def evict_cache():
+    cache_folder = get_cache_folder()
+    min_time = time.time() - CACHE_MAX_AGE * 24 * 60 * 60
+
+    dict_used_times = {}
+    list_entries = []
+    for entry in os.scandir(cache_folder):
+        if entry.name.endswith(".used"):
+            dict_used_times[entry.path[:-len(".used")]] = entry.stat().st_mtime
+        else:
+            list_entries.append(entry)
+
+    list_cached = []
+    cache_size = 0
+    for entry in list_entries:
+        entry_stat = entry.stat()
+        used_time = max(entry_stat.st_mtime, dict_used_times.pop(entry.path, 0))
+        if used_time < min_time:  # Unused for too long
+            remove_cached_file(entry.path)
+        else:
+            list_cached.append([used_time, entry_stat.st_size, entry.path])
+            cache_size = cache_size + entry_stat.st_size
+    for cached_file in dict_used_times:  # Markers of removed results
+        remove_cached_file(cached_file)
+
+    list_cached.sort()  # Least recently used first
+    for used_time, size, cached_file in list_cached:
+        if cache_size <= CACHE_MAX_SIZE * 1024 * 1024:
+            break
+        remove_cached_file(cached_file)
+        cache_size = cache_size - size
+
+
+# Gets the windows used for streaming the provided output raster object
+# Windows follow the internal block (tile/strip) grid of the raster, whole blocks are grouped together
+# bands_in_memory: Number of band windows held in memory at once. Window size is limited by MAX_MEMORY
+# max_pixels: Optional maximum number of pixels of a window (atleast one block)
+def get_stream_windows(raster_obj, bands_in_memory, max_pixels=None):
+    block_height, block_width = raster_obj.block_shapes[0]
+    item_size = np.dtype(raster_obj.dtypes[0]).itemsize
+    max_bytes = MAX_MEMORY * 1024 * 1024
+    block_bytes = block_height * block_width * item_size * bands_in_memory
+
+    blocks_per_row = int(np.ceil(raster_obj.width / float(block_width)))
+    max_blocks = max(1, max_bytes // block_bytes)  # Atleast one block is read at a time
+    if max_pixels is not None:
+        max_blocks = min(max_blocks, max(1, max_pixels // (block_height * block_width)))
+    if max_blocks >= blocks_per_row:  # Full width windows, consisting of one or more rows of blocks
+        window_width = raster_obj.width
+        window_height = (max_blocks // blocks_per_row) * block_height
+    else:  # A row of blocks does not fit in memory, windows consists of a (square) group of blocks
+        window_rows = max(1, int(np.sqrt(max_blocks)))
+        window_width = (max_blocks // window_rows) * block_width
+        window_height = window_rows * block_height
+
+    list_windows = []
+    for row_off in range(0, raster_obj.height, window_height):
+        height = min(window_height, raster_obj.height - row_off)
+        for col_off in range(0, raster_obj.width, window_width):
+            width = min(window_width, raster_obj.width - col_off)
+            list_windows.append(rasterio.windows.Window(col_off, row_off, width, height))
+
+    return list_windows
+
+
+# Limits the GDAL block cache to MAX_MEMORY while streaming, the previous cache size is restored afterwards
+# The block cache is shared by the whole process. GDAL_CACHEMAX is in bytes, a nested rasterio environment does not
+# restore it when it ends
+@contextlib.contextmanager
+def limit_block_cache():
+    previous_cache_max = rasterio.env.get_gdal_config("GDAL_CACHEMAX")
+    try:
+        with rasterio.Env(GDAL_CACHEMAX=MAX_MEMORY * 1024 * 1024):
+            yield
+    finally:
+        rasterio.env.set_gdal_config("GDAL_CACHEMAX", previous_cache_max)
+
+
+# Runs the tasks through a read/write pipeline, reading the next tasks overlaps with writing the current task
+# read_function(task): Reads (decodes, warps, computes) a task, called by PIPELINE_THREADS threads
+# write_function(task, data): Writes the read data of a task, called by the calling thread in the order of the tasks
+# At most PIPELINE_DEPTH tasks are read ahead of the writer, readers wait for the writer when it falls behind
+# The pipeline is disabled if PIPELINE_THREADS is 0, each task is then read and written in turn
+# If TRACE is enabled, each read and write is recorded as a span, see "trace_function"
+def run_pipeline(list_tasks, read_function, write_function):
+    if TRACE:
+        read_function = trace_function(read_function)
+        write_function = trace_function(write_function)
+
+    if PIPELINE_THREADS < 1:
+        for task in list_tasks:
+            write_function(task, read_function(task))
+        return
+
+    read_queue = collections.deque()  # Tasks which are read or being read, in the order of the tasks
+    with concurrent.futures.ThreadPoolExecutor(PIPELINE_THREADS) as executor:
+        try:
+            for task in list_tasks:
+                read_queue.append([task, executor.submit(read_function, task)])
+                if len(read_queue) > PIPELINE_DEPTH:  # Back-pressure, waits for the oldest task and writes it
+                    read_task, future = read_queue.popleft()
+                    write_function(read_task, future.result())
+
+            while read_queue:
+                read_task, future = read_queue.popleft()
+                write_function(read_task, future.result())
+        finally:  # Tasks which are not started yet are cancelled if reading or writing failed
+            for read_task, future in read_queue:
+                future.cancel()
+
+
+# Gets the value of the pixels which are not written (nodata, or 0 if the raster object has no nodata value)
+def get_fill_value(raster_obj):
+    if raster_obj.nodata is None:
+        return 0
+
+    return raster_obj.nodata
+
+
+# Checks whether all values of the array equal the fill value, see "get_fill_value"
+def is_filled(data, fill_value):
+    if fill_value != fill_value:  # NaN nodata
+        return bool(np.isnan(data).all())
+
+    return bool((data == fill_value).all())
+
+
+# Gets the empty internal blocks of a sparse Geotiff raster, e.g. the swath edges of the rasters written by this module
+# Fast pre-scan, only the block index of the file is read and no pixels are decoded
+# Returns an array of the block rows and columns (True: the block is empty in all bands), None for other formats
+def get_empty_blocks(raster_obj):
+    if raster_obj.driver != "GTiff":
+        return None
+
+    block_height, block_width = raster_obj.block_shapes[0]
+    block_rows = int(np.ceil(raster_obj.height / float(block_height)))
+    block_cols = int(np.ceil(raster_obj.width / float(block_width)))
+    empty_blocks = np.ones((block_rows, block_cols), dtype=bool)
+    for band in range(1, raster_obj.count + 1):
+        for row in range(block_rows):
+            for col in range(block_cols):
+                if empty_blocks[row, col]:
+                    try:
+                        raster_obj.block_size(band, row, col)
+                        empty_blocks[row, col] = False
+                    except rasterio.errors.RasterBlockError:  # The block is not written
+                        pass
+
+    return empty_blocks
+
+
+# Gets the source raster windows covering the windows of a warped raster object (WarpedVRT)
+# Windows are extended by a few pixels for the resampling kernel. The points of all windows are transformed at once
+# The windows are only transformed once for each pair of grids (e.g. the bands of products of the same tile), see
+# SOURCE_WINDOWS_CACHE. None is returned for windows which could not be transformed
+def get_source_windows(warped_raster_obj, list_windows):
+    import rasterio.warp
+
+    source_obj = warped_raster_obj.src_dataset
+    key = (str(warped_raster_obj.crs), tuple(warped_raster_obj.transform), str(source_obj.crs),
+           tuple(source_obj.transform), tuple(window.flatten() for window in list_windows))
+    if key in SOURCE_WINDOWS_CACHE:
+        return SOURCE_WINDOWS_CACHE[key]
+
+    list_x = []
+    list_y = []
+    for window in list_windows:  # A grid of 5 by 5 points covering the edges of the window
+        left, bottom, right, top = rasterio.windows.bounds(window, warped_raster_obj.transform)
+        for x in np.linspace(left, right, 5):
+            for y in np.linspace(bottom, top, 5):
+                list_x.append(x)
+                list_y.append(y)
+
+    list_x, list_y = rasterio.warp.transform(warped_raster_obj.crs, source_obj.crs, list_x, list_y)
+    list_source_windows = []
+    for index in range(len(list_windows)):
+        window_x = list_x[index * 25:(index + 1) * 25]
+        window_y = list_y[index * 25:(index + 1) * 25]
+        if not (np.isfinite(window_x).all() and np.isfinite(window_y).all()):
+            list_source_windows.append(None)
+            continue
+
+        window = rasterio.windows.from_bounds(min(window_x), min(window_y), max(window_x), max(window_y),
+                                              transform=source_obj.transform)
+        list_source_windows.append(rasterio.windows.Window(window.col_off - 4, window.row_off - 4, window.width + 8,
+                                                           window.height + 8))
+    SOURCE_WINDOWS_CACHE[key] = list_source_windows
+
+    return list_source_windows
+
+
+# Checks whether a window of a raster object is empty, without reading it
+# The window is empty if it is outside the raster or only covers empty blocks (see "get_empty_blocks")
+def is_window_empty(raster_obj, window, empty_blocks):
+    if window is None:  # Unknown
+        return False
+
+    row_start = max(0, int(np.floor(window.row_off)))
+    col_start = max(0, int(np.floor(window.col_off)))
+    row_end = min(raster_obj.height, int(np.ceil(window.row_off + window.height)))
+    col_end = min(raster_obj.width, int(np.ceil(window.col_off + window.width)))
+    if row_start >= row_end or col_start >= col_end:  # Outside the raster
+        return True
+    if empty_blocks is None:
+        return False
+
+    block_height, block_width = raster_obj.block_shapes[0]
+    return bool(empty_blocks[row_start // block_height:(row_end - 1) // block_height + 1,
+                             col_start // block_width:(col_end - 1) // block_width + 1].all())
+
+
+# Gets the band variables of band math expressions for the provided list of single band rasters (e.g. a stack)
+# Returns {variable: band number}, the Sentinel-2 band names (see "s2_get_band_name") and b1, b2, ... for all bands
+def get_band_variables(list_bands):
+    band_variables = {}
+    band_number = 1
+    for band in list_bands:
+        band_variables["b" + str(band_number)] = band_number
+        band_name = s2_get_band_name(band)
+        if band_name != "":
+            band_variables[band_name] = band_number
+
+        band_number = band_number + 1
+
+    return band_variables
+
+
+# Compiles a band math expression, e.g. "(B08 - B04) / (B08 + B04)", or the name of an index (see INDEX_EXPRESSIONS)
+# Only numbers, band variables, arithmetic operators and INDEX_FUNCTIONS are allowed, otherwise a ValueError is raised
+# Returns the compiled expression and {variable: band number} of the used band variables
+def compile_expression(expression, band_variables):
+    expression = INDEX_EXPRESSIONS.get(expression.lower(), expression)
+    try:
+        expression_tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise ValueError("Invalid band math expression: " + expression)
+
+    allowed_nodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant, ast.Add,
+                     ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+    used_variables = {}
+    for node in ast.walk(expression_tree):
+        if not isinstance(node, allowed_nodes):
+            raise ValueError("Unsupported element (" + type(node).__name__ + ") in band math expression: " + expression)
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError("Unsupported constant in band math expression: " + expression)
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in INDEX_FUNCTIONS):
+            raise ValueError("Unsupported function in band math expression: " + expression)
+        if isinstance(node, ast.Name) and node.id not in INDEX_FUNCTIONS:
+            if node.id not in band_variables:
+                raise ValueError("Unknown band " + node.id + " in band math expression: " + expression)
+            used_variables[node.id] = band_variables[node.id]
+    if len(used_variables) == 0:
+        raise ValueError("No bands used in band math expression: " + expression)
+
+    return compile(expression_tree, "<expression>", "eval"), used_variables
+
+
+# Evaluates a compiled band math expression (see "compile_expression") on the windows of the used bands
+# dict_data: {variable: window of the band}, nodata_mask: Optional mask of the pixels which are nodata
+# Computed using vectorized NumPy on the window, the result is float32 and NaN where it is nodata or not defined
+def evaluate_expression(expression_code, dict_data, nodata_mask):
+    namespace = {}
+    for function in INDEX_FUNCTIONS:
+        namespace[function] = getattr(np, function)
+    for variable, data in dict_data.items():
+        namespace[variable] = data.astype(np.float32)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        result = eval(expression_code, {"__builtins__": {}}, namespace)
+    result = np.array(np.broadcast_to(result, nodata_mask.shape), dtype=np.float32)
+    result[~np.isfinite(result) | nodata_mask] = np.nan
+
+    return result
+
+
+# Gets the mask of the pixels of the windows (list of arrays) which are nodata in atleast one of the windows
+# No pixels are masked if the fill value is not a nodata value
+def get_nodata_mask(list_data, fill_value, is_nodata):
+    nodata_mask = np.zeros(list_data[0].shape, dtype=bool)
+    if is_nodata:
+        for data in list_data:
+            if fill_value != fill_value:  # NaN nodata
+                nodata_mask = nodata_mask | np.isnan(data)
+            else:
+                nodata_mask = nodata_mask | (data == fill_value)
+
+    return nodata_mask
+
+
+# Gets the statistics of each band of a window (array of bands, rows and columns): [min, max, sum, valid pixels]
+# Nodata and NaN pixels are not valid. Min and max are None if the band has no valid pixels in the window
+def get_window_statistics(data, fill_value, is_nodata):
+    list_statistics = []
+    for band_data in data:
+        valid_data = band_data[~get_nodata_mask([band_data], fill_value, is_nodata)]
+        if np.issubdtype(valid_data.dtype, np.floating):
+            valid_data = valid_data[~np.isnan(valid_data)]
+
+        if valid_data.size == 0:
+            list_statistics.append([None, None, 0.0, 0])
+        else:
+            list_statistics.append([valid_data.min().item(), valid_data.max().item(),
+                                    float(valid_data.sum(dtype=np.float64)), int(valid_data.size)])
+
+    return list_statistics
+
+
+# Adds the statistics of the bands of a window to the statistics of the bands of the raster, see "get_window_statistics"
+def add_statistics(list_statistics, list_window_statistics):
+    for statistics, window_statistics in zip(list_statistics, list_window_statistics):
+        if window_statistics[3] == 0:
+            continue
+
+        if statistics[3] == 0:
+            statistics[0] = window_statistics[0]
+            statistics[1] = window_statistics[1]
+        else:
+            statistics[0] = min(statistics[0], window_statistics[0])
+            statistics[1] = max(statistics[1], window_statistics[1])
+        statistics[2] = statistics[2] + window_statistics[2]
+        statistics[3] = statistics[3] + window_statistics[3]
+
+
+# Creates the temporary index rasters of the index outputs ({index raster: expression}) of an output raster object
+# The index rasters have the grid of the output raster object, float32 values and NaN as nodata
+# The index rasters are closed by the provided ExitStack, see "store_index_results"
+# Returns the list of [index raster, temporary raster, expression] and the list of indexes for "stream_bands"
+def create_index_rasters(raster_stack, output_raster_obj, index_outputs, band_variables):
+    list_index_jobs = []
+    list_indexes = []
+    for index_raster, expression in index_outputs.items():
+        expression_code, used_variables = compile_expression(expression, band_variables)
+        temp_raster = get_temp_output(index_raster)
+        index_raster_obj = raster_stack.enter_context(
+            open_output_raster(temp_raster, driver='Gtiff', width=output_raster_obj.width,
+                               height=output_raster_obj.height, count=1, crs=output_raster_obj.crs,
+                               transform=output_raster_obj.transform, dtype="float32", nodata=np.nan,
+                               **get_output_options('Gtiff', "float32")))
+
+        list_index_jobs.append([index_raster, temp_raster, expression])
+        list_indexes.append([index_raster_obj, expression_code, used_variables])
+
+    return list_index_jobs, list_indexes
+
+
+# Stores the index rasters written while writing the input raster (see "create_index_rasters") in the result cache
+# The results are cached as if they were calculated from the input raster, see "calculate_index"
+def store_index_results(list_index_jobs, input_raster, band_variables):
+    for index_raster, temp_raster, expression in list_index_jobs:
+        cache_key = get_cache_key("calculate_index", [input_raster],
+                                  [INDEX_EXPRESSIONS.get(expression.lower(), expression), sorted(band_variables.items())])
+        store_result(cache_key, temp_raster, index_raster)
+
+
+# Writes the source bands to the output raster object window by window
+# list_sources: [[raster_obj, band], [raster_obj, band], ...], the n-th source is written to band n of the output
+# Windows are read by the pipeline (see "run_pipeline") while the previous windows are compressed and written
+# A raster object is only read by one thread at a time, different raster objects are read at the same time
+# If SPARSE_BLOCKS is enabled, windows which only contain nodata are not written and stay empty (sparse Geotiff)
+# Windows of empty source areas are not read (see "is_window_empty"), other windows are checked after reading
+# The output is identical to writing complete bands. Warped sources are warped per window, values can differ slightly
+# from warping complete bands (approximated transformation)
+# list_indexes: Optional list of [index raster object, compiled expression, {variable: output band}], the band math
+# expressions are evaluated on the windows while they are written, see "create_index_rasters"
+# Outputs opened by "open_output_raster" are checkpointed every CHECKPOINT_INTERVAL MB: the outputs are closed (written
+# to disk) and reopened, and the number of written windows is added to their checkpoint files. The provided raster
+# objects are then closed. A resumed output (interrupted run) continues after its last checkpointed window
+# If a CATALOG is provided, the band statistics of the outputs are gathered by the reader threads and kept until the
+# outputs are recorded (see STATISTICS_CACHE and "record_raster"), the outputs are not read again
+def stream_bands(list_sources, output_raster_obj, list_indexes=()):
+    output_fill = get_fill_value(output_raster_obj)
+    skip_empty = SPARSE_BLOCKS and output_raster_obj.driver == "GTiff"
+    if len(list_indexes) > 0 and output_raster_obj.nodata is None:  # Empty windows are only nodata in the indexes
+        skip_empty = False
+
+    # The windows held by the pipeline are limited to MAX_MEMORY
+    # Smaller windows are used if empty windows are skipped, more windows at the edge of the data are then empty
+    max_pixels = None
+    if skip_empty:
+        max_pixels = 2048 * 2048
+    bands_in_memory = (len(list_sources) + 2 * len(list_indexes)) * (PIPELINE_DEPTH + 1)
+    list_windows = get_stream_windows(output_raster_obj, bands_in_memory, max_pixels)
+
+    # Groups the sources by raster object: [raster_obj, source bands, output bands]
+    # The location of each output band is kept as (group, band of the group)
+    list_groups = []
+    band_locations = {}
+    output_band = 1
+    for source in list_sources:
+        if list_groups and list_groups[-1][0] is source[0]:
+            list_groups[-1][1].append(source[1])
+            list_groups[-1][2].append(output_band)
+        else:
+            list_groups.append([source[0], [source[1]], [output_band]])
+        band_locations[output_band] = (len(list_groups) - 1, len(list_groups[-1][2]) - 1)
+
+        output_band = output_band + 1
+
+    # Adds the lock, the source raster (of warped rasters), its empty blocks and the source windows to each group
+    # Warped rasters (WarpedVRT) of the same raster share its lock, the raster can not be read by two threads at once
+    # Empty areas of a source can only be skipped if they are read as the nodata value of the output
+    raster_locks = {}
+    for group in list_groups:
+        raster_obj = getattr(group[0], "src_dataset", group[0])
+        group.append(raster_locks.setdefault(id(raster_obj), threading.Lock()))
+        group.append(raster_obj)
+
+        source_fill = get_fill_value(group[0])
+        if skip_empty and (source_fill == output_fill or (source_fill != source_fill and output_fill != output_fill)):
+            group.append(get_empty_blocks(raster_obj))
+            if raster_obj is group[0]:
+                group.append(list_windows)
+            else:
+                group.append(get_source_windows(group[0], list_windows))
+        else:  # Not checked
+            group.append(None)
+            group.append(None)
+
+    # Reads all groups of a window, returns None if the window only contains nodata
+    def read_window(index):
+        window = list_windows[index]
+        if skip_empty:
+            window_empty = True
+            for group in list_groups:
+                if group[6] is None or not is_window_empty(group[4], group[6][index], group[5]):
+                    window_empty = False
+                    break
+            if window_empty:
+                return None
+
+        list_data = []
+        for group in list_groups:
+            with group[3]:
+                list_data.append(group[0].read(group[1], window=window))
+            trace_count("bytes_read", list_data[-1].nbytes)
+        trace_count("pixels", window.width * window.height * len(list_sources))
+
+        if skip_empty:
+            window_empty = True
+            for data in list_data:
+                if not is_filled(data, output_fill):
+                    window_empty = False
+                    break
+            if window_empty:
+                return None
+
+        # The indexes of the window are computed by the reader threads and written after the output bands
+        for index_raster in list_indexes:
+            dict_data = {}
+            for variable, band in index_raster[2].items():
+                group_index, group_band = band_locations[band]
+                dict_data[variable] = list_data[group_index][group_band]
+            nodata_mask = get_nodata_mask(list(dict_data.values()), output_fill, output_raster_obj.nodata is not None)
+            list_data.append(evaluate_expression(index_raster[1], dict_data, nodata_mask))
+
+        list_window_statistics = []
+        if gather_statistics:
+            for data in list_data[:len(list_groups)]:
+                list_window_statistics.extend(get_window_statistics(data, output_fill,
+                                                                    output_raster_obj.nodata is not None))
+            for data in list_data[len(list_groups):]:
+                list_window_statistics.extend(get_window_statistics([data], np.nan, True))
+
+        return list_data, list_window_statistics
+
+    # The output raster objects: the output followed by the index rasters, replaced when they are reopened
+    # The checkpoint key identifies the windows, sources and expressions, other checkpoints are not resumed
+    list_outputs = [output_raster_obj]
+    for index_raster in list_indexes:
+        list_outputs.append(index_raster[0])
+    list_provided_outputs = list(list_outputs)
+    checkpoint_key = ""
+    first_window = 0
+    if CHECKPOINT_INTERVAL > 0 and all(os.path.exists(output.name + ".checkpoint") for output in list_outputs):
+        list_source_files = []
+        list_source_params = []
+        for group in list_groups:
+            list_source_files.append(group[4].name)
+            list_source_params.append([group[1], group[0].crs, group[0].transform, group[0].width, group[0].height])
+        for index_raster in list_indexes:
+            code = index_raster[1]
+            list_source_params.append([code.co_code, code.co_names, code.co_consts, sorted(index_raster[2].items())])
+        checkpoint_key = get_cache_key("stream_bands", list_source_files, [list_source_params, list_windows])
+
+        # Resumed if all outputs are resumed and have a checkpoint of the same windows
+        if all(output.mode == "r+" for output in list_outputs):
+            first_window = len(list_windows)
+            for output in list_outputs:
+                finished_windows = 0
+                for line in read_checkpoint(output.name + ".checkpoint")[1:]:
+                    if line.startswith(checkpoint_key + " "):
+                        finished_windows = int(line.split(" ")[1])
+                first_window = min(first_window, finished_windows)
+            trace_count("windows_resumed", first_window)
+
+    # Statistics of the output bands followed by the index rasters, see "add_statistics"
+    # Resumed outputs are read to get their statistics, the statistics of the written windows are not checkpointed
+    gather_statistics = CATALOG != "" and first_window == 0
+    list_statistics = []
+    for band_index in range(len(list_sources) + len(list_indexes)):
+        list_statistics.append([None, None, 0.0, 0])
+
+    def write_window(index, window_result):
+        if window_result is None:  # Empty window, the blocks are not written
+            trace_count("windows_skipped", 1)
+            if gather_statistics and output_raster_obj.nodata is None:  # The empty pixels are valid zeros
+                window_pixels = list_windows[index].width * list_windows[index].height
+                add_statistics(list_statistics, [[0, 0, 0.0, window_pixels]] * len(list_sources))
+        else:
+            list_data, list_window_statistics = window_result
+            for group, data in zip(list_groups, list_data):
+                list_outputs[0].write(data, group[2], window=list_windows[index])
+                trace_count("bytes_written", data.nbytes)
+            for output, data in zip(list_outputs[1:], list_data[len(list_groups):]):
+                output.write(data, 1, window=list_windows[index])
+                trace_count("bytes_written", data.nbytes)
+            add_statistics(list_statistics, list_window_statistics)
+
+    # The windows are written in segments of CHECKPOINT_INTERVAL MB, the outputs are checkpointed after each segment
+    # Outputs are closed outside the GDAL environment, the environment of a closed raster object can end it
+    segment_windows = len(list_windows)
+    if checkpoint_key != "":
+        pixel_bytes = 0
+        for output in list_outputs:
+            for dtype in output.dtypes:
+                pixel_bytes = pixel_bytes + np.dtype(dtype).itemsize
+        window_bytes = list_windows[0].width * list_windows[0].height * pixel_bytes
+        segment_windows = max(1, int(CHECKPOINT_INTERVAL * 1024 * 1024 / window_bytes))
+
+    try:
+        for segment_start in range(first_window, len(list_windows), segment_windows):
+            segment_end = min(segment_start + segment_windows, len(list_windows))
+            with limit_block_cache():  # The GDAL block cache is also kept within the memory ceiling
+                run_pipeline(list(range(segment_start, segment_end)), read_window, write_window)
+
+            if checkpoint_key != "" and segment_end < len(list_windows):
+                with trace_span("checkpoint"):
+                    for output_index, output in enumerate(list_outputs):
+                        output.close()
+                        list_outputs[output_index] = rasterio.open(output.name, 'r+')
+                    for output in list_outputs:
+                        write_checkpoint(output.name + ".checkpoint", checkpoint_key + " " + str(segment_end))
+    finally:  # Closes the reopened outputs, the provided raster objects are closed by the caller
+        for output, provided_output in zip(list_outputs, list_provided_outputs):
+            if output is not provided_output:
+                output.close()
+
+    # The statistics are kept with the sources of the bands ([source raster, source band]), see "record_raster"
+    if gather_statistics:
+        list_band_sources = []
+        for source in list_sources:
+            list_band_sources.append([getattr(source[0], "src_dataset", source[0]).name, source[1]])
+        STATISTICS_CACHE[output_raster_obj.name] = [list_band_sources, list_statistics[:len(list_sources)]]
+        for index_number, index_raster in enumerate(list_indexes):
+            STATISTICS_CACHE[index_raster[0].name] = [list_band_sources,
+                                                      [list_statistics[len(list_sources) + index_number]]]
+
+
+# Writes a virtual raster (VRT) which stacks the first band of each of the provided rasters
+# No pixels are read or written, the VRT only references the source rasters
+# Rasters with a different resolution are resampled on the fly to SPATIAL_RES, or the highest resolution
+# if RESAMPLE is disabled
+def stack_rasters_vrt(list_bands, output_vrt):
+    if RESAMPLE:
+        vrt_obj = gdal.BuildVRT(output_vrt, list_bands, separate=True, resolution="user", xRes=SPATIAL_RES,
+                                yRes=SPATIAL_RES, resampleAlg=RESAMPLING)
+    else:
+        vrt_obj = gdal.BuildVRT(output_vrt, list_bands, separate=True, resolution="highest",
+                                resampleAlg=RESAMPLING)
+    vrt_obj = None  # Closing the VRT writes it to disk
+
 
-    return dtype_name.lower()  # All characters has to be lowercase for rasterio
+# Writes a virtual raster (VRT) which references the bands of the input raster in the order of the new stack
+# No pixels are read or written
+def restack_bands_vrt(input_raster, output_vrt, new_stack):
+    vrt_obj = gdal.Translate(output_vrt, input_raster, format="VRT", bandList=new_stack)
+    vrt_obj = None  # Closing the VRT writes it to disk
 
 
 # Stacks the list of raster directories
 # Provide the output directory
 # Geotiff is the output format (*.tiff)
-def stack_rasters(list_bands, output_stacked_raster):
+# Bands with a different resolution are resampled on the fly, see RESAMPLE, SPATIAL_RES and RESAMPLING
+# If the output raster has a "vrt" extension, a virtual raster referencing the bands is written instead
+# index_outputs: Optional {index raster: band math expression}, e.g. {"ndvi.tif": "(B08 - B04) / (B08 + B04)"}
+# The index rasters are written in the same pass as the stack, see "calculate_index" for the expressions
+@trace_function
+def stack_rasters(list_bands, output_stacked_raster, index_outputs=None):
     for band in list_bands:  # Checks whether all of the provided rasters/bands exist
-        if not os.path.exists(band):
-            writeMessage("ERROR: Stacking cannot be performed because one of the rasters/bands does not exist: " + band)
+        if not file_exists(band):
+            write_message("ERROR: Stacking cannot be performed because one of the rasters/bands does not exist: " + band)
             return
 
-    # If the raster exist or overwrite is disabled, the stacking is not performed
-    if not os.path.exists(output_stacked_raster) or OVERWRITE:
-        delete_raster(output_stacked_raster)  # Deletes the raster if it exists
+    if index_outputs is None:
+        index_outputs = {}
+    band_variables = get_band_variables(list_bands)
+    for expression in index_outputs.values():  # Invalid expressions raise a ValueError before stacking
+        compile_expression(expression, band_variables)
 
-        band_count = len(list_bands)
-        writeMessage("Stacking " + str(band_count) + " bands...")
-
-        band_obj1 = rasterio.open(list_bands[0])
-        dtype = get_raster_dtype(list_bands[0])
-        writeMessage("Raster dtype: " + dtype)
-
-        # Creates the stacked Geotiff raster and sets the raster properties
-        with rasterio.open(output_stacked_raster, 'w', driver='Gtiff', width=band_obj1.width, height=band_obj1.height,
-                           count=band_count, crs=band_obj1.crs, transform=band_obj1.transform,
-                           dtype=dtype) as stacked_raster:
-            band_id = 1
-            for band in list_bands:
-                band_obj = rasterio.open(band)
-                stacked_raster.write(band_obj.read(1), band_id)
+    # If the bands and settings did not change and overwrite is disabled, the cached stack is used
+    list_index_jobs = []
+    cache_key = get_cache_key("stack_rasters", list_bands, [RESAMPLE, SPATIAL_RES, RESAMPLING])
+    if not fetch_cached_result(cache_key, output_stacked_raster, OVERWRITE):
+        temp_raster = get_temp_output(output_stacked_raster)
 
-                band_id = band_id + 1
+        band_count = len(list_bands)
+        write_message("Stacking " + str(band_count) + " bands...")
+
+        if check_extension(output_stacked_raster, ["vrt"]):  # Virtual stack, see "materialize_vrt"
+            stack_rasters_vrt(list_bands, temp_raster)
+        else:
+            with contextlib.ExitStack() as raster_stack:
+                list_raster_objs = []
+                for band in list_bands:
+                    list_raster_objs.append(raster_stack.enter_context(open_raster(band)))
+
+                band_obj1 = list_raster_objs[0]
+                dtype = get_raster_dtype(list_bands[0])
+                write_message("Raster dtype: " + dtype)
+
+                # The stack grid is the grid of the first band, at SPATIAL_RES if RESAMPLE is enabled
+                transform = band_obj1.transform
+                width = band_obj1.width
+                height = band_obj1.height
+                if RESAMPLE:
+                    transform, width, height = get_resampled_grid(band_obj1, SPATIAL_RES)
+
+                # Bands with a different resolution or extent are aligned to the stack grid on the fly
+                resampling = get_resampling(RESAMPLING)
+                list_band_objs = []
+                for raster_obj in list_raster_objs:
+                    list_band_objs.append(get_warped_raster(raster_obj, band_obj1.crs, transform, width, height,
+                                                            resampling))
+
+                # Creates the stacked Geotiff raster and sets the raster properties
+                stacked_raster = raster_stack.enter_context(
+                    open_output_raster(temp_raster, driver='Gtiff', width=width, height=height,
+                                       count=band_count, crs=band_obj1.crs, transform=transform, dtype=dtype,
+                                       nodata=band_obj1.nodata, **get_output_options('Gtiff', dtype)))
+
+                if STREAMING:  # Stacks the bands window by window, bounded by MAX_MEMORY
+                    list_sources = []
+                    for band_obj in list_band_objs:
+                        list_sources.append([band_obj, 1])
+                    list_index_jobs, list_indexes = create_index_rasters(raster_stack, stacked_raster, index_outputs,
+                                                                         band_variables)
+                    stream_bands(list_sources, stacked_raster, list_indexes)
+                else:  # Reads and writes each complete band
+                    band_id = 1
+                    for band_obj in list_band_objs:
+                        stacked_raster.write(band_obj.read(1), band_id)
+
+                        band_id = band_id + 1
+
+        store_result(cache_key, temp_raster, output_stacked_raster)
+        store_index_results(list_index_jobs, output_stacked_raster, band_variables)
+
+    # Indexes which are not written while stacking (e.g. the stack is cached) are calculated from the stack
+    list_written_indexes = [index_job[0] for index_job in list_index_jobs]
+    for index_raster, expression in index_outputs.items():
+        if index_raster not in list_written_indexes:
+            calculate_index(output_stacked_raster, index_raster, expression, band_variables)
 
 
 # Restacks the bands of the provided input raster
@@ -167,43 +1643,123 @@ def stack_rasters(list_bands, output_stacked_raster):
 # New stack: For raster with bands [1, 2, 3, 4]: [2, 1, 3], second,
 # first and third bands. Band 4 is excluded in this example.
 # Geotiff is the output format (*.tiff)
+# If the output raster has a "vrt" extension, a virtual raster referencing the bands is written instead
+@trace_function
 def restack_bands(input_raster, output_restacked_raster, new_stack):
-    if os.path.exists(input_raster):  # If the input raster does not exist, the restack is not performed
-        # If the output raster exists and overwrite is disabled, the restack is not performed
-        if not os.path.exists(output_restacked_raster) or OVERWRITE:
-            delete_raster(output_restacked_raster)  # Deletes the output raster if it exists
-
+    if file_exists(input_raster):  # If the input raster does not exist, the restack is not performed
+        # If the input raster and new stack did not change and overwrite is disabled, the cached restack is used
+        cache_key = get_cache_key("restack_bands", [input_raster], [new_stack])
+        if not fetch_cached_result(cache_key, output_restacked_raster, OVERWRITE):
             new_stack_len = len(new_stack)
             if new_stack_len > 0:  # Check if atleast one element is provided
-                orig_raster = rasterio.open(input_raster)
                 dtype = get_raster_dtype(input_raster)
-                band_count = orig_raster.count
+                band_count = get_raster_info(input_raster)["count"]
 
                 # Checks if all provided bands are valid
-                writeMessage("Restacking: " + input_raster)
-                writeMessage("Original raster band count: " + str(band_count))
-                writeMessage("New raster band count: " + str(new_stack_len))
+                write_message("Restacking: " + input_raster)
+                write_message("Original raster band count: " + str(band_count))
+                write_message("New raster band count: " + str(new_stack_len))
                 for band in new_stack:
                     # If a restack band is outside the band range of the original raster
                     if band <= 0 or band > band_count:
-                        writeMessage("ERROR: Restack band " + str(band) + " is outside the possible band range")
+                        write_message("ERROR: Restack band " + str(band) + " is outside the possible band range")
                         return
 
-                writeMessage("New stack: " + str(new_stack))
+                write_message("New stack: " + str(new_stack))
+
+                temp_raster = get_temp_output(output_restacked_raster)
+                if check_extension(output_restacked_raster, ["vrt"]):  # Virtual restack, see "materialize_vrt"
+                    restack_bands_vrt(input_raster, temp_raster, new_stack)
+                    store_result(cache_key, temp_raster, output_restacked_raster)
+                    return
 
                 # Creates the restacked raster and sets the raster properties
-                with rasterio.open(output_restacked_raster, 'w', driver='Gtiff',
-                                   width=orig_raster.width, height=orig_raster.height,
-                                   count=new_stack_len, crs=orig_raster.crs, transform=orig_raster.transform,
-                                   dtype=dtype) as new_stacked_raster:
-                    new_band_id = 1
-                    for band in new_stack:  # Restacks the bands
-                        new_stacked_raster.write(orig_raster.read(band), new_band_id)
-                        new_band_id = new_band_id + 1
+                with open_raster(input_raster) as orig_raster, \
+                        open_output_raster(temp_raster, driver='Gtiff',
+                                           width=orig_raster.width, height=orig_raster.height,
+                                           count=new_stack_len, crs=orig_raster.crs, transform=orig_raster.transform,
+                                           dtype=dtype, nodata=orig_raster.nodata,
+                                           **get_output_options('Gtiff', dtype)) as new_stacked_raster:
+                    if STREAMING:  # Restacks the bands window by window, bounded by MAX_MEMORY
+                        list_sources = []
+                        for band in new_stack:
+                            list_sources.append([orig_raster, band])
+                        stream_bands(list_sources, new_stacked_raster)
+                    else:  # Reads and writes each complete band
+                        new_band_id = 1
+                        for band in new_stack:  # Restacks the bands
+                            new_stacked_raster.write(orig_raster.read(band), new_band_id)
+                            new_band_id = new_band_id + 1
+
+                store_result(cache_key, temp_raster, output_restacked_raster)
             else:  # The band stack is empty and restacking can therefore not be performed
-                writeMessage("ERROR: Not performing restack because the new band stack is empty: " + str(new_stack))
+                write_message("ERROR: Not performing restack because the new band stack is empty: " + str(new_stack))
     else:  # No input raster found
-        writeMessage("ERROR: Input raster does not exist: " + input_raster)
+        write_message("ERROR: Input raster does not exist: " + input_raster)
+
+
+# Calculates a band index (e.g. NDVI) of the provided raster in a single pass, window by window
+# expression: Band math using the band variables, e.g. "(B08 - B04) / (B08 + B04)", or a name of INDEX_EXPRESSIONS
+# Operators: +, -, *, /, ** and the functions of INDEX_FUNCTIONS, e.g. "sqrt(b1 * b2)"
+# band_variables: Optional {variable: band number}, see "get_band_variables". b1, b2, ... are used if not provided
+# The index raster has float32 values, pixels with nodata in one of the used bands are NaN (nodata)
+# Geotiff is the output format (*.tiff)
+@trace_function
+def calculate_index(input_raster, output_index_raster, expression, band_variables=None):
+    if not file_exists(input_raster):  # No input raster found
+        write_message("ERROR: Input raster does not exist: " + input_raster)
+        return
+
+    input_info = get_raster_info(input_raster)
+    if band_variables is None:
+        band_variables = {}
+        for band in range(1, input_info["count"] + 1):
+            band_variables["b" + str(band)] = band
+    expression_code, used_variables = compile_expression(expression, band_variables)
+
+    # If the input raster and expression did not change and overwrite is disabled, the cached index is used
+    cache_key = get_cache_key("calculate_index", [input_raster],
+                              [INDEX_EXPRESSIONS.get(expression.lower(), expression), sorted(band_variables.items())])
+    if fetch_cached_result(cache_key, output_index_raster, OVERWRITE):
+        return
+
+    write_message("Calculating index: " + expression + " of " + ntpath.basename(input_raster))
+    temp_raster = get_temp_output(output_index_raster)
+    list_variables = list(used_variables.keys())
+    list_bands = [used_variables[variable] for variable in list_variables]
+    fill_value = input_info["nodata"]
+    with rasterio.open(temp_raster, 'w', driver='Gtiff', width=input_info["width"], height=input_info["height"],
+                       count=1, crs=input_info["crs"], transform=input_info["transform"], dtype="float32",
+                       nodata=np.nan, **get_output_options('Gtiff', "float32")) as index_raster_obj:
+
+        # Reads the used bands of a window and evaluates the expression, each reader thread uses its own raster object
+        def read_window(window):
+            with open_raster(input_raster) as raster_obj:
+                data = raster_obj.read(list_bands, window=window)
+            trace_count("bytes_read", data.nbytes)
+            trace_count("pixels", window.width * window.height)
+
+            list_data = [data[band_index] for band_index in range(len(list_bands))]
+            nodata_mask = get_nodata_mask(list_data, fill_value, fill_value is not None)
+            index_data = evaluate_expression(expression_code, dict(zip(list_variables, list_data)), nodata_mask)
+            if SPARSE_BLOCKS and is_filled(index_data, np.nan):
+                return None
+
+            return index_data
+
+        def write_window(window, index_data):
+            if index_data is None:  # Only nodata, the blocks are not written
+                trace_count("windows_skipped", 1)
+                return
+
+            index_raster_obj.write(index_data, 1, window=window)
+            trace_count("bytes_written", index_data.nbytes)
+
+        list_windows = get_stream_windows(index_raster_obj, (len(list_bands) + 2) * (PIPELINE_DEPTH + 1))
+        with limit_block_cache():  # The GDAL block cache is also kept within the memory ceiling
+            run_pipeline(list_windows, read_window, write_window)
+
+    store_result(cache_key, temp_raster, output_index_raster)
 
 
 # Get the resamling method for modules using the "Resampling" module
@@ -211,137 +1767,208 @@ def restack_bands(input_raster, output_restacked_raster, new_stack):
 # If the provided resampling method is identified, nearest will be applied
 def get_resampling(resampling_str):
     if resampling_str == "nearest":  # Nearest neighbour
-        resampling = Resampling.nearest
+        resampling = rasterio.enums.Resampling.nearest
     elif resampling_str == "bilinear":  # Bilinear
-        resampling = Resampling.bilinear
+        resampling = rasterio.enums.Resampling.bilinear
     elif resampling_str == "cubic":  # Cubic convolution
-        resampling = Resampling.cubic
+        resampling = rasterio.enums.Resampling.cubic
     else:  # Resampling method not identified, the default (nearest neighbour) method will be used
-        writeMessage("WARNING: Unknown resampling methods (" + str(resampling_str) +
+        write_message("WARNING: Unknown resampling methods (" + str(resampling_str) +
                      "), nearest resampling will be applied.")
-        resampling = Resampling.nearest
+        resampling = rasterio.enums.Resampling.nearest
 
     return resampling
 
 
-# Returns either the EPSG code or projection xml text
+# Gets the projection xml text (WKT) of a Lo-system coordinate system, hartebeesthoek94
+def get_lo_projection(central_meridian):
+    return "PROJCS[\"Lo" + str(central_meridian) + "\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
+           "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
+           "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
+           "PARAMETER[\"central_meridian\"," + str(central_meridian) + "],PARAMETER[\"scale_factor\",1]," \
+           "PARAMETER[\"false_easting\",0],PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
+
+
+# Gets the projection xml text (WKT) of a southern hemisphere UTM coordinate system, wgs84
+def get_utm_south_projection(zone, central_meridian):
+    return "PROJCS[\"WGS_1984_UTM_Zone_" + str(zone) + "S\",GEOGCS[\"GCS_WGS_1984\",DATUM[\"D_WGS_1984\"," \
+           "SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],PRIMEM[\"Greenwich\",0.0]," \
+           "UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"]," \
+           "PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",10000000.0]," \
+           "PARAMETER[\"Central_Meridian\"," + str(float(central_meridian)) + "],PARAMETER[\"Scale_Factor\",0.9996]," \
+           "PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0],AUTHORITY[\"EPSG\",327" + str(zone) + "]]"
+
+
+# Builds the table of supported coordinate systems, projection name: EPSG code or projection xml text
 # Geographic: "wgs84", "hartebeesthoek"
 # Projected: "web" (Web-mercator), "albers_africa", "albers_south_africa"
-# LO-system: "lo15", "lo19", "lo21", "lo23", "lo25", "lo27", "lo29", "lo31", "lo33"
-# UTM-system: "utm_33s", "utm_34s", "utm_35s" or "utm_36s"
-# If the coordinate system could not be identified, an error message is returned
+# LO-system: "lo15", "lo17", "lo19", "lo21", "lo23", "lo25", "lo27", "lo29", "lo31", "lo33"
+# UTM-system: "utm33s", "utm34s", "utm35s" or "utm36s" ("utm_33s", etc. are also accepted)
+def build_projection_table():
+    projection_table = {
+        "wgs84": "EPSG:4326",  # Geographic: WGS84
+        "hartebeesthoek": "EPSG:4148",  # Geographic: Hartebeesthoek94
+        "web": "EPSG:3857",  # Projected: Web-mercator, WGS84
+        # Projected: Albers equal area conic for Africa, wgs84
+        "albers_africa": "PROJCS[\"Africa_Albers_Equal_Area_Conic\",GEOGCS[\"GCS_WGS_1984\",DATUM[\"D_WGS_1984\","
+                         "SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\","
+                         "0.0174532925199433]],PROJECTION[\"Albers\"],PARAMETER[\"False_Easting\",0.0],"
+                         "PARAMETER[\"False_Northing\",0.0],PARAMETER[\"Central_Meridian\",25.0],"
+                         "PARAMETER[\"Standard_Parallel_1\",20.0],PARAMETER[\"Standard_Parallel_2\",-23.0],"
+                         "PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]",
+        # Projected: Albers equal area conic for South Africa, hartebeesthoek94
+        "albers_south_africa": "PROJCS[\"South_Africa_Albers_Equal_Area_Conic\",GEOGCS[\"GCS_Hartebeesthoek_1994\","
+                               "DATUM[\"D_Hartebeesthoek_1994\",SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],"
+                               "PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Albers\"],"
+                               "PARAMETER[\"False_Easting\",0.0],PARAMETER[\"False_Northing\",0.0],"
+                               "PARAMETER[\"Central_Meridian\",25.0],PARAMETER[\"Standard_Parallel_1\",-33.5],"
+                               "PARAMETER[\"Standard_Parallel_2\",-34.5],PARAMETER[\"Latitude_Of_Origin\",0.0],"
+                               "UNIT[\"Meter\",1.0]]"
+    }
+
+    for central_meridian in range(15, 35, 2):  # Projected: Lo15 to Lo33, hartebeesthoek94
+        projection_table["lo" + str(central_meridian)] = get_lo_projection(central_meridian)
+
+    for zone in range(33, 37):  # Projected: UTM33S to UTM36S, wgs84
+        central_meridian = zone * 6 - 183
+        projection_table["utm" + str(zone) + "s"] = get_utm_south_projection(zone, central_meridian)
+        projection_table["utm_" + str(zone) + "s"] = projection_table["utm" + str(zone) + "s"]
+
+    return projection_table
+
+
+# Returns either the EPSG code or projection xml text
+# See "build_projection_table" for the supported coordinate systems
+# If the coordinate system could not be identified, a ValueError is raised
 def get_epsg_projection_code(projection_name):
-    if "wgs84" == projection_name:  # Geographic: WGS84
-        return "EPSG:4326"
-    elif "hartebeesthoek" == projection_name:  # Geographic: Hartebeesthoek94
-        return "EPSG:4148"
-    elif "lo15" == projection_name:  # Projected: Lo15, hartebeesthoek94
-        return "PROJCS[\"Lo15\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",15],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo17" == projection_name:  # Projected: Lo17, hartebeesthoek94
-        return "PROJCS[\"Lo17\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",17],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo19" == projection_name:  # Projected: Lo19, hartebeesthoek94
-        return "PROJCS[\"Lo19\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",19],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo21" == projection_name:  # Projected: Lo21, hartebeesthoek94
-        return "PROJCS[\"Lo21\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",21],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo23" == projection_name:  # Projected: Lo23, hartebeesthoek94
-        return "PROJCS[\"Lo23\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",23],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo25" == projection_name:  # Projected: Lo25, hartebeesthoek94
-        return "PROJCS[\"Lo25\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",25],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo27" == projection_name:  # Projected: Lo27, hartebeesthoek94
-        return "PROJCS[\"Lo27\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",27],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo29" == projection_name:  # Projected: Lo29, hartebeesthoek94
-        return "PROJCS[\"Lo29\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",29],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo31" == projection_name:  # Projected: Lo31, hartebeesthoek94
-        return "PROJCS[\"Lo31\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",31],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "lo33" == projection_name:  # Projected: Lo33, hartebeesthoek94
-        return "PROJCS[\"Lo33\",GEOGCS[\"Hartebeesthoek94\",DATUM[\"D_Hartebeesthoek_1994\"," \
-               "SPHEROID[\"WGS_1984\",6378137,298.257223563]],PRIMEM[\"Greenwich\",0],UNIT[\"Degree\"," \
-               "0.017453292519943295]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"latitude_of_origin\",0]," \
-               "PARAMETER[\"central_meridian\",33],PARAMETER[\"scale_factor\",1],PARAMETER[\"false_easting\",0]," \
-               "PARAMETER[\"false_northing\",0],UNIT[\"Meter\",1]]"
-    elif "utm33s" == projection_name:  # Projected: UTM33S, wgs94
-        return "PROJCS[\"WGS_1984_UTM_Zone_33S\",GEOGCS[\"GCS_WGS_1984\",DATUM[\"D_WGS_1984\"," \
-               "SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],PRIMEM[\"Greenwich\",0.0]," \
-               "UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"]," \
-               "PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",10000000.0]," \
-               "PARAMETER[\"Central_Meridian\",15.0],PARAMETER[\"Scale_Factor\",0.9996]," \
-               "PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0],AUTHORITY[\"EPSG\",32733]]"
-    elif "utm34s" == projection_name:  # Projected: UTM34S, wgs94
-        return "PROJCS[\"WGS_1984_UTM_Zone_34S\",GEOGCS[\"GCS_WGS_1984\",DATUM[\"D_WGS_1984\"," \
-               "SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],PRIMEM[\"Greenwich\",0.0]," \
-               "UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"]," \
-               "PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",10000000.0]," \
-               "PARAMETER[\"Central_Meridian\",21.0],PARAMETER[\"Scale_Factor\",0.9996]," \
-               "PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0],AUTHORITY[\"EPSG\",32734]]"
-    elif "utm35s" == projection_name:  # Projected: UTM35S, wgs94
-        return "PROJCS[\"WGS_1984_UTM_Zone_35S\",GEOGCS[\"GCS_WGS_1984\",DATUM[\"D_WGS_1984\"," \
-               "SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\"," \
-               "0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"],PARAMETER[\"False_Easting\",500000.0]," \
-               "PARAMETER[\"False_Northing\",10000000.0],PARAMETER[\"Central_Meridian\",27.0]," \
-               "PARAMETER[\"Scale_Factor\",0.9996]," \
-               "PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0],AUTHORITY[\"EPSG\",32735]]"
-    elif "utm36s" == projection_name:  # Projected: UTM36S, wgs94
-        return "PROJCS[\"WGS_1984_UTM_Zone_36S\",GEOGCS[\"GCS_WGS_1984\",DATUM[\"D_WGS_1984\"," \
-               "SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],PRIMEM[\"Greenwich\",0.0]," \
-               "UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Transverse_Mercator\"]," \
-               "PARAMETER[\"False_Easting\",500000.0],PARAMETER[\"False_Northing\",10000000.0]," \
-               "PARAMETER[\"Central_Meridian\",33.0],PARAMETER[\"Scale_Factor\",0.9996]," \
-               "PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0],AUTHORITY[\"EPSG\",32736]]"
-    elif "albers_africa" == projection_name:  # Projected: Albers equal area conic for Africa, wgs84
-        return "PROJCS[\"Africa_Albers_Equal_Area_Conic\",GEOGCS[\"GCS_WGS_1984\",DATUM[\"D_WGS_1984\"," \
-               "SPHEROID[\"WGS_1984\",6378137.0,298.257223563]],PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\"," \
-               "0.0174532925199433]],PROJECTION[\"Albers\"],PARAMETER[\"False_Easting\",0.0]," \
-               "PARAMETER[\"False_Northing\",0.0],PARAMETER[\"Central_Meridian\",25.0]," \
-               "PARAMETER[\"Standard_Parallel_1\",20.0],PARAMETER[\"Standard_Parallel_2\",-23.0]," \
-               "PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]"
-    # Projected: Albers equal area conic for South Africa, hartebeesthoek94
-    elif "albers_south_africa" == projection_name:
-        return "PROJCS[\"South_Africa_Albers_Equal_Area_Conic\",GEOGCS[\"GCS_Hartebeesthoek_1994\"," \
-               "DATUM[\"D_Hartebeesthoek_1994\",SPHEROID[\"WGS_1984\",6378137.0,298.257223563]]," \
-               "PRIMEM[\"Greenwich\",0.0],UNIT[\"Degree\",0.0174532925199433]],PROJECTION[\"Albers\"]," \
-               "PARAMETER[\"False_Easting\",0.0],PARAMETER[\"False_Northing\",0.0]," \
-               "PARAMETER[\"Central_Meridian\",25.0],PARAMETER[\"Standard_Parallel_1\",-33.5]," \
-               "PARAMETER[\"Standard_Parallel_2\",-34.5],PARAMETER[\"Latitude_Of_Origin\",0.0],UNIT[\"Meter\",1.0]]"
-    elif "web" == projection_name:  # Projected: Web-mercator, WGS84
-        return "EPSG:3857"
-    else:  # Unknown projection, error message returned
-        return "ERROR: Projection not found: " + projection_name
+    if projection_name in PROJECTION_TABLE:
+        return PROJECTION_TABLE[projection_name]
+    else:  # Unknown projection
+        raise ValueError("Projection not found: " + str(projection_name))
+
+
+# Gets the coordinate system (rasterio CRS) of a projection
+# The projection can be a name from the projection table (see "build_projection_table"), an EPSG code,
+# projection xml text or a CRS
+# Each projection is only parsed once, see CRS_CACHE. Unknown projections raise a ValueError
+def get_crs(projection):
+    if isinstance(projection, rasterio.crs.CRS):
+        return projection
+
+    if projection not in CRS_CACHE:
+        if projection in PROJECTION_TABLE:
+            CRS_CACHE[projection] = rasterio.crs.CRS.from_user_input(PROJECTION_TABLE[projection])
+        else:  # EPSG code or projection xml text
+            try:
+                CRS_CACHE[projection] = rasterio.crs.CRS.from_user_input(projection)
+            except rasterio.errors.CRSError:
+                raise ValueError("Projection not found: " + str(projection))
+
+    return CRS_CACHE[projection]
+
+
+PROJECTION_TABLE = build_projection_table()  # Built once, see "get_epsg_projection_code" and "get_crs"
+
+
+# Calculates the transform, width and height of a raster grid projected to the provided coordinate system
+# Calculated once for each distinct source grid and coordinate system pair, see TRANSFORM_CACHE
+# resolution: Optional output spatial resolution, calculated from the source grid if not provided
+def get_default_transform(source_crs, epsg_code, width, height, bounds, resolution=None):
+    import rasterio.warp
+
+    key = (str(source_crs), str(epsg_code), width, height, tuple(bounds), resolution)
+    if key not in TRANSFORM_CACHE:
+        TRANSFORM_CACHE[key] = rasterio.warp.calculate_default_transform(source_crs, get_crs(epsg_code), width,
+                                                                         height, *bounds, resolution=resolution)
+
+    return TRANSFORM_CACHE[key]
+
+
+# Gets a raster object which is aligned to the provided grid (coordinate system, transform, width and height)
+# Pixels are resampled and/or projected on the fly while reading (WarpedVRT), only the read windows are warped
+# The raster object itself is returned if it is already aligned to the grid
+def get_warped_raster(raster_obj, epsg_code, transform, width, height, resampling):
+    dst_crs = get_crs(epsg_code)
+    if (raster_obj.crs == dst_crs and raster_obj.transform == transform
+            and raster_obj.width == width and raster_obj.height == height):
+        return raster_obj
+
+    return rasterio.vrt.WarpedVRT(raster_obj, crs=dst_crs, transform=transform, width=width, height=height,
+                                  resampling=resampling, warp_mem_limit=WARP_MEMORY,
+                                  warp_extras={"NUM_THREADS": PROJECT_THREADS})
+
+
+# Gets the grid (transform, width and height) of the raster object at the provided spatial resolution
+# The grid has the same origin and (approximately) the same extent as the raster
+def get_resampled_grid(raster_obj, spatial_res):
+    transform = (rasterio.Affine.translation(raster_obj.transform.c, raster_obj.transform.f) *
+                 rasterio.Affine.scale(spatial_res, -spatial_res))
+    width = max(1, int(round(raster_obj.width * raster_obj.res[0] / float(spatial_res))))
+    height = max(1, int(round(raster_obj.height * raster_obj.res[1] / float(spatial_res))))
+
+    return transform, width, height
+
+
+# Resamples the provided raster to the provided spatial resolution
+# Resampling has to be a string, "nearest", "bilinear" or "cubic"
+# Downsampling uses decimated reads, existing overviews of the input raster are used by GDAL
+# Upsampling uses the multithreaded GDAL warper, see PROJECT_THREADS
+# Geotiff is the output format (*.tiff)
+@trace_function
+def resample_raster(input_raster, output_raster, resampling_str, spatial_res):
+    import rasterio.warp
+
+    if file_exists(input_raster):
+        # Skips resampling if the cached result is used, see "fetch_cached_result"
+        cache_key = get_cache_key("resample_raster", [input_raster], [resampling_str.lower(), spatial_res])
+        if not fetch_cached_result(cache_key, output_raster, OVERWRITE):
+            temp_raster = get_temp_output(output_raster)
+
+            resampling = get_resampling(resampling_str.lower())
+            with open_raster(input_raster) as source_raster:
+                write_message("Resample raster: " + ntpath.basename(input_raster))
+                write_message("Spatial resolution: " + str(source_raster.res[0]) + " to " + str(spatial_res))
+
+                transform, width, height = get_resampled_grid(source_raster, spatial_res)
+                kwargs = source_raster.meta.copy()
+                kwargs.update({
+                    'driver': 'Gtiff',
+                    'transform': transform,
+                    'width': width,
+                    'height': height
+                })
+                kwargs.update(get_output_options('Gtiff', source_raster.dtypes[0]))
+
+                with rasterio.open(temp_raster, 'w', **kwargs) as resampled_raster:
+                    list_bands = list(range(1, source_raster.count + 1))
+                    if spatial_res > source_raster.res[0]:  # Downsampling, decimated reads window by window
+                        # Source pixels per output pixel (same origin, see "get_resampled_grid"). The output size is
+                        # rounded, windows at the edge can extend past the source and are read boundless
+                        x_scale = spatial_res / float(source_raster.res[0])
+                        y_scale = spatial_res / float(source_raster.res[1])
+                        for window in get_stream_windows(resampled_raster, 1):
+                            source_window = rasterio.windows.Window(window.col_off * x_scale,
+                                                                    window.row_off * y_scale,
+                                                                    window.width * x_scale, window.height * y_scale)
+                            boundless = (source_window.col_off + source_window.width > source_raster.width or
+                                         source_window.row_off + source_window.height > source_raster.height)
+                            for band in list_bands:
+                                resampled_raster.write(source_raster.read(band, window=source_window,
+                                                                          out_shape=(window.height, window.width),
+                                                                          resampling=resampling, boundless=boundless,
+                                                                          fill_value=get_fill_value(source_raster)),
+                                                       band, window=window)
+                    else:  # Upsampling (or the same resolution), multithreaded GDAL warper
+                        rasterio.warp.reproject(source=rasterio.band(source_raster, list_bands),
+                                                destination=rasterio.band(resampled_raster, list_bands),
+                                                src_transform=source_raster.transform, src_crs=source_raster.crs,
+                                                dst_transform=transform, dst_crs=source_raster.crs,
+                                                resampling=resampling, num_threads=PROJECT_THREADS,
+                                                warp_mem_limit=WARP_MEMORY)
+
+            store_result(cache_key, temp_raster, output_raster)
+    else:  # If the input raster does not exist, resampling is skipped
+        write_message("ERROR: Input raster (" + input_raster + ") not found, resampling not performed.")
 
 
 # Projects the provided raster
@@ -351,56 +1978,273 @@ def get_epsg_projection_code(projection_name):
 # If the required projection is not provided in the function, the required EPSG code or xml text can be used
 # Spatial reference (EPSG codes) list: https://spatialreference.org/ref/
 # Geotiff is the output format (*.tiff)
-def project_raster(input_raster, output_raster, resampling_str, epsg_code):
-    if os.path.exists(input_raster):
-        # Skips projecting if the output raster already exists or the overwrite is disabled
-        if not os.path.exists(output_raster) or OVERWRITE:
+# dst_grid: Optional (transform, width, height) of the output raster, calculated from the input raster if not provided
+# All bands are warped at once by the multithreaded GDAL warper (PROJECT_THREADS), in chunks of WARP_MEMORY MB. This is
+# faster than warping the windows of a single WarpedVRT in the pipeline, the output is not checkpointed
+# If SPARSE_BLOCKS is enabled, chunks without source pixels are not written and the Geotiff blocks stay empty
+@trace_function
+def project_raster(input_raster, output_raster, resampling_str, epsg_code, dst_grid=None):
+    import rasterio.warp
+
+    if file_exists(input_raster):
+        # Skips projecting if the cached result is used, see "fetch_cached_result"
+        grid_params = None if dst_grid is None else [tuple(dst_grid[0]), dst_grid[1], dst_grid[2]]
+        cache_key = get_cache_key("project_raster", [input_raster], [resampling_str.lower(), epsg_code, grid_params])
+        if not fetch_cached_result(cache_key, output_raster, OVERWRITE):
             raster_name = ntpath.basename(input_raster)
             resampling_str = resampling_str.lower()
             resampling = get_resampling(resampling_str)
 
-            writeMessage("Project raster: " + raster_name)
-            writeMessage("Resampling: " + resampling_str)
-            writeMessage("EPSG code: " + epsg_code)
+            write_message("Project raster: " + raster_name)
+            write_message("Resampling: " + resampling_str)
+            write_message("EPSG code: " + str(epsg_code))
 
-            delete_raster(output_raster)  # If the output raster exists, it is deleted
-            with rasterio.open(input_raster) as source_raster:
+            temp_raster = get_temp_output(output_raster)
+            with open_raster(input_raster) as source_raster:
 
-                transform, width, height = calculate_default_transform(source_raster.crs,
-                                                                       epsg_code, source_raster.width,
-                                                                       source_raster.height, *source_raster.bounds)
+                if dst_grid is None:
+                    dst_grid = get_default_transform(source_raster.crs, epsg_code, source_raster.width,
+                                                     source_raster.height, source_raster.bounds)
+                transform, width, height = dst_grid
                 kwargs = source_raster.meta.copy()
                 kwargs.update({
-                    'crs': epsg_code,
+                    'driver': 'Gtiff',
+                    'crs': get_crs(epsg_code),
                     'transform': transform,
                     'width': width,
                     'height': height
                 })
+                kwargs.update(get_output_options('Gtiff', source_raster.dtypes[0]))
+
+                warp_options = {}
+                if SPARSE_BLOCKS:
+                    warp_options["SKIP_NOSOURCE"] = "YES"
+                with rasterio.open(temp_raster, 'w', **kwargs) as projected_raster:
+                    list_bands = list(range(1, source_raster.count + 1))
+                    source_bands = rasterio.band(source_raster, list_bands)
+                    prj_bands = rasterio.band(projected_raster, list_bands)
+
+                    with limit_block_cache():  # The GDAL block cache is also kept within the memory ceiling
+                        rasterio.warp.reproject(source=source_bands, destination=prj_bands,
+                                                src_transform=source_raster.transform, src_crs=source_raster.crs,
+                                                dst_transform=projected_raster.transform, dst_crs=get_crs(epsg_code),
+                                                resampling=resampling, num_threads=PROJECT_THREADS,
+                                                warp_mem_limit=WARP_MEMORY, **warp_options)
+                    band_pixels = width * height * len(list_bands)
+                    trace_count("pixels", band_pixels)
+                    trace_count("bytes_written", band_pixels * np.dtype(source_raster.dtypes[0]).itemsize)
+
+            store_result(cache_key, temp_raster, output_raster)
+    else:  # If the input raster does not exist, projecting is skipped
+        write_message("ERROR: Input raster (" + input_raster + ") not found, projecting not performed.")
+
+
+# Projects a list of rasters using a pool of PROJECT_PROCESSES processes, see "project_raster"
+# Projected rasters are written to the output folder using the name of the input raster
+# Output grids are calculated in this process, once for each distinct source grid, and shared with the workers
+@trace_function
+def project_rasters(list_input_rasters, output_folder, resampling_str, epsg_code):
+    list_jobs = []
+    for input_raster in list_input_rasters:
+        if file_exists(input_raster):
+            with open_raster(input_raster) as source_raster:
+                dst_grid = get_default_transform(source_raster.crs, epsg_code, source_raster.width,
+                                                 source_raster.height, source_raster.bounds)
+
+            output_raster = output_folder + ntpath.basename(input_raster)
+            list_jobs.append([input_raster, output_raster, resampling_str, epsg_code, dst_grid])
+        else:  # If the input raster does not exist, projecting is skipped
+            write_message("ERROR: Input raster (" + input_raster + ") not found, projecting not performed.")
+
+    write_message("Projecting " + str(len(list_jobs)) + " rasters using " + str(PROJECT_PROCESSES) + " processes...")
+    with get_process_pool(PROJECT_PROCESSES) as executor:
+        list_futures = []
+        for job in list_jobs:
+            list_futures.append(executor.submit(run_traced, project_raster, *job))
+
+        for future in list_futures:  # Waits for all rasters, errors of the workers are raised here
+            merge_trace(future.result())
+
+
+# Gets the bounds (left, bottom, right, top) covering all of the provided bounds
+def get_union_bounds(list_bounds):
+    return (min([bounds[0] for bounds in list_bounds]), min([bounds[1] for bounds in list_bounds]),
+            max([bounds[2] for bounds in list_bounds]), max([bounds[3] for bounds in list_bounds]))
+
+
+# Builds an R-tree of the provided bounds (left, bottom, right, top), packed using Sort-Tile-Recursive
+# Nodes are [bounds, list of child nodes], the leaves are [bounds, index of the bounds]. See "query_rtree"
+def build_rtree(list_bounds, node_size=8):
+    list_nodes = []
+    for index, bounds in enumerate(list_bounds):
+        list_nodes.append([tuple(bounds), index])
+
+    while len(list_nodes) > node_size:  # Packs the nodes into parent nodes until a single node remains
+        slice_count = int(np.ceil(np.sqrt(np.ceil(len(list_nodes) / float(node_size)))))
+        slice_size = slice_count * node_size
+        list_nodes.sort(key=lambda node: node[0][0] + node[0][2])  # Vertical slices, sorted by x
+        list_parent_nodes = []
+        for slice_start in range(0, len(list_nodes), slice_size):
+            list_slice_nodes = sorted(list_nodes[slice_start:slice_start + slice_size],
+                                      key=lambda node: node[0][1] + node[0][3])  # Sorted by y within the slice
+            for node_start in range(0, len(list_slice_nodes), node_size):
+                list_child_nodes = list_slice_nodes[node_start:node_start + node_size]
+                list_parent_nodes.append([get_union_bounds([node[0] for node in list_child_nodes]),
+                                          list_child_nodes])
+        list_nodes = list_parent_nodes
+
+    if len(list_nodes) == 0:
+        return [(0, 0, 0, 0), []]
+
+    return [get_union_bounds([node[0] for node in list_nodes]), list_nodes]
+
+
+# Gets the indexes of the bounds in the R-tree (see "build_rtree") which intersect the provided bounds, sorted
+def query_rtree(rtree, bounds):
+    list_indexes = []
+    list_nodes = [rtree]
+    while list_nodes:
+        node_bounds, children = list_nodes.pop()
+        if (node_bounds[0] >= bounds[2] or node_bounds[2] <= bounds[0] or
+                node_bounds[1] >= bounds[3] or node_bounds[3] <= bounds[1]):  # No overlap
+            continue
+
+        if isinstance(children, list):
+            list_nodes.extend(children)
+        else:  # Leaf, children is the index of the bounds
+            list_indexes.append(children)
+
+    return sorted(list_indexes)
+
+
+# Mosaics the provided rasters (e.g. adjacent Sentinel-2 tiles) into a single raster in the provided coordinate system
+# The footprints of the rasters are indexed in an R-tree and the output is written window by window (pipeline)
+# For each window only the intersecting rasters are read, only the window is warped, see "get_warped_raster"
+# Memory is bounded by the window size and MAX_OPEN_RASTERS, regardless of the number of rasters
+# Where rasters overlap, the first raster in the list with data is used. Nodata (or 0 without nodata) is transparent
+# The output has the spatial resolution SPATIAL_RES if RESAMPLE is enabled, otherwise the highest input resolution
+# Resampling has to be a string, "nearest", "bilinear" or "cubic". See "get_epsg_projection_code" for the projections
+# All rasters require the same band count. Geotiff is the output format (*.tiff)
+@trace_function
+def mosaic_rasters(list_rasters, output_raster, resampling_str, epsg_code):
+    for raster in list_rasters:  # Checks whether all of the provided rasters exist
+        if not file_exists(raster):
+            write_message("ERROR: Mosaicking cannot be performed because one of the rasters does not exist: " + raster)
+            return
 
-                with rasterio.open(output_raster, 'w', **kwargs) as projected_raster:
-                    band_count = source_raster.count
-                    for band in range(1, band_count):  # Projects each band and writes it to the projected raster file
-                        source_band = rasterio.band(source_raster, band)
-                        source_trans = source_raster.transform
-                        source_prj = source_raster.crs
-
-                        prj_band = rasterio.band(projected_raster, band)
-                        prj_trans = projected_raster.transform
+    if len(list_rasters) == 0:
+        write_message("ERROR: No rasters provided for the mosaic")
+        return
+
+    # If the rasters and settings did not change and overwrite is disabled, the cached mosaic is used
+    cache_key = get_cache_key("mosaic_rasters", list_rasters, [resampling_str.lower(), epsg_code, RESAMPLE,
+                                                               SPATIAL_RES])
+    if fetch_cached_result(cache_key, output_raster, OVERWRITE):
+        return
+
+    write_message("Mosaicking " + str(len(list_rasters)) + " rasters...")
+    resampling = get_resampling(resampling_str.lower())
+    raster_info1 = get_raster_info(list_rasters[0])
+    band_count = raster_info1["count"]
+    dtype = raster_info1["dtype"]
+
+    # Footprints of the rasters in the output coordinate system, using the projected grid of each raster
+    resolution = None
+    if RESAMPLE:
+        resolution = SPATIAL_RES
+    list_footprints = []
+    spatial_res = None
+    for raster in list_rasters:
+        raster_info = get_raster_info(raster)
+        if raster_info["count"] != band_count:
+            write_message("ERROR: Mosaicking cannot be performed because the band count of " + raster + " (" +
+                          str(raster_info["count"]) + ") differs from " + str(band_count))
+            return
 
-                        reproject(source=source_band, destination=prj_band, src_transform=source_trans,
-                                  src_crs=source_prj, dst_transform=prj_trans, dst_crs=epsg_code, resampling=resampling)
-    else:  # If the input raster does not exist, projecting is skipped
-        writeMessage("ERROR: Input raster (" + input_raster + ") not found, projecting not performed.")
+        transform, width, height = get_default_transform(raster_info["crs"], epsg_code, raster_info["width"],
+                                                         raster_info["height"], raster_info["bounds"], resolution)
+        list_footprints.append(rasterio.transform.array_bounds(height, width, transform))
+        if spatial_res is None or transform.a < spatial_res:
+            spatial_res = transform.a
+
+    # The output grid covers all footprints and is aligned to the spatial resolution
+    left, bottom, right, top = get_union_bounds(list_footprints)
+    left = np.floor(left / spatial_res) * spatial_res
+    top = np.ceil(top / spatial_res) * spatial_res
+    transform = rasterio.Affine.translation(left, top) * rasterio.Affine.scale(spatial_res, -spatial_res)
+    width = max(1, int(np.ceil((right - left) / spatial_res)))
+    height = max(1, int(np.ceil((top - bottom) / spatial_res)))
+    rtree = build_rtree(list_footprints)
+
+    temp_raster = get_temp_output(output_raster)
+    nodata = raster_info1["nodata"]
+    with rasterio.open(temp_raster, 'w', driver='Gtiff', width=width, height=height, count=band_count,
+                       crs=get_crs(epsg_code), transform=transform, dtype=dtype, nodata=nodata,
+                       **get_output_options('Gtiff', dtype)) as mosaic_raster:
+        output_fill = get_fill_value(mosaic_raster)
+        list_bands = list(range(1, band_count + 1))
+
+        # Reads the intersecting rasters of a window, each reader thread uses its own raster objects
+        # Returns None if no raster has data in the window
+        def read_window(window):
+            list_indexes = query_rtree(rtree, rasterio.windows.bounds(window, transform))
+            mosaic_data = None
+            for index in list_indexes:
+                with open_raster(list_rasters[index]) as raster_obj:
+                    warped_raster_obj = get_warped_raster(raster_obj, epsg_code, transform, width, height, resampling)
+                    data = warped_raster_obj.read(list_bands, window=window)
+                    trace_count("bytes_read", data.nbytes)
+                    data_fill = get_fill_value(warped_raster_obj)
+                    if warped_raster_obj is not raster_obj:
+                        warped_raster_obj.close()
+
+                # Pixels of the raster with data, which are still empty in the mosaic
+                if data_fill != data_fill:
+                    data_mask = ~np.isnan(data).all(axis=0)
+                else:
+                    data_mask = (data != data_fill).any(axis=0)
+                if mosaic_data is None:
+                    mosaic_data = np.full(data.shape, output_fill, dtype=dtype)
+                    empty_mask = np.ones(data_mask.shape, dtype=bool)
+                data_mask = data_mask & empty_mask
+                mosaic_data[:, data_mask] = data[:, data_mask]
+                empty_mask = empty_mask & ~data_mask
+
+                if not empty_mask.any():  # The window is filled, the remaining rasters are not read
+                    break
+
+            trace_count("pixels", window.width * window.height * band_count)
+            if mosaic_data is None or (SPARSE_BLOCKS and is_filled(mosaic_data, output_fill)):
+                return None
+
+            return mosaic_data
+
+        def write_window(window, mosaic_data):
+            if mosaic_data is None:  # No data, the blocks are not written
+                trace_count("windows_skipped", 1)
+                return
+
+            mosaic_raster.write(mosaic_data, list_bands, window=window)
+            trace_count("bytes_written", mosaic_data.nbytes)
+
+        max_pixels = None
+        if SPARSE_BLOCKS:
+            max_pixels = 2048 * 2048
+        list_windows = get_stream_windows(mosaic_raster, band_count * 2 * (PIPELINE_DEPTH + 1), max_pixels)
+        with limit_block_cache():  # The GDAL block cache is also kept within the memory ceiling
+            run_pipeline(list_windows, read_window, write_window)
+
+    store_result(cache_key, temp_raster, output_raster)
 
 
 # Deletes the provided raster
-# Will also delete additional files ("tfw", "aux.xml", "ovr" and "xml")
+# Will also delete additional files ("tfw", "aux.xml", "ovr", "xml" and "checkpoint")
 # Should work with any raster format
 # Deletion is not executed if the raster does not exist
 def delete_raster(raster_to_delete):
-    raster_extensions = ["tfw", "aux.xml", "ovr", "xml"]
+    raster_extensions = ["tfw", "aux.xml", "ovr", "xml", "checkpoint"]
     if os.path.exists(raster_to_delete):
-        writeMessage("Deleting: " + raster_to_delete)
+        write_message("Deleting: " + raster_to_delete)
         os.remove(raster_to_delete)
 
         base_name = ntpath.basename(raster_to_delete)
@@ -422,36 +2266,62 @@ def delete_raster(raster_to_delete):
 # Deletion is not executed if the file does not exist
 def delete_file(file_to_delete):
     if os.path.exists(file_to_delete):
-        writeMessage("Deleting: " + file_to_delete)
+        write_message("Deleting: " + file_to_delete)
         os.remove(file_to_delete)
 
 
 # Copies a raster
 # Can be used to change the format of the raster
+@trace_function
 def copy_raster(input_raster, output_raster, overwrite):
-    # If the output raster already exists and overwrite is disabled, it is skipped
-    if not os.path.exists(output_raster) or overwrite:
-        delete_raster(output_raster)  # Deletes the raster if it exists
+    # If the input raster did not change and overwrite is disabled, the cached copy is used
+    cache_key = get_cache_key("copy_raster", [input_raster], [])
+    if not fetch_cached_result(cache_key, output_raster, overwrite):
+        temp_raster = get_temp_output(output_raster)
 
-        writeMessage("Copying raster: " + input_raster)
-        writeMessage("Output raster: " + output_raster)
+        write_message("Copying raster: " + input_raster)
+        write_message("Output raster: " + output_raster)
 
-        input_raster_obj = rasterio.open(input_raster)
         dtype = get_raster_dtype(input_raster)
-        band_count = input_raster_obj.count
+        band_count = get_raster_info(input_raster)["count"]
 
         # Creates the new raster
-        with rasterio.open(output_raster, 'w', driver=FORMAT, width=input_raster_obj.width,
-                           height=input_raster_obj.height,
-                           count=band_count, crs=input_raster_obj.crs, transform=input_raster_obj.transform,
-                           dtype=dtype) as new_raster:
+        with open_raster(input_raster) as input_raster_obj, \
+                open_output_raster(temp_raster, driver=FORMAT, width=input_raster_obj.width,
+                                   height=input_raster_obj.height,
+                                   count=band_count, crs=input_raster_obj.crs, transform=input_raster_obj.transform,
+                                   dtype=dtype, nodata=input_raster_obj.nodata,
+                                   **get_output_options(FORMAT, dtype)) as new_raster:
+
+            if STREAMING:  # Copies the bands window by window, bounded by MAX_MEMORY
+                list_sources = []
+                for index_band in range(1, band_count + 1):
+                    list_sources.append([input_raster_obj, index_band])
+                stream_bands(list_sources, new_raster)
+            else:
+                index_band = 1
+                while index_band <= band_count:  # Writes each band to the new raster
+                    input_raster_band = input_raster_obj.read(index_band)
+                    new_raster.write(input_raster_band, index_band)
 
-            index_band = 1
-            while index_band <= band_count:  # Writes each band to the new raster
-                input_raster_band = input_raster_obj.read(index_band)
-                new_raster.write(input_raster_band, index_band)
+                    index_band = index_band + 1
 
-                index_band = index_band + 1
+        store_result(cache_key, temp_raster, output_raster)
+
+
+# Materializes a virtual raster (VRT), created by "stack_rasters" or "restack_bands", to a raster file
+# Only needed when a physical raster is required, e.g. for delivery. The VRT is kept
+# The raster is written in the FORMAT format
+@trace_function
+def materialize_vrt(input_vrt, output_raster):
+    if os.path.exists(input_vrt):
+        if check_extension(input_vrt, ["vrt"]):
+            write_message("Materializing VRT: " + ntpath.basename(input_vrt))
+            copy_raster(input_vrt, output_raster, OVERWRITE)
+        else:  # The input raster is not a virtual raster
+            write_message("ERROR: Input raster is not a VRT: " + input_vrt)
+    else:  # No input VRT found
+        write_message("ERROR: Input VRT does not exist: " + input_vrt)
 
 
 # Creates the output folder if it does not exist
@@ -489,24 +2359,133 @@ def s2_get_raster_stack_bands(list_rasters, s2_level):
             elif "B01" in filename or "B09" in filename or "B11" in filename:
                 list_60m_bands.append(raster)
     else:  # The Sentinel-2 data level could not be identified
-        writeMessage("ERROR: Unknown Sentinel-2 level: " + s2_level)
+        write_message("ERROR: Unknown Sentinel-2 level: " + s2_level)
 
     return list_10m_bands, list_20m_bands, list_60m_bands
 
 
+# Sentinel-2: Gets the band name of a band raster, e.g. "B04" or "B8A". Returns "" if the band is not identified
+def s2_get_band_name(raster):
+    filename = ntpath.basename(raster)
+    for band_name in ["B01", "B02", "B03", "B04", "B05", "B06", "B07", "B08", "B8A", "B09", "B10", "B11", "B12",
+                      "WVP"]:
+        if "_" + band_name in filename:
+            return band_name
+
+    return ""
+
+
+# Sentinel-2: Processes a product in a single pass, from the metadata to the stacked and projected raster
+# The bands of the provided band groups ("10m", "20m" and "60m", see "s2_get_raster_stack_bands") are stacked,
+# resampled to SPATIAL_RES and projected window by window while reading. No intermediate rasters are written
+# If RESAMPLE is disabled, the output has the resolution of the first band
+# new_stack: Optional order of the selected bands, e.g. [3, 2, 1], see "restack_bands"
+# index_outputs: Optional {index raster: band math expression}, written in the same pass, see "stack_rasters"
+# Resampling has to be a string, "nearest", "bilinear" or "cubic"
+# Geotiff is the output format (*.tiff)
+@trace_function
+def s2_process_product(metadata, raw_folder, s2_level, output_raster, resampling_str, epsg_code,
+                       band_groups=("10m", "20m", "60m"), new_stack=None, index_outputs=None):
+    sensor, date, tile, list_rasters = read_raster_sentinel2_metadata(metadata, raw_folder)
+    list_10m_bands, list_20m_bands, list_60m_bands = s2_get_raster_stack_bands(list_rasters, s2_level)
+
+    list_bands = []
+    for band_group in band_groups:
+        if band_group == "10m":
+            list_bands = list_bands + list_10m_bands
+        elif band_group == "20m":
+            list_bands = list_bands + list_20m_bands
+        elif band_group == "60m":
+            list_bands = list_bands + list_60m_bands
+        else:  # Unknown band group
+            write_message("ERROR: Unknown Sentinel-2 band group: " + str(band_group))
+            return
+
+    if new_stack is not None:  # Restacks the selected bands
+        list_restacked_bands = []
+        for band in new_stack:
+            if band <= 0 or band > len(list_bands):
+                write_message("ERROR: Restack band " + str(band) + " is outside the possible band range")
+                return
+            list_restacked_bands.append(list_bands[band - 1])
+        list_bands = list_restacked_bands
+
+    if len(list_bands) == 0:  # No bands found for the product
+        write_message("ERROR: No bands found for the product: " + metadata)
+        return
+
+    for band in list_bands:  # Checks whether all of the bands exist
+        if not file_exists(band):
+            write_message("ERROR: Product cannot be processed because one of the bands does not exist: " + band)
+            return
+
+    if index_outputs is None:
+        index_outputs = {}
+    band_variables = get_band_variables(list_bands)
+    for expression in index_outputs.values():  # Invalid expressions raise a ValueError before processing
+        compile_expression(expression, band_variables)
+
+    # If the bands and settings did not change and overwrite is disabled, the cached result is used
+    list_index_jobs = []
+    cache_key = get_cache_key("s2_process_product", list_bands, [resampling_str.lower(), epsg_code, RESAMPLE,
+                                                                 SPATIAL_RES])
+    if not fetch_cached_result(cache_key, output_raster, OVERWRITE):
+        temp_raster = get_temp_output(output_raster)
+
+        write_message("Processing Sentinel-2 product: " + sensor + " " + date + " " + tile)
+        write_message("Bands: " + str(len(list_bands)) + ", resampling: " + resampling_str +
+                      ", EPSG code: " + str(epsg_code))
+
+        resampling = get_resampling(resampling_str.lower())
+
+        # The output grid is calculated from the first band
+        band_info1 = get_raster_info(list_bands[0])
+        resolution = None
+        if RESAMPLE:
+            resolution = SPATIAL_RES
+        transform, width, height = get_default_transform(band_info1["crs"], epsg_code, band_info1["width"],
+                                                         band_info1["height"], band_info1["bounds"], resolution)
+
+        dtype = band_info1["dtype"]
+        with contextlib.ExitStack() as raster_stack, \
+                open_output_raster(temp_raster, driver='Gtiff', width=width, height=height, count=len(list_bands),
+                                   crs=get_crs(epsg_code), transform=transform, dtype=dtype,
+                                   nodata=band_info1["nodata"], **get_output_options('Gtiff', dtype)) as product_raster:
+            list_sources = []
+            for band in list_bands:
+                band_obj = raster_stack.enter_context(open_raster(band))
+                warped_band_obj = get_warped_raster(band_obj, epsg_code, transform, width, height, resampling)
+                list_sources.append([warped_band_obj, 1])
+            list_index_jobs, list_indexes = create_index_rasters(raster_stack, product_raster, index_outputs,
+                                                                 band_variables)
+            stream_bands(list_sources, product_raster, list_indexes)
+
+        store_result(cache_key, temp_raster, output_raster)
+        store_index_results(list_index_jobs, output_raster, band_variables)
+
+    # Indexes which are not written while processing (the product is cached) are calculated from the output raster
+    list_written_indexes = [index_job[0] for index_job in list_index_jobs]
+    for index_raster, expression in index_outputs.items():
+        if index_raster not in list_written_indexes:
+            calculate_index(output_raster, index_raster, expression, band_variables)
+
+
 # Creates a csv metadata file based on provided info
 # list_info: [[raster, sensor, capture_date, tile, bands, spatial_res, projection],
 # [raster, sensor, capture_date, tile, bands, spatial_res, projection], ...]
 # Provide "" for data info if the table element should be left empty
 # output_metadata: directory + "metadata.csv"
+@trace_function
 def create_metadata(list_info, output_metadata):
     if len(list_info) > 0:  # Checks if any info is provided to print to the csv file
-        if not os.path.exists(output_metadata) or OVERWRITE:  # Skips if the metadata file exists
-            delete_file(output_metadata)
+        # Skips if the info did not change and overwrite is disabled, the cached metadata file is used
+        cache_key = get_cache_key("create_metadata", [], [list_info])
+        if not fetch_cached_result(cache_key, output_metadata, OVERWRITE):
+            temp_metadata = get_temp_output(output_metadata)
 
-            writeMessage("Metadata: " + ntpath.basename(output_metadata))
+            write_message("Metadata: " + ntpath.basename(output_metadata))
 
-            with open(output_metadata, 'w', newline='') as csv_file:
+            with open(temp_metadata, 'w', newline='') as csv_file:
                 csv_writer = csv.writer(csv_file)
                 # Columns which will be written to the csv file
                 columns = ["Raster", "Data", "Capture date", "Tile", "Bands", "Spatial resolution", "Projection"]
@@ -527,5 +2506,520 @@ def create_metadata(list_info, output_metadata):
                     # If the length is incorrect, not enough info is provided. An error is written to the csv file
                     else:
                         csv_writer.writerow(["ERROR: Not enough info provided for the raster: " + str(file_info)])
+
+            store_result(cache_key, temp_metadata, output_metadata)
     else:  # No metadata data info is provided
-        writeMessage("ERROR: No metadata data info provided: " + output_metadata)
+        write_message("ERROR: No metadata data info provided: " + output_metadata)
+
+
+# Sentinel-2: Gets the sensor, capture date and tile of a raster from the product or band file names of its path
+# e.g. ".../S2A_MSIL2A_20200105T075311_N0213_R135_T34JBL_20200105T101613.SAFE/..." or "T34JBL_20200105T075311_B02.jp2"
+# Returns ["", "", ""] if the path does not contain a Sentinel-2 product, the sensor is "" for band file names only
+def s2_get_product_info(raster):
+    product_info = ["", "", ""]
+    for name in raster.replace("\\", "/").split("/"):
+        list_split_name = name.replace(".SAFE", "").replace(".zip", "").split("_")
+        if name.startswith("S2") and len(list_split_name) > 5:  # Product name, see "parse_sentinel2_metadata"
+            return [list_split_name[0], (list_split_name[2])[:8], (list_split_name[5])[1:]]
+        elif (len(list_split_name) > 2 and len(list_split_name[0]) == 6 and list_split_name[0].startswith("T")
+              and (list_split_name[1])[8:9] == "T"):  # Band file name
+            product_info = ["", (list_split_name[1])[:8], (list_split_name[0])[1:]]
+
+    return product_info
+
+
+# Gets the band statistics of a raster by reading it window by window, see "get_window_statistics"
+# Returns the statistics in the form gathered by "stream_bands": [[[raster, band], ...], [statistics of each band]]
+def get_raster_statistics(raster):
+    list_band_sources = []
+    list_statistics = []
+    with open_raster(raster) as raster_obj:
+        for band in range(1, raster_obj.count + 1):
+            list_band_sources.append([raster, band])
+            list_statistics.append([None, None, 0.0, 0])
+
+        fill_value = get_fill_value(raster_obj)
+        for window in get_stream_windows(raster_obj, raster_obj.count):
+            data = raster_obj.read(window=window)
+            add_statistics(list_statistics, get_window_statistics(data, fill_value, raster_obj.nodata is not None))
+
+    return [list_band_sources, list_statistics]
+
+
+# Records a written raster and the statistics of its bands in the CATALOG, see "open_catalog"
+# raster_statistics: The statistics gathered while writing the raster (see "stream_bands"), the raster is read if they
+# are not provided and the raster changed since it was recorded
+# The sensor, capture date and tile are taken from the records of the sources, or the Sentinel-2 file names
+# Bands are named after the source bands (recorded or Sentinel-2 band names) or b1, b2, ... Index rasters have more
+# sources than bands, their band is named after the raster
+def record_raster(raster, raster_statistics=None):
+    raster_path = os.path.abspath(raster)
+    file_stat = os.stat(raster)
+    catalog_conn = open_catalog(CATALOG)
+    with contextlib.closing(catalog_conn):
+        if raster_statistics is None:
+            record = catalog_conn.execute("SELECT size, mtime FROM rasters WHERE path = ?", (raster_path,)).fetchone()
+            if record == (file_stat.st_size, file_stat.st_mtime_ns):  # The record is current
+                return
+            raster_statistics = get_raster_statistics(raster)
+        list_band_sources, list_statistics = raster_statistics
+
+        # Product info and band names from the sources
+        product_info = s2_get_product_info(raster)
+        list_source_names = []
+        for source_raster, source_band in list_band_sources:
+            source_path = source_raster
+            if not source_raster.startswith("/vsi"):
+                source_path = os.path.abspath(source_raster)
+            source_record = None
+            source_name = None
+            if source_path != raster_path:
+                source_record = catalog_conn.execute("SELECT sensor, date, tile FROM rasters WHERE path = ?",
+                                                     (source_path,)).fetchone()
+                source_name = catalog_conn.execute("SELECT name FROM band_statistics WHERE path = ? AND band = ?",
+                                                   (source_path, source_band)).fetchone()
+            if source_record is not None and source_record[2] != "":
+                product_info = list(source_record)
+            elif s2_get_product_info(source_raster)[2] != "":
+                product_info = s2_get_product_info(source_raster)
+
+            if source_name is not None:
+                list_source_names.append(source_name[0])
+            else:
+                list_source_names.append(s2_get_band_name(source_raster))
+
+        list_band_names = []
+        for band_index in range(len(list_statistics)):
+            if len(list_source_names) != len(list_statistics):  # Index raster, the band is named after the raster
+                list_band_names.append(os.path.splitext(ntpath.basename(raster))[0])
+            elif list_source_names[band_index] != "":
+                list_band_names.append(list_source_names[band_index])
+            else:
+                list_band_names.append("b" + str(band_index + 1))
+
+        raster_info = get_raster_info(raster)
+        projection = ""
+        if raster_info["crs"] is not None:
+            projection = raster_info["crs"].to_string()
+
+        with catalog_conn:
+            catalog_conn.execute("INSERT OR REPLACE INTO rasters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (raster_path, product_info[0], product_info[1], product_info[2],
+                                  str(list_band_names), raster_info["res"][0], projection, raster_info["width"],
+                                  raster_info["height"], raster_info["dtype"], file_stat.st_size,
+                                  file_stat.st_mtime_ns))
+            catalog_conn.execute("DELETE FROM band_statistics WHERE path = ?", (raster_path,))
+            for band_index, statistics in enumerate(list_statistics):
+                mean = None
+                if statistics[3] > 0:
+                    mean = statistics[2] / statistics[3]
+                catalog_conn.execute("INSERT INTO band_statistics VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (raster_path, band_index + 1, list_band_names[band_index], statistics[0],
+                                      statistics[1], mean, statistics[3]))
+
+
+# Queries the rasters recorded in the CATALOG by tile and capture date (YYYYMMDD), see "record_raster"
+# Provide "" to select all tiles or dates. start_date and end_date are included
+# Returns a list of [raster, sensor, capture_date, tile, bands, spatial_res, projection, list of band statistics]
+# Band statistics: [band, band name, min, max, mean, valid pixels]
+def query_catalog(tile="", start_date="", end_date=""):
+    query = "SELECT path, sensor, date, tile, bands, spatial_res, projection FROM rasters WHERE 1 = 1"
+    list_params = []
+    if tile != "":
+        query = query + " AND tile = ?"
+        list_params.append(tile)
+    if start_date != "":
+        query = query + " AND date >= ?"
+        list_params.append(str(start_date))
+    if end_date != "":
+        query = query + " AND date <= ?"
+        list_params.append(str(end_date))
+
+    list_records = []
+    with contextlib.closing(open_catalog(CATALOG)) as catalog_conn:
+        for record in catalog_conn.execute(query + " ORDER BY date, tile, path", list_params).fetchall():
+            list_band_statistics = []
+            for band_statistics in catalog_conn.execute("SELECT band, name, min, max, mean, valid_count FROM "
+                                                        "band_statistics WHERE path = ? ORDER BY band", (record[0],)):
+                list_band_statistics.append(list(band_statistics))
+            list_records.append(list(record) + [list_band_statistics])
+
+    return list_records
+
+
+# Exports the rasters recorded in the CATALOG to a csv file, a row for each band of each raster
+# The rasters can be selected by tile and capture date, see "query_catalog"
+# output_metadata: directory + "catalog.csv"
+@trace_function
+def export_catalog(output_metadata, tile="", start_date="", end_date=""):
+    list_records = query_catalog(tile, start_date, end_date)
+    write_message("Exporting " + str(len(list_records)) + " rasters: " + ntpath.basename(output_metadata))
+
+    temp_metadata = get_temp_output(output_metadata)
+    with open(temp_metadata, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        # The columns of "create_metadata" followed by the band statistics
+        csv_writer.writerow(["Raster", "Data", "Capture date", "Tile", "Bands", "Spatial resolution", "Projection",
+                             "Band", "Band name", "Min", "Max", "Mean", "Valid pixels"])
+        for record in list_records:
+            for band_statistics in record[7]:
+                csv_writer.writerow(record[:7] + band_statistics)
+
+    os.replace(temp_metadata, output_metadata)
+
+
+# Reads a job manifest (JSON file) of a batch, see "run_batch"
+# {"settings": {setting: value}, "jobs": [{"id": ..., "operation": ..., "args": [...], "kwargs": {...},
+# "settings": {setting: value}, "outputs": [...]}, ...]}
+# operation: Function of this module, e.g. "s2_process_product". Jobs without an id are identified by their position
+# settings: Optional global variables of the batch and of each job, e.g. {"OUTPUT_PROFILE": "zstd"}
+# outputs: Optional files which must exist after the job, a job which did not write them failed
+# Returns the settings of the batch and the list of jobs, or None if the manifest is invalid
+def read_job_manifest(manifest):
+    try:
+        with open(manifest) as manifest_file:
+            manifest_info = json.load(manifest_file)
+    except (OSError, ValueError) as error:
+        write_message("ERROR: The job manifest cannot be read: " + manifest + " (" + str(error) + ")")
+        return None
+
+    settings = manifest_info.get("settings", {})
+    list_jobs = manifest_info.get("jobs", [])
+    for setting in settings:
+        if setting not in get_settings():
+            write_message("ERROR: Unknown setting of the batch: " + setting)
+            return None
+    list_job_ids = []
+    for job_index, job in enumerate(list_jobs):
+        job["id"] = str(job.get("id", job_index))
+        list_job_ids.append(job["id"])
+        error = check_job(job)
+        if error != "":
+            write_message("ERROR: " + error)
+            return None
+    if len(set(list_job_ids)) != len(list_job_ids):
+        write_message("ERROR: The job ids of the manifest are not unique: " + manifest)
+        return None
+
+    return settings, list_jobs
+
+
+# Checks the operation and the settings of a job, see "read_job_manifest"
+# Returns "" if the job is valid, otherwise the error
+def check_job(job):
+    if not callable(globals().get(job.get("operation", ""))):
+        return "Unknown operation of job " + job["id"] + ": " + str(job.get("operation"))
+    for setting in job.get("settings", {}):
+        if setting not in get_settings():
+            return "Unknown setting of job " + job["id"] + ": " + setting
+
+    return ""
+
+
+# Gets the key of a job, a job which changed in the manifest has another key and is run again
+def get_job_key(job, settings):
+    return hashlib.sha256(json.dumps([job, settings], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# Reads the finished jobs of a batch journal: {job id: job key}
+# The journal has a JSON record per line, a record which is not completely written (interrupted) is ignored
+def read_job_journal(journal):
+    dict_finished_jobs = {}
+    for line in read_checkpoint(journal):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("status") == "done":
+            dict_finished_jobs[record["id"]] = record["key"]
+        else:
+            dict_finished_jobs.pop(record.get("id"), None)
+
+    return dict_finished_jobs
+
+
+# Runs a job of a batch in a worker process, see "run_batch"
+# The settings of the batch and the job replace the global variables of the worker while the job runs, jobs which
+# run at the same time do not share settings
+# Returns "" if the job succeeded, otherwise the error
+def run_job(job, settings):
+    previous_settings = get_settings()
+    set_settings(settings)
+    set_settings(job.get("settings", {}))
+    try:
+        globals()[job["operation"]](*job.get("args", []), **job.get("kwargs", {}))
+
+        for output in job.get("outputs", []):
+            if not os.path.exists(output):
+                return "Output not written: " + output
+        return ""
+    except Exception as error:
+        return type(error).__name__ + ": " + str(error)
+    finally:
+        set_settings(previous_settings)
+
+
+# Runs the jobs of a job manifest (see "read_job_manifest") with BATCH_PROCESSES worker processes
+# Finished and failed jobs are recorded in a journal (the manifest + ".journal" by default) which is written to
+# disk after each job. A restarted batch skips the jobs which are done, failed jobs are run again
+# Streamed Geotiff outputs are checkpointed (CHECKPOINT_INTERVAL, 1024 MB unless the manifest sets it), the outputs
+# of an interrupted job continue after their last checkpoint. Unfinished outputs are only written to temporary files
+# (see "get_temp_output"), a partial output is never mistaken for a finished one
+# Returns the number of done, failed and skipped jobs, or None if the manifest is invalid
+@trace_function
+def run_batch(manifest, journal=""):
+    manifest_info = read_job_manifest(manifest)
+    if manifest_info is None:
+        return None
+    settings = {"CHECKPOINT_INTERVAL": 1024}
+    settings.update(manifest_info[0])
+    list_jobs = manifest_info[1]
+
+    if journal == "":
+        journal = manifest + ".journal"
+    dict_finished_jobs = read_job_journal(journal)
+    list_pending_jobs = []
+    for job in list_jobs:
+        if dict_finished_jobs.get(job["id"]) != get_job_key(job, settings):
+            list_pending_jobs.append(job)
+    skipped_jobs = len(list_jobs) - len(list_pending_jobs)
+    write_message("Batch: " + str(len(list_pending_jobs)) + " jobs, " + str(skipped_jobs) + " jobs already done")
+
+    done_jobs = 0
+    failed_jobs = 0
+    with get_process_pool(BATCH_PROCESSES) as executor:
+        dict_futures = {}
+        for job in list_pending_jobs:
+            dict_futures[executor.submit(run_traced, run_job, job, settings)] = job
+
+        for future in concurrent.futures.as_completed(dict_futures):
+            job = dict_futures[future]
+            try:
+                error = merge_trace(future.result())
+            except Exception as pool_error:  # The worker process stopped (e.g. out of memory)
+                error = type(pool_error).__name__ + ": " + str(pool_error)
+
+            record = {"id": job["id"], "key": get_job_key(job, settings), "status": "done",
+                      "time": datetime.datetime.now().isoformat()}
+            if error == "":
+                done_jobs = done_jobs + 1
+                write_message("Job done: " + job["id"])
+            else:
+                record["status"] = "failed"
+                record["error"] = error
+                failed_jobs = failed_jobs + 1
+                write_message("ERROR: Job failed: " + job["id"] + " (" + error + ")")
+            write_checkpoint(journal, json.dumps(record))
+
+    return done_jobs, failed_jobs, skipped_jobs
+
+
+# Claims the oldest job of a job queue folder, see "run_worker"
+# A queued job is a JSON file ("*.json") with a job of a manifest (see "read_job_manifest"), written to another name
+# and renamed to "*.json" once complete. A claimed job is renamed to "*.running", the rename is atomic and a job is
+# only claimed by one of the workers sharing the queue folder
+# Returns the claimed job file, or "" if the queue is empty
+def claim_queued_job(queue_folder):
+    list_job_files = []
+    for entry in os.scandir(queue_folder):
+        if entry.name.endswith(".json") and entry.is_file():
+            list_job_files.append([entry.stat().st_mtime_ns, entry.path])
+
+    for job_mtime, job_file in sorted(list_job_files):
+        running_job_file = job_file[:-len(".json")] + ".running"
+        try:
+            os.rename(job_file, running_job_file)
+        except FileNotFoundError:  # Claimed by another worker
+            continue
+        return running_job_file
+
+    return ""
+
+
+# Runs a claimed job of a job queue folder in this process (see "claim_queued_job" and "run_job")
+# The job and its result ("status", "error" and "time") are written to "*.done" or "*.failed"
+# A job left "*.running" by a stopped worker is not run again unless it is renamed to "*.json"
+# Returns "" if the job succeeded, otherwise the error
+def run_queued_job(running_job_file):
+    job_name = running_job_file[:-len(".running")]
+    try:
+        with open(running_job_file) as job_file:
+            job = json.load(job_file)
+        job["id"] = str(job.get("id", os.path.basename(job_name)))
+        error = check_job(job)
+    except (OSError, ValueError, AttributeError) as job_error:
+        job = {"id": os.path.basename(job_name)}
+        error = "The job cannot be read (" + str(job_error) + ")"
+    if error == "":
+        error = run_job(job, {})
+
+    job["status"] = "done"
+    job["time"] = datetime.datetime.now().isoformat()
+    if error == "":
+        write_message("Job done: " + job["id"])
+    else:
+        job["status"] = "failed"
+        job["error"] = error
+        write_message("ERROR: Job failed: " + job["id"] + " (" + error + ")")
+    temp_result = job_name + ".result"
+    with open(temp_result, "w") as result_file:
+        json.dump(job, result_file, indent=1)
+    os.replace(temp_result, job_name + "." + job["status"])
+    os.remove(running_job_file)
+
+    return error
+
+
+# Gets the Sentinel-2 products of an input folder which are ready to be processed, see "run_worker"
+# Products are zip files ("S2*.zip") and SAFE folders (their metadata file). A product is ready once its size and
+# modified time did not change since the previous poll (dict_product_states: {product: (size, modified time)}),
+# products which are still being copied are skipped. SAFE folders should be moved into the folder once complete
+# The folder is scanned quietly, only new products are reported
+# Returns a list of [product, (size, modified time)]
+def get_ready_products(input_folder, dict_product_states):
+    dict_files = scan_files(input_folder, verbose=False)
+
+    list_ready_products = []
+    for product, size, mtime in dict_files["zips"] + dict_files["metadata"]:
+        if product.endswith(".zip") and not os.path.basename(product).startswith("S2"):
+            continue
+        try:  # The scan can be read from the catalog, the current size is needed
+            product_stat = os.stat(product)
+        except FileNotFoundError:  # Removed since the scan
+            continue
+        product_state = (product_stat.st_size, product_stat.st_mtime_ns)
+        if dict_product_states.get(product) == product_state:
+            list_ready_products.append([product, product_state])
+        elif product not in dict_product_states:
+            write_message("New product found: " + product)
+        dict_product_states[product] = product_state
+
+    return sorted(list_ready_products)
+
+
+# Creates the job processing a Sentinel-2 product of a worker with "s2_process_product", see "run_worker"
+# The output is output_folder + product name + ".tif", the index rasters output_folder + product name + "_" + index
+# name + ".tif" (see INDEX_EXPRESSIONS)
+# Returns the job, or None if the product metadata is not found
+def get_product_job(product, output_folder, epsg_code, resampling_str, band_groups, index_names):
+    if product.endswith(".zip"):
+        metadata, raw_folder = s2_get_zip_metadata(product, output_folder + "extracted/")
+        if metadata == "":
+            return None
+        product_name = os.path.basename(product)[:-len(".zip")]
+    else:
+        metadata = product
+        raw_folder = os.path.dirname(product) + "/"
+        product_name = os.path.basename(os.path.dirname(product))
+    if product_name.endswith(".SAFE"):
+        product_name = product_name[:-len(".SAFE")]
+    s2_level = os.path.basename(metadata)[len("MTD_MSI"):len("MTD_MSI") + 3]  # e.g. "MTD_MSIL2A.xml": "L2A"
+
+    output_raster = output_folder + product_name + ".tif"
+    index_outputs = {}
+    for index_name in index_names:
+        index_outputs[output_folder + product_name + "_" + index_name + ".tif"] = INDEX_EXPRESSIONS[index_name]
+
+    return {"id": product, "operation": "s2_process_product",
+            "args": [metadata, raw_folder, s2_level, output_raster, resampling_str, epsg_code, list(band_groups)],
+            "kwargs": {"index_outputs": index_outputs}, "outputs": [output_raster] + list(index_outputs)}
+
+
+# Runs a worker process which takes jobs from a job queue folder and/or processes the new Sentinel-2 products of an
+# input folder, until it is stopped (Ctrl+C) or max_polls polls were done (0: no limit)
+# The worker keeps its state between jobs: the modules are imported once (see "import_lazy") and GDAL keeps running
+# with a block cache of MAX_MEMORY (see "limit_block_cache"). The caches are cleared after each job (see
+# "clear_caches"), the memory of the worker does not grow with the number of processed files
+# queue_folder: Jobs are run in the order they were queued, see "claim_queued_job". Queued jobs run first
+# input_folder: New products (see "get_ready_products") are projected to epsg_code and written to output_folder, see
+# "get_product_job". The products are recorded in output_folder + "worker.journal", a restarted worker skips the
+# processed products. A product which changed is processed again, failed products are retried when the worker restarts
+# Idle workers poll the folders every WORKER_POLL_INTERVAL seconds
+# Returns the number of done and failed jobs and products
+@trace_function
+def run_worker(queue_folder="", input_folder="", output_folder="", epsg_code="", resampling_str="bilinear",
+               band_groups=("10m", "20m", "60m"), index_names=(), max_polls=0):
+    if queue_folder == "" and input_folder == "":
+        write_message("ERROR: The worker needs a job queue folder or an input folder")
+        return None
+    if input_folder != "" and (output_folder == "" or epsg_code == ""):
+        write_message("ERROR: The worker needs an output folder and a projection to process the input folder")
+        return None
+    for index_name in index_names:
+        if index_name not in INDEX_EXPRESSIONS:
+            write_message("ERROR: Unknown index: " + index_name)
+            return None
+
+    journal = ""
+    dict_finished_products = {}
+    set_failed_products = set()
+    dict_product_states = {}
+    if input_folder != "":
+        create_output_folder(output_folder)
+        journal = output_folder + "worker.journal"
+        dict_finished_products = read_job_journal(journal)
+    worker_settings = [output_folder, str(epsg_code), resampling_str, list(band_groups), list(index_names)]
+
+    done_jobs = 0
+    failed_jobs = 0
+    polls = 0
+    try:
+        with limit_block_cache():
+            get_crs("wgs84")  # Starts GDAL and PROJ
+            if epsg_code != "":
+                get_crs(epsg_code)
+            write_message("Worker started")
+
+            while max_polls == 0 or polls < max_polls:
+                polls = polls + 1
+                list_errors = []
+                if queue_folder != "":
+                    running_job_file = claim_queued_job(queue_folder)
+                    if running_job_file != "":
+                        list_errors.append(run_queued_job(running_job_file))
+
+                if input_folder != "" and len(list_errors) == 0:
+                    for product, product_state in get_ready_products(input_folder, dict_product_states):
+                        key = get_job_key([product, product_state], worker_settings)
+                        if dict_finished_products.get(product) == key or key in set_failed_products:
+                            continue
+                        job = get_product_job(product, output_folder, epsg_code, resampling_str, band_groups,
+                                              index_names)
+                        error = "Sentinel-2 metadata not found" if job is None else run_job(job, {})
+
+                        record = {"id": product, "key": key, "status": "done",
+                                  "time": datetime.datetime.now().isoformat()}
+                        if error == "":
+                            dict_finished_products[product] = key
+                            write_message("Product done: " + product)
+                        else:
+                            record["status"] = "failed"
+                            record["error"] = error
+                            set_failed_products.add(key)
+                            write_message("ERROR: Product failed: " + product + " (" + error + ")")
+                        write_checkpoint(journal, json.dumps(record))
+                        list_errors.append(error)
+
+                done_jobs = done_jobs + list_errors.count("")
+                failed_jobs = failed_jobs + len(list_errors) - list_errors.count("")
+                if len(list_errors) > 0:
+                    clear_caches()
+                if len(list_errors) == 0 and (max_polls == 0 or polls < max_polls):  # Idle
+                    time.sleep(WORKER_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        write_message("Worker stopped")
+
+    return done_jobs, failed_jobs
+
+
+# Starts a worker, see "run_worker"
+# python open_source_template_v01.py worker queue_folder/
+# python open_source_template_v01.py worker queue_folder/ input_folder/ output_folder/ epsg_code
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "worker":
+        run_worker(sys.argv[2])
+    elif len(sys.argv) == 6 and sys.argv[1] == "worker":
+        run_worker(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
+    else:
+        print("Usage: python open_source_template_v01.py worker queue_folder/")
+        print("       python open_source_template_v01.py worker queue_folder/ input_folder/ output_folder/ epsg_code")
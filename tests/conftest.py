@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+import open_source_template_v01 as template  # noqa: E402
+
+
+# Restores the settings of the template module after each test
+@pytest.fixture(autouse=True)
+def settings(tmp_path):
+    previous_settings = template.get_settings()
+    template.VERBOSE = False
+    template.CACHE_DIR = str(tmp_path / "cache") + "/"
+    yield
+    template.set_settings(previous_settings)
+
+
+# Writes a synthetic raster window by window (256 rows), the raster is never held in memory at once
+# The peak memory of the test process stays low, processes started by a test inherit it (Linux)
+# values: Function (row offset, column offset, height, width, band) which returns the pixels of a window
+def write_synthetic_raster(raster, width, height, band_count, values, dtype="uint16", resolution=10, nodata=None):
+    profile = {"driver": "GTiff", "width": width, "height": height, "count": band_count, "dtype": dtype,
+               "crs": "EPSG:32734", "transform": from_origin(300000, 7000000, resolution, resolution),
+               "tiled": True, "blockxsize": 256, "blockysize": 256, "nodata": nodata}
+    with rasterio.open(raster, "w", **profile) as raster_obj:
+        for band in range(1, band_count + 1):
+            for row_offset in range(0, height, 256):
+                window_height = min(256, height - row_offset)
+                window = rasterio.windows.Window(0, row_offset, width, window_height)
+                raster_obj.write(values(row_offset, 0, window_height, width, band).astype(dtype), band,
+                                 window=window)
+
+    return raster
+
+
+# Pixel values which vary over the raster and between the bands
+def gradient_values(row_offset, column_offset, height, width, band):
+    rows, columns = np.mgrid[row_offset:row_offset + height, column_offset:column_offset + width]
+    return (rows * 7 + columns * 3 + band * 1000) % 10000 + 1
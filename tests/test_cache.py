@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import rasterio
+
+from conftest import gradient_values, template, write_synthetic_raster
+
+
+def test_rerun_skips_downstream_steps(tmp_path):
+    list_bands = []
+    for band in range(3):
+        list_bands.append(write_synthetic_raster(str(tmp_path / ("band" + str(band) + ".tif")), 512, 512, 1,
+                                                 lambda *window: gradient_values(*window[:4], band + 1)))
+    stack_raster = str(tmp_path / "stack.tif")
+    restack_raster = str(tmp_path / "restack.tif")
+
+    list_stats = []
+    for run in range(3):
+        template.stack_rasters(list_bands, stack_raster)
+        template.restack_bands(stack_raster, restack_raster, [3, 2, 1])
+        list_stats.append([os.stat(stack_raster), os.stat(restack_raster)])
+
+    for stack_stat, restack_stat in list_stats[1:]:  # Cached results, the outputs are not written again
+        assert (stack_stat.st_ino, stack_stat.st_mtime_ns) == (list_stats[0][0].st_ino, list_stats[0][0].st_mtime_ns)
+        assert (restack_stat.st_ino, restack_stat.st_mtime_ns) == (list_stats[0][1].st_ino,
+                                                                   list_stats[0][1].st_mtime_ns)
+
+    cached_file = template.get_cached_file(template.get_cache_key("stack_rasters", list_bands,
+                                                                  [template.RESAMPLE, template.SPATIAL_RES,
+                                                                   template.RESAMPLING]), stack_raster)
+    assert not os.path.samefile(cached_file, stack_raster)
+    assert os.stat(cached_file).st_mtime_ns == list_stats[0][0].st_mtime_ns
+    assert os.path.exists(cached_file + ".used")
+
+
+# An output changed in place does not change the cached result, the next run restores the output from the cache
+def test_changed_output_does_not_change_the_cache(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 300, 200, 1, gradient_values)
+    output_raster = str(tmp_path / "copy.tif")
+    template.copy_raster(input_raster, output_raster, False)
+    with rasterio.open(input_raster) as raster_obj:
+        expected = raster_obj.read()
+
+    with rasterio.open(output_raster, "r+") as raster_obj:
+        raster_obj.write(np.zeros((1, 200, 300), dtype=np.uint16))
+    cached_file = template.get_cached_file(template.get_cache_key("copy_raster", [input_raster], []), output_raster)
+    with rasterio.open(cached_file) as raster_obj:
+        assert np.array_equal(raster_obj.read(), expected)
+
+    template.copy_raster(input_raster, output_raster, False)
+    with rasterio.open(output_raster) as raster_obj:
+        assert np.array_equal(raster_obj.read(), expected)
+
+
+# Without CACHE_DIR and TEMP_LOC the cache is kept in the cache folder of the user, not in the working directory
+def test_default_cache_folder(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "user_cache"))
+    template.CACHE_DIR = ""
+    template.TEMP_LOC = ""
+    assert template.get_cache_folder() == str(tmp_path / "user_cache" / "open_source_template") + "/"
+    assert os.path.isdir(template.get_cache_folder())
+
+
+def test_evict_cache_keeps_recently_used_results(tmp_path):
+    cache_folder = template.get_cache_folder()
+    for name, used_time in [["old", 1000], ["recent", 3000]]:
+        with open(cache_folder + name + ".tif", "wb") as cached_file:
+            cached_file.write(b"0" * 700 * 1024)
+        os.utime(cache_folder + name + ".tif", (1000, 1000))
+        template.mark_cache_used(cache_folder + name + ".tif")
+        os.utime(cache_folder + name + ".tif.used", (used_time, used_time))
+    template.CACHE_MAX_AGE = 1000000
+    template.CACHE_MAX_SIZE = 1
+
+    template.evict_cache()
+    assert sorted(os.listdir(cache_folder)) == ["recent.tif", "recent.tif.used"]
+
+
+def test_project_raster_grid_is_part_of_the_key(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 600, 500, 1,
+                                          lambda *window: gradient_values(*window[:4], 1))
+    output_raster = str(tmp_path / "projected.tif")
+    template.project_raster(input_raster, output_raster, "nearest", "EPSG:32734")
+    with rasterio.open(output_raster) as raster_obj:
+        assert (raster_obj.width, raster_obj.height) == (600, 500)
+
+    dst_grid = (rasterio.Affine(30, 0, 300000, 0, -30, 7000000), 200, 167)
+    template.project_raster(input_raster, output_raster, "nearest", "EPSG:32734", dst_grid)
+    with rasterio.open(output_raster) as raster_obj:
+        assert (raster_obj.width, raster_obj.height) == (200, 167)
+        assert raster_obj.transform == dst_grid[0]
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import gradient_values, template, write_synthetic_raster
+
+
+# Pixel values of which the top 3000 rows are zero (empty, skipped while streaming)
+def partly_zero_values(row_offset, column_offset, height, width, band):
+    data = gradient_values(row_offset, column_offset, height, width, band)
+    rows = np.arange(row_offset, row_offset + height)[:, np.newaxis]
+    return np.where(rows < 3000, 0, data)
+
+
+@pytest.mark.parametrize("nodata", [None, 0])
+def test_streamed_statistics_match_raster_statistics(tmp_path, nodata):
+    template.CATALOG = str(tmp_path / "catalog.sqlite")
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 2000, 4000, 1, partly_zero_values,
+                                          nodata=nodata)
+    output_raster = str(tmp_path / "copy.tif")
+    template.copy_raster(input_raster, output_raster, True)
+
+    list_band_statistics = template.query_catalog()[-1][7]
+    list_statistics = template.get_raster_statistics(output_raster)[1]
+    assert len(list_band_statistics) == len(list_statistics)
+    for band_statistics, statistics in zip(list_band_statistics, list_statistics):
+        assert band_statistics[2:4] == statistics[0:2]
+        assert band_statistics[4] == pytest.approx(statistics[2] / statistics[3])
+        assert band_statistics[5] == statistics[3]
+    if nodata is None:  # The zeros are valid pixels
+        assert list_band_statistics[0][5] == 2000 * 4000
+
+
+# A folder which cannot be listed is skipped, the rest of the folder tree is scanned and the folder is scanned again
+# by the next scan. Root can list folders without permissions, the denied listing is therefore also simulated
+def test_scan_skips_unreadable_folders(tmp_path, monkeypatch):
+    template.CATALOG = str(tmp_path / "catalog.sqlite")
+    for folder in ["data/readable", "data/locked/inner"]:
+        os.makedirs(str(tmp_path / folder))
+    for raster in ["data/readable/a.tif", "data/locked/b.tif", "data/locked/inner/c.tif"]:
+        with open(str(tmp_path / raster), "wb") as raster_file:
+            raster_file.write(b"0")
+    os.symlink(str(tmp_path / "missing.tif"), str(tmp_path / "data/readable/broken.tif"))
+    locked_folder = str(tmp_path / "data/locked")
+
+    scandir = os.scandir
+
+    def denied_scandir(folder):
+        if os.path.normpath(folder) == locked_folder:
+            raise PermissionError(13, "Permission denied", folder)
+        return scandir(folder)
+
+    monkeypatch.setattr(template.os, "scandir", denied_scandir)
+    os.chmod(locked_folder, 0)
+    try:
+        dict_files = template.scan_files(str(tmp_path / "data"))
+    finally:
+        os.chmod(locked_folder, 0o755)
+        monkeypatch.setattr(template.os, "scandir", scandir)
+    assert [os.path.basename(raster[0]) for raster in dict_files["rasters"]] == ["a.tif"]
+
+    dict_files = template.scan_files(str(tmp_path / "data"))
+    assert sorted(os.path.basename(raster[0]) for raster in dict_files["rasters"]) == ["a.tif", "b.tif", "c.tif"]
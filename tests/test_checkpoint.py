@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+
+from conftest import gradient_values, template, write_synthetic_raster
+
+
+# Copies the raster with checkpoints, the copy is interrupted after the provided number of segments (pipeline runs)
+# Returns the trace counters of the copy
+def copy_with_checkpoints(monkeypatch, input_raster, output_raster, interrupted_segments=None):
+    run_pipeline = template.run_pipeline
+    list_segments = []
+
+    def interrupted_pipeline(list_tasks, read_function, write_function):
+        if len(list_segments) == interrupted_segments:
+            run_pipeline(list_tasks[:len(list_tasks) // 2], read_function, write_function)
+            raise KeyboardInterrupt()
+        list_segments.append(list_tasks)
+        run_pipeline(list_tasks, read_function, write_function)
+
+    monkeypatch.setattr(template, "run_pipeline", interrupted_pipeline)
+    template.reset_trace()
+    try:
+        template.copy_raster(input_raster, output_raster, True)
+        return dict(template.TRACE_COUNTERS)
+    finally:
+        monkeypatch.setattr(template, "run_pipeline", run_pipeline)
+        template.reset_trace()
+
+
+@pytest.fixture
+def checkpoint_settings():
+    template.TRACE = True
+    template.MAX_MEMORY = 1  # Many small windows
+    template.CHECKPOINT_INTERVAL = 1  # A checkpoint after about 1 MB of windows
+    template.SPARSE_BLOCKS = False
+
+
+# An interrupted copy is resumed after its last checkpoint and is identical to an uninterrupted copy
+def test_interrupted_copy_is_resumed(tmp_path, monkeypatch, checkpoint_settings):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 1500, 1200, 2, gradient_values)
+    expected_raster = str(tmp_path / "expected.tif")
+    counters = copy_with_checkpoints(monkeypatch, input_raster, expected_raster)
+    total_pixels = counters["pixels"]
+    assert counters.get("windows_resumed", 0) == 0
+
+    output_raster = str(tmp_path / "output.tif")
+    with pytest.raises(KeyboardInterrupt):
+        copy_with_checkpoints(monkeypatch, input_raster, output_raster, 3)
+    assert not os.path.exists(output_raster)
+    assert os.path.exists(str(tmp_path / "output.partial.tif.checkpoint"))
+
+    counters = copy_with_checkpoints(monkeypatch, input_raster, output_raster)
+    assert counters["windows_resumed"] > 0
+    assert counters["pixels"] < total_pixels  # The checkpointed windows are not read again
+    assert not os.path.exists(str(tmp_path / "output.partial.tif.checkpoint"))
+    with open(expected_raster, "rb") as expected_file, open(output_raster, "rb") as output_file:
+        assert expected_file.read() == output_file.read()
+
+
+# A checkpoint of other sources (the input changed) or of another output is not resumed, the output is written again
+@pytest.mark.parametrize("change", ["input", "checkpoint"])
+def test_stale_checkpoint_is_discarded(tmp_path, monkeypatch, checkpoint_settings, change):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 1500, 1200, 2, gradient_values)
+    output_raster = str(tmp_path / "output.tif")
+    with pytest.raises(KeyboardInterrupt):
+        copy_with_checkpoints(monkeypatch, input_raster, output_raster, 3)
+
+    if change == "input":  # Other pixel values and modified time
+        write_synthetic_raster(input_raster, 1500, 1200, 2, lambda *window: gradient_values(*window) + 5)
+    else:  # A checkpoint of an output with other arguments
+        with open(str(tmp_path / "output.partial.tif.checkpoint"), "w") as checkpoint_file:
+            checkpoint_file.write("0" * 64 + "\n")
+
+    counters = copy_with_checkpoints(monkeypatch, input_raster, output_raster)
+    assert counters.get("windows_resumed", 0) == 0
+    with rasterio.open(input_raster) as raster_obj, rasterio.open(output_raster) as output_obj:
+        assert np.array_equal(raster_obj.read(), output_obj.read())
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import rasterio
+
+from conftest import gradient_values, template, write_synthetic_raster
+
+BAND_VARIABLES = {"b1": 1, "b2": 2, "B04": 1, "B08": 2}
+
+
+def test_ndvi_matches_numpy():
+    red = np.array([[100, 200], [0, 300]], dtype=np.uint16)
+    nir = np.array([[300, 200], [0, 900]], dtype=np.uint16)
+    expression_code, used_variables = template.compile_expression("ndvi", BAND_VARIABLES)
+    assert used_variables == {"B04": 1, "B08": 2}
+
+    nodata_mask = template.get_nodata_mask([red, nir], 0, True)
+    result = template.evaluate_expression(expression_code, {"B04": red, "B08": nir}, nodata_mask)
+    with np.errstate(invalid="ignore"):
+        expected = (nir.astype(np.float32) - red) / (nir.astype(np.float32) + red)
+    expected[1, 0] = np.nan  # Nodata
+    assert result.dtype == np.float32
+    assert np.array_equal(result, expected, equal_nan=True)
+
+
+@pytest.mark.parametrize("expression", ["B08.sum()", "np.sqrt(B08)", "__import__('os')", "open('file')",
+                                        "B08[0]", "B99 + B04", "(lambda: B08)()", "'B08'", "B08 if B04 else B04",
+                                        "B08 < B04", "sqrt", "2 + 3", "B08 +"])
+def test_disallowed_expressions_raise(expression):
+    with pytest.raises(ValueError):
+        template.compile_expression(expression, BAND_VARIABLES)
+
+
+def test_calculate_index_matches_numpy(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 700, 600, 2,
+                                          lambda *window: gradient_values(*window), nodata=0)
+    with rasterio.open(input_raster, "r+") as raster_obj:  # Nodata pixels in one of the bands
+        raster_obj.write(np.zeros((50, 700), dtype=np.uint16), 1, window=rasterio.windows.Window(0, 100, 700, 50))
+    cache_max = rasterio.env.get_gdal_config("GDAL_CACHEMAX")
+
+    output_raster = str(tmp_path / "index.tif")
+    template.calculate_index(input_raster, output_raster, "sqrt(b2 * b1) / (b1 + b2)")
+    assert rasterio.env.get_gdal_config("GDAL_CACHEMAX") == cache_max
+
+    with rasterio.open(input_raster) as raster_obj:
+        b1, b2 = raster_obj.read().astype(np.float32)
+    expected = np.sqrt(b2 * b1) / (b1 + b2)
+    expected[(b1 == 0) | (b2 == 0)] = np.nan
+    with rasterio.open(output_raster) as index_raster_obj:
+        assert np.allclose(index_raster_obj.read(1), expected, equal_nan=True)
@@ -0,0 +1,34 @@
+import zipfile
+
+from conftest import template
+
+METADATA_XML = ('<?xml version="1.0" encoding="UTF-8"?>\n<n1:Level-2A_User_Product xmlns:n1="https://psd-14.sentinel2.'
+                'eo.esa.int/PSD/User_Product_Level-2A.xsd">\n<n1:General_Info>\n<Product_Info>\n<PRODUCT_URI>'
+                'S2A_MSIL2A_20200105T075311_N0213_R135_T34JBL_20200105T101613.SAFE</PRODUCT_URI>\n</Product_Info>\n'
+                '</n1:General_Info>\n<n1:Quality_Indicators_Info>\n<Cloud_Coverage_Assessment>12.5'
+                '</Cloud_Coverage_Assessment>\n</n1:Quality_Indicators_Info>\n</n1:Level-2A_User_Product>\n')
+
+
+# Missing files, zip members and invalid zip files are reported in the records, the batch is not stopped
+def test_unreadable_metadata_does_not_stop_the_batch(tmp_path):
+    metadata = str(tmp_path / "MTD_MSIL2A.xml")
+    with open(metadata, "w") as metadata_file:
+        metadata_file.write(METADATA_XML)
+    zip_file = str(tmp_path / "product.zip")
+    with zipfile.ZipFile(zip_file, "w") as zip_obj:
+        zip_obj.writestr("product.SAFE/MTD_MSIL2A.xml", METADATA_XML)
+    invalid_zip_file = str(tmp_path / "invalid.zip")
+    with open(invalid_zip_file, "w") as invalid_file:
+        invalid_file.write("not a zip file")
+
+    list_metadata = [metadata, str(tmp_path / "missing.xml"),
+                     template.get_vsizip_path(zip_file, "product.SAFE/") + "MTD_MSIL2A.xml",
+                     template.get_vsizip_path(zip_file, "product.SAFE/") + "MTD_MSIL1C.xml",
+                     template.get_vsizip_path(invalid_zip_file, "product.SAFE/") + "MTD_MSIL2A.xml"]
+    template.METADATA_PROCESSES = 2
+    list_records = template.read_sentinel2_metadata_batch(list_metadata)
+
+    assert [record["error"] == "" for record in list_records] == [True, False, True, False, False]
+    assert [record["tile"] for record in list_records] == ["34JBL", "", "34JBL", "", ""]
+    assert list_records[1]["error"].startswith("FileNotFoundError")
+    assert list_records[3]["error"].startswith("KeyError")
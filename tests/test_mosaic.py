@@ -0,0 +1,56 @@
+import numpy as np
+import rasterio
+
+from conftest import gradient_values, template, write_synthetic_raster
+
+
+# Writes the window of the raster as a tile with the same grid, pixels inside the holes are set to nodata
+def write_tile(raster_obj, tile, window, list_holes=()):
+    data = raster_obj.read(window=window)
+    for hole in list_holes:
+        rows = slice(hole[0] - window.row_off, hole[1] - window.row_off)
+        data[:, rows, hole[2] - window.col_off:hole[3] - window.col_off] = 0
+    profile = raster_obj.profile
+    profile.update(width=window.width, height=window.height, transform=raster_obj.window_transform(window))
+    with rasterio.open(tile, "w", **profile) as tile_obj:
+        tile_obj.write(data)
+
+    return tile
+
+
+# Overlapping tiles of a raster are mosaicked back to the raster, nodata of a tile is filled by the other tiles
+def test_tiles_mosaic_to_the_original(tmp_path):
+    cache_max = rasterio.env.get_gdal_config("GDAL_CACHEMAX")
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 900, 700, 2, gradient_values, nodata=0)
+    Window = rasterio.windows.Window
+    with rasterio.open(input_raster) as raster_obj:
+        list_tiles = [  # The holes (row start, row end, column start, column end) are inside the overlaps
+            write_tile(raster_obj, str(tmp_path / "tile1.tif"), Window(0, 0, 520, 400), [(300, 400, 400, 520)]),
+            write_tile(raster_obj, str(tmp_path / "tile2.tif"), Window(400, 0, 500, 400), [(0, 120, 400, 480)]),
+            write_tile(raster_obj, str(tmp_path / "tile3.tif"), Window(0, 300, 900, 400), [(300, 360, 0, 900)])]
+
+    output_raster = str(tmp_path / "mosaic.tif")
+    template.mosaic_rasters(list_tiles, output_raster, "nearest", "EPSG:32734")
+    assert rasterio.env.get_gdal_config("GDAL_CACHEMAX") == cache_max
+
+    with rasterio.open(input_raster) as raster_obj, rasterio.open(output_raster) as mosaic_obj:
+        assert mosaic_obj.transform == raster_obj.transform
+        assert (mosaic_obj.width, mosaic_obj.height) == (raster_obj.width, raster_obj.height)
+        assert mosaic_obj.nodata == 0
+        assert np.array_equal(mosaic_obj.read(), raster_obj.read())
+
+
+# Pixels without data in any tile stay nodata
+def test_gaps_stay_nodata(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 600, 300, 1, gradient_values, nodata=0)
+    Window = rasterio.windows.Window
+    with rasterio.open(input_raster) as raster_obj:
+        list_tiles = [write_tile(raster_obj, str(tmp_path / "tile1.tif"), Window(0, 0, 250, 300)),
+                      write_tile(raster_obj, str(tmp_path / "tile2.tif"), Window(350, 0, 250, 300))]
+        expected = raster_obj.read()
+    expected[:, :, 250:350] = 0
+
+    output_raster = str(tmp_path / "mosaic.tif")
+    template.mosaic_rasters(list_tiles, output_raster, "nearest", "EPSG:32734")
+    with rasterio.open(output_raster) as mosaic_obj:
+        assert np.array_equal(mosaic_obj.read(), expected)
@@ -0,0 +1,74 @@
+import os
+import time
+
+import numpy as np
+import rasterio
+import rasterio.warp
+
+from conftest import template, write_synthetic_raster
+
+
+# Smooth pixel values, bilinear resampling of neighbouring pixels stays close to the source values
+def smooth_values(row_offset, column_offset, height, width, band):
+    rows, columns = np.mgrid[row_offset:row_offset + height, column_offset:column_offset + width]
+    return rows * 3 + columns * 2 + band * 100 + 1
+
+
+# The source windows of a grid pair are transformed once and reused by the next stack with the same grids
+def test_source_windows_are_reused(tmp_path):
+    template.SOURCE_WINDOWS_CACHE.clear()
+    template.RESAMPLE = False
+    list_outputs = []
+    for name in ["first", "second"]:
+        list_bands = [write_synthetic_raster(str(tmp_path / (name + "_B04.tif")), 600, 500, 1, smooth_values,
+                                             nodata=0),
+                      write_synthetic_raster(str(tmp_path / (name + "_B11.tif")), 300, 250, 1, smooth_values,
+                                             resolution=20, nodata=0)]
+        list_outputs.append(str(tmp_path / (name + "_stack.tif")))
+        template.stack_rasters(list_bands, list_outputs[-1])
+    assert len(template.SOURCE_WINDOWS_CACHE) == 1
+
+    with rasterio.open(list_outputs[0]) as first_raster, rasterio.open(list_outputs[1]) as second_raster:
+        assert np.array_equal(first_raster.read(), second_raster.read())
+
+
+# The projection is the output of the multithreaded GDAL warper warping all bands at once, and not slower
+def test_projection_matches_the_one_shot_warp(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 2000, 2000, 2, smooth_values, nodata=0)
+    output_raster = str(tmp_path / "projected.tif")
+    start_time = time.perf_counter()
+    template.project_raster(input_raster, output_raster, "bilinear", "lo19")
+    project_time = time.perf_counter() - start_time
+
+    with rasterio.open(input_raster) as source_raster, rasterio.open(output_raster) as projected_raster:
+        expected = np.zeros((2, projected_raster.height, projected_raster.width), dtype=np.uint16)
+        start_time = time.perf_counter()
+        rasterio.warp.reproject(source=rasterio.band(source_raster, [1, 2]), destination=expected,
+                                src_transform=source_raster.transform, src_crs=source_raster.crs,
+                                dst_transform=projected_raster.transform, dst_crs=template.get_crs("lo19"),
+                                resampling=rasterio.enums.Resampling.bilinear, dst_nodata=0,
+                                num_threads=template.PROJECT_THREADS, warp_mem_limit=template.WARP_MEMORY)
+        warp_time = time.perf_counter() - start_time
+        assert np.array_equal(projected_raster.read(), expected)
+    assert project_time < warp_time * 2 + 0.5
+
+
+# Chunks of the output grid without source pixels are not written, the output is sparse
+def test_projection_outside_the_source_is_sparse(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 500, 500, 1, smooth_values, nodata=0)
+    with rasterio.open(input_raster) as source_raster:
+        transform, width, height = template.get_default_transform(source_raster.crs, "lo19", source_raster.width,
+                                                                   source_raster.height, source_raster.bounds)
+    dst_grid = (transform, width * 4, height * 4)  # The source covers the top left of the output grid
+    template.WARP_MEMORY = 1
+    template.OVERWRITE = True  # The sparse output is not taken from the cache
+
+    list_outputs = []
+    for sparse_blocks in [False, True]:
+        template.SPARSE_BLOCKS = sparse_blocks
+        list_outputs.append(str(tmp_path / ("projected_" + str(sparse_blocks) + ".tif")))
+        template.project_raster(input_raster, list_outputs[-1], "bilinear", "lo19", dst_grid)
+
+    with rasterio.open(list_outputs[0]) as dense_raster, rasterio.open(list_outputs[1]) as sparse_raster:
+        assert np.array_equal(dense_raster.read(), sparse_raster.read())
+    assert os.path.getsize(list_outputs[1]) < os.path.getsize(list_outputs[0]) / 2
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+import rasterio
+import rasterio.warp
+
+from conftest import gradient_values, template, write_synthetic_raster
+
+
+# The decimated reads of a downsampled raster are aligned to its grid, the pixels equal a nearest neighbour warp
+@pytest.mark.parametrize("width, height", [(1000, 800), (999, 801), (1001, 799)])
+def test_downsampling_matches_the_output_grid(tmp_path, width, height):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), width, height, 1,
+                                          lambda *window: gradient_values(*window[:4], 1), resolution=20)
+    output_raster = str(tmp_path / "resampled.tif")
+    template.resample_raster(input_raster, output_raster, "nearest", 60)
+
+    with rasterio.open(input_raster) as source_raster, rasterio.open(output_raster) as resampled_raster:
+        assert resampled_raster.res == (60, 60)
+        expected = np.zeros((resampled_raster.height, resampled_raster.width), dtype=resampled_raster.dtypes[0])
+        rasterio.warp.reproject(rasterio.band(source_raster, 1), expected, dst_transform=resampled_raster.transform,
+                                dst_crs=resampled_raster.crs, resampling=rasterio.enums.Resampling.nearest)
+        assert np.array_equal(resampled_raster.read(1), expected)
@@ -0,0 +1,123 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import rasterio
+
+from conftest import REPO_FOLDER, gradient_values, template, write_synthetic_raster
+
+# Stacks the bands in a new process (the peak memory only includes this stack) and prints the memory (MB) before
+# stacking and the peak memory after stacking. On Linux the current (VmRSS) and peak (VmHWM) memory of the process are
+# used, the peak memory of "get_peak_memory" includes the peak memory of the parent process (pytest)
+# Arguments: streaming ("1" or "0"), MAX_MEMORY, output raster, bands
+STACK_CODE = """
+import os
+import sys
+import open_source_template_v01 as template
+
+
+def get_memory(field):
+    if not os.path.exists("/proc/self/status"):
+        return template.get_peak_memory()
+    with open("/proc/self/status") as status_file:
+        for line in status_file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024.0
+
+
+template.VERBOSE = False
+template.OVERWRITE = True
+template.CACHE_DIR = os.path.dirname(sys.argv[3]) + "/cache/"
+template.STREAMING = sys.argv[1] == "1"
+template.MAX_MEMORY = int(sys.argv[2])
+with template.rasterio.open(sys.argv[4]) as raster_obj:  # Imports rasterio and starts GDAL before measuring
+    raster_obj.read(1, window=template.rasterio.windows.Window(0, 0, 1, 1))
+start_memory = get_memory("VmRSS")
+template.stack_rasters(sys.argv[4:], sys.argv[3])
+print(start_memory, get_memory("VmHWM"))
+"""
+
+BAND_SIZE = 8000  # 8000 x 8000 uint16 bands, 122 MB each
+MAX_MEMORY = 32
+
+
+def stack_in_process(streaming, output_raster, list_bands):
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([REPO_FOLDER] + [environment.get("PYTHONPATH", "")])
+    output = subprocess.run([sys.executable, "-c", STACK_CODE, "1" if streaming else "0", str(MAX_MEMORY),
+                             output_raster] + list_bands, env=environment, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    start_memory, peak_memory = output.split()[-2:]
+    if start_memory == "None":  # Peak memory not available (Windows)
+        return None, None
+    return float(start_memory), float(peak_memory)
+
+
+def test_streamed_stack_memory_and_output(tmp_path):
+    list_bands = []
+    for band in range(4):
+        list_bands.append(write_synthetic_raster(str(tmp_path / ("band" + str(band) + ".tif")), BAND_SIZE, BAND_SIZE,
+                                                 1, lambda *window: gradient_values(*window[:4], band + 1)))
+    band_size = BAND_SIZE * BAND_SIZE * 2 / 1024.0 / 1024.0
+
+    streamed_raster = str(tmp_path / "streamed.tif")
+    start_memory, peak_memory = stack_in_process(True, streamed_raster, list_bands)
+    if start_memory is None:  # Peak memory not available (Windows)
+        return
+    # The windows held by the pipeline and the GDAL block cache are each bounded by MAX_MEMORY, the rest is used by
+    # GDAL (compression, file buffers) and NumPy temporaries
+    assert peak_memory - start_memory < MAX_MEMORY * 2 + 96
+    assert peak_memory - start_memory < band_size * len(list_bands) / 2
+
+    full_raster = str(tmp_path / "full.tif")
+    full_start_memory, full_peak_memory = stack_in_process(False, full_raster, list_bands)
+    assert full_peak_memory - full_start_memory > band_size  # Complete bands are read
+
+    with open(streamed_raster, "rb") as streamed_file, open(full_raster, "rb") as full_file:
+        assert streamed_file.read() == full_file.read()
+    with rasterio.open(streamed_raster) as raster_obj:
+        assert raster_obj.count == len(list_bands)
+
+
+
+# Streaming limits the GDAL block cache (process-wide) while it runs and restores it afterwards
+def test_streaming_keeps_the_gdal_cache_size(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 500, 500, 1,
+                                          lambda *window: gradient_values(*window[:4], 1))
+    cache_max = rasterio.env.get_gdal_config("GDAL_CACHEMAX")
+
+    template.copy_raster(input_raster, str(tmp_path / "copy.tif"), True)
+    assert rasterio.env.get_gdal_config("GDAL_CACHEMAX") == cache_max
+    with template.limit_block_cache():
+        assert rasterio.env.get_gdal_config("GDAL_CACHEMAX") == template.MAX_MEMORY * 1024 * 1024
+
+
+# Pixel values of which the area above the diagonal is zero (empty), like the edge of a swath
+def diagonal_edge_values(row_offset, column_offset, height, width, band):
+    data = gradient_values(row_offset, column_offset, height, width, band)
+    rows, columns = np.mgrid[row_offset:row_offset + height, column_offset:column_offset + width]
+    return np.where(columns > rows, 0, data)
+
+
+# Empty windows at the edge of the data are skipped with the default profile, the output is smaller and identical
+def test_empty_edge_windows_are_skipped(tmp_path):
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 2048, 2048, 1, diagonal_edge_values, nodata=0)
+    template.TRACE = True
+    template.MAX_MEMORY = 1  # Windows of a single block
+    list_outputs = []
+    list_skipped_windows = []
+    for sparse_blocks in [False, True]:
+        template.SPARSE_BLOCKS = sparse_blocks
+        template.reset_trace()
+        list_outputs.append(str(tmp_path / ("copy_" + str(sparse_blocks) + ".tif")))
+        template.copy_raster(input_raster, list_outputs[-1], True)
+        list_skipped_windows.append(template.TRACE_COUNTERS["windows_skipped"])
+    template.reset_trace()
+
+    assert list_skipped_windows[0] == 0
+    assert list_skipped_windows[1] >= 6  # Blocks of 512 by 512, 6 of the 16 blocks are above the diagonal
+    with rasterio.open(list_outputs[0]) as dense_raster, rasterio.open(list_outputs[1]) as sparse_raster:
+        assert sparse_raster.block_shapes[0] == (512, 512)
+        assert np.array_equal(dense_raster.read(), sparse_raster.read())
+    assert os.path.getsize(list_outputs[1]) < os.path.getsize(list_outputs[0]) * 0.7
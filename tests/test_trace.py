@@ -0,0 +1,25 @@
+from conftest import gradient_values, template, write_synthetic_raster
+
+
+# The spans and counters recorded by the worker processes are merged into the trace of this process
+def test_worker_traces_are_merged(tmp_path):
+    list_rasters = []
+    for name in ["first", "second"]:
+        list_rasters.append(write_synthetic_raster(str(tmp_path / (name + ".tif")), 600, 500, 1,
+                                                   lambda *window: gradient_values(*window[:4], 1)))
+    template.TRACE = True
+    template.PROJECT_PROCESSES = 2
+    template.reset_trace()
+    try:
+        template.project_rasters(list_rasters, template.create_output_folder(str(tmp_path / "projected") + "/"),
+                                 "bilinear", "lo19")
+        trace_summary = template.get_trace_summary()
+        list_process_ids = set(event["pid"] for event in template.TRACE_EVENTS if event["name"] == "project_raster")
+    finally:
+        template.reset_trace()
+
+    assert trace_summary["spans"]["project_rasters"]["count"] == 1
+    assert trace_summary["spans"]["project_raster"]["count"] == 2
+    assert trace_summary["counters"]["bytes_written"] > 0
+    assert trace_summary["counters"]["pixels"] > 0
+    assert len(list_process_ids) >= 1 and template.os.getpid() not in list_process_ids
@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import rasterio
+
+from conftest import REPO_FOLDER, gradient_values, template, write_synthetic_raster
+
+IMPORT_CODE = """
+import sys
+sys.modules["gdal"] = None  # Blocks the import of GDAL
+sys.path.insert(0, sys.argv[1])
+import open_source_template_v01 as template
+try:
+    template.gdal.BuildVRT
+except ImportError as error:
+    print("ImportError: " + str(error))
+"""
+
+
+# A queued job is claimed, run and recorded as done in one poll, the caches are cleared after the job
+def test_worker_runs_a_queued_job(tmp_path):
+    queue_folder = str(tmp_path / "queue") + "/"
+    os.makedirs(queue_folder)
+    input_raster = write_synthetic_raster(str(tmp_path / "input.tif"), 300, 200, 2, gradient_values)
+    output_raster = str(tmp_path / "output.tif")
+    with open(queue_folder + "copy.json", "w") as job_file:
+        json.dump({"operation": "copy_raster", "args": [input_raster, output_raster, True],
+                   "outputs": [output_raster]}, job_file)
+
+    cache_max = rasterio.env.get_gdal_config("GDAL_CACHEMAX")
+    assert template.run_worker(queue_folder, max_polls=1) == (1, 0)
+    assert rasterio.env.get_gdal_config("GDAL_CACHEMAX") == cache_max
+
+    assert sorted(os.listdir(queue_folder)) == ["copy.done"]
+    with open(queue_folder + "copy.done") as result_file:
+        job = json.load(result_file)
+    assert job["id"] == "copy" and job["status"] == "done"
+    with rasterio.open(input_raster) as raster_obj, rasterio.open(output_raster) as output_obj:
+        assert np.array_equal(raster_obj.read(), output_obj.read())
+    assert len(template.RASTER_INFO_CACHE) == 0 and len(template.HANDLE_CACHE) == 0
+
+
+# A failed job is recorded with its error, the worker keeps running
+def test_worker_records_a_failed_job(tmp_path):
+    queue_folder = str(tmp_path / "queue") + "/"
+    os.makedirs(queue_folder)
+    with open(queue_folder + "missing.json", "w") as job_file:
+        json.dump({"operation": "copy_raster", "args": [str(tmp_path / "missing.tif"), str(tmp_path / "out.tif"),
+                                                        True], "outputs": [str(tmp_path / "out.tif")]}, job_file)
+
+    assert template.run_worker(queue_folder, max_polls=2) == (0, 1)
+    with open(queue_folder + "missing.failed") as result_file:
+        assert json.load(result_file)["status"] == "failed"
+
+
+# The module can be imported without GDAL, the ImportError is raised once GDAL is used
+def test_import_without_gdal():
+    result = subprocess.run([sys.executable, "-c", IMPORT_CODE, REPO_FOLDER], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.startswith("ImportError: No module named gdal")